@@ -9,6 +9,7 @@ from ptah.contexts import AppContext
 async def lifespan(_app: FastAPI):
     _app.state.ctx = AppContext()
     yield
+    _app.state.ctx.close()
 
 
 app = FastAPI(title="PTAH API", lifespan=lifespan)
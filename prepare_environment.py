@@ -1,72 +1,221 @@
 import argparse
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from shutil import rmtree
 from ptah.env import ENV
-from ptah.models.PtahConfig import PtahConfig, PtahProfile
+from ptah.models.BuilderManifest import BuilderEntry, BuilderManifest
+from ptah.models.PtahConfig import OpenWrtProfile, PtahConfig, PtahProfile
+from ptah.utils.builder_store import (
+    collect_unused_builders,
+    get_builder_manifest_path,
+    get_builder_store_path,
+    load_builder_manifest,
+)
 from ptah.utils.utils import (
     extract_tar_zst,
+    extract_tar_zst_stream,
+    file_sha256,
     load_ptah_config,
     recreate_dir,
-    echo_to_file,
 )
 import requests
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 5
+
+
+class HashingReader:
+    """File-like wrapper hashing the bytes read from a stream."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        while self.read(DOWNLOAD_CHUNK_SIZE):
+            pass
+
 
 class PrepareDockerEnvironment:
     ptah_config: PtahConfig
+    stream: bool
+    jobs: int
 
-    def __init__(self, config: str):
+    def __init__(self, config: str, stream: bool = False, jobs: int = 4):
         config_path = Path(config)
         self.ptah_config = load_ptah_config(config_path)
+        self.stream = stream
+        self.jobs = jobs
 
     # ------------------------------- Helper Functions ------------------------------ #
 
+    def get_target_url(self, openwrt_profile: OpenWrtProfile) -> str:
+        return (
+            f"{ENV.openwrt_base_releases_url}/{openwrt_profile.openwrt_version}"
+            f"/targets/{openwrt_profile.target}/{openwrt_profile.arch}"
+        )
+
+    def fetch_sha256sums(self, target_url: str) -> dict[str, str]:
+        """Fetch the release sha256sums file, as a {filename: sha256} mapping."""
+        response = requests.get(f"{target_url}/sha256sums", timeout=40)
+        response.raise_for_status()
+        checksums = {}
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            checksum, filename = line.split(maxsplit=1)
+            checksums[filename.lstrip("*")] = checksum
+        return checksums
+
+    def download_file(self, url: str, destination: Path):
+        """
+        Download a file, resuming with an HTTP Range request when the transfer
+        is interrupted or a partial file is already present.
+        """
+        for attempt in range(1, DOWNLOAD_ATTEMPTS + 1):
+            offset = destination.stat().st_size if destination.exists() else 0
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                with requests.get(
+                    url, headers=headers, stream=True, timeout=40
+                ) as response:
+                    # The partial file is already complete
+                    if response.status_code == 416:
+                        return
+                    response.raise_for_status()
+                    # 200 means the server ignored the range, start over
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with open(destination, mode, buffering=DOWNLOAD_CHUNK_SIZE) as f:
+                        for chunk in response.iter_content(
+                            chunk_size=DOWNLOAD_CHUNK_SIZE
+                        ):
+                            f.write(chunk)
+                return
+            except (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as exc:
+                if attempt == DOWNLOAD_ATTEMPTS:
+                    raise
+                logging.warning(
+                    "Download of %s interrupted (%s), resuming (%d/%d)",
+                    url,
+                    exc,
+                    attempt,
+                    DOWNLOAD_ATTEMPTS,
+                )
+
     def fetch_openwrt_image_builder(
-        self, profile: PtahProfile, profile_path: Path, tmp_path: Path
-    ):
-        openwrt_version = profile.openwrt_profile.openwrt_version
-        target = profile.openwrt_profile.target
-        arch = profile.openwrt_profile.arch
-        target_url = (
-            f"{ENV.openwrt_base_releases_url}/{openwrt_version}/targets/{target}/{arch}"
+        self, openwrt_profile: OpenWrtProfile, download_path: Path
+    ) -> BuilderEntry:
+        """Download an ImageBuilder and extract it into the builder store."""
+        builder_key = BuilderManifest.builder_key(openwrt_profile)
+        target_url = self.get_target_url(openwrt_profile)
+        archive_name = openwrt_profile.get_imagebuilder_archive_name(
+            ENV.openwrt_builder_file_ext
         )
-        archive_name = f"openwrt-imagebuilder-{openwrt_version}-{target}-{arch}{ENV.openwrt_builder_file_ext}"
         image_builder_url = f"{target_url}/{archive_name}"
 
-        response = requests.get(image_builder_url, stream=True, timeout=40)
-        response.raise_for_status()
+        expected_sha256 = self.fetch_sha256sums(target_url).get(archive_name)
+        if not expected_sha256:
+            raise ValueError(f"{archive_name} is not listed in {target_url}/sha256sums")
+
+        # Extract next to the final location and rename once complete
+        store_path = get_builder_store_path()
+        staging_path = store_path / f".{builder_key}.tmp"
+        recreate_dir(staging_path)
 
-        archive_path = tmp_path / archive_name
-        with open(archive_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        if self.stream:
+            # Decompress straight from the response, the archive never hits the disk
+            with requests.get(image_builder_url, stream=True, timeout=40) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                reader = HashingReader(response.raw)
+                extract_tar_zst_stream(reader, staging_path)
+                reader.drain()
+            actual_sha256 = reader.sha256.hexdigest()
+        else:
+            archive_path = download_path / archive_name
+            self.download_file(image_builder_url, archive_path)
+            actual_sha256 = file_sha256(archive_path)
+            if actual_sha256 == expected_sha256:
+                extract_tar_zst(archive_path, staging_path)
+            archive_path.unlink()
+
+        if actual_sha256 != expected_sha256:
+            rmtree(staging_path)
+            raise ValueError(
+                f"Checksum mismatch for {archive_name}: "
+                f"expected {expected_sha256}, got {actual_sha256}"
+            )
+
+        builder_path = store_path / builder_key
+        if builder_path.exists():
+            rmtree(builder_path)
+        staging_path.rename(builder_path)
 
-        unpack_dir = profile_path
-        unpack_dir.mkdir(parents=True, exist_ok=True)
-        extract_tar_zst(archive_path, unpack_dir)
         # The .stem.stem is used to remove .tar.zst from the archive name
         archive_extracted_path = Path(Path(archive_name).stem).stem
-        echo_to_file(profile_path / "builder_folder", f"{archive_extracted_path}")
+        return BuilderEntry(folder=archive_extracted_path, sha256=actual_sha256)
 
     # ---------------------------------- Main Logic --------------------------------- #
     def main(self):
         for path in [
             ENV.git_repo_path,
-            ENV.builders_path,
             ENV.output_path,
             ENV.gitlab_releases_output_path,
             ENV.routers_files_path,
+            ENV.profile_layers_path,
         ]:
             recreate_dir(path)
+        get_builder_store_path().mkdir(parents=True, exist_ok=True)
 
+        # Profiles sharing the same OpenWrt version, target and arch share a builder
+        manifest = load_builder_manifest()
+        profiles_by_builder: dict[str, list[PtahProfile]] = {}
         for profile in self.ptah_config.ptah_profiles:
-            profile_path = ENV.builders_path / profile.name
-            tmp_path = profile_path / "tmp"
-            for path in [profile_path, tmp_path]:
-                recreate_dir(path)
+            builder_key = BuilderManifest.builder_key(profile.openwrt_profile)
+            profiles_by_builder.setdefault(builder_key, []).append(profile)
+
+        missing_builders = {
+            builder_key: profiles[0].openwrt_profile
+            for builder_key, profiles in profiles_by_builder.items()
+            if builder_key not in manifest.builders
+            or not (
+                get_builder_store_path()
+                / builder_key
+                / manifest.builders[builder_key].folder
+            ).is_dir()
+        }
 
-            self.fetch_openwrt_image_builder(profile, profile_path, tmp_path)
-            rmtree(tmp_path)
+        download_path = ENV.builders_path / ".downloads"
+        recreate_dir(download_path)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {
+                builder_key: executor.submit(
+                    self.fetch_openwrt_image_builder, openwrt_profile, download_path
+                )
+                for builder_key, openwrt_profile in missing_builders.items()
+            }
+            for builder_key, future in futures.items():
+                manifest.builders[builder_key] = future.result()
+        rmtree(download_path)
+
+        # Reference counting: a builder is kept as long as a profile uses it
+        for builder_key, entry in manifest.builders.items():
+            entry.profiles = [
+                profile.name for profile in profiles_by_builder.get(builder_key, [])
+            ]
+        collect_unused_builders(manifest)
+        manifest.save(get_builder_manifest_path())
 
 
 # --------------------------------- Entry Point --------------------------------- #
@@ -75,9 +224,20 @@ if __name__ == "__main__":
     parser.add_argument(
         "--config", required=True, help="Path to Ptah configuration file"
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Extract ImageBuilders while downloading them instead of saving the archives",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of ImageBuilders downloaded at the same time",
+    )
     args = parser.parse_args()
 
     if not args.config:
         raise ValueError("Please provide path to configuration file")
 
-    PrepareDockerEnvironment(args.config).main()
+    PrepareDockerEnvironment(args.config, args.stream, args.jobs).main()
@@ -1,29 +1,41 @@
+import hmac
 import logging
 import os
 from pathlib import Path
-from typing import Annotated
-from fastapi import Depends, HTTPException, status
+from typing import Annotated, cast
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from netaddr import EUI, AddrFormatError, mac_unix_expanded
+from ptah.contexts import AppContext
 from ptah.env import ENV
 from ptah.models.PtahConfig import PtahConfig
-from ptah.utils.K8sVaultTokenProcessing import K8sVaultTokenProcessing
-from ptah.utils.utils import load_ptah_config
-from rezel_vault_jwt.jwt_transit_manager import JwtTransitManager
+from ptah.utils.PtahConfigStore import PtahConfigSnapshot
+from ptah.utils.JwtVerifier import JwtVerification
+from ptah.utils.VaultTokenManager import VaultTokenManager
 from common_models.base import validate_mac
 
 
-def get_config() -> PtahConfig:
-    return load_ptah_config(ENV.config_path)
+async def get_app_context(request: Request) -> AppContext:
+    return cast(AppContext, request.app.state.ctx)
 
 
-def read_secrets(config: Annotated[PtahConfig, Depends(get_config)]) -> dict:
+async def get_config_snapshot(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+) -> PtahConfigSnapshot:
+    return ctx.config_store.snapshot()
+
+
+async def get_config(
+    snapshot: Annotated[PtahConfigSnapshot, Depends(get_config_snapshot)],
+) -> PtahConfig:
+    return snapshot.config
+
+
+def load_secrets(vault_token_manager: VaultTokenManager, config: PtahConfig) -> dict:
     secrets = {}
     for credential in config.credentials.keys():
         if credential == "K8S_VAULT_TOKEN":
-            secrets[credential] = K8sVaultTokenProcessing(
-                ENV.vault_url, ENV.vault_role_name
-            ).get_vault_token()
+            secrets[credential] = vault_token_manager.get_token()
             continue
         if credential not in os.environ:
             raise RuntimeError(
@@ -37,47 +49,67 @@ def read_secrets(config: Annotated[PtahConfig, Depends(get_config)]) -> dict:
     return secrets
 
 
-def verify_jwt(token: str):
-    k8s_token_processing = K8sVaultTokenProcessing(
-        vault_url=ENV.vault_url,
-        vault_role_name=ENV.vault_role_name,
-    )
-    jwt_manager = JwtTransitManager(
-        vault_token=k8s_token_processing.get_vault_token(),
-        vault_base_url=ENV.vault_url,
-        transit_mount=ENV.vault_transit_mount,
-        transit_key=ENV.vault_transit_key,
+async def read_secrets(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    config: Annotated[PtahConfig, Depends(get_config)],
+) -> dict:
+    # Getting the Vault token may need a login
+    return await ctx.work_pools.run(
+        "auth", load_secrets, ctx.vault_token_manager, config
     )
-    is_valid = jwt_manager.verify_jwt(token)
-    if not is_valid:
+
+
+def check_jwt_verification(verification: JwtVerification) -> dict:
+    if not verification.valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    # Decode the JWT token to extract payload
-    payload = JwtTransitManager.decode_jwt(token)
-    return payload
+    return verification.payload
 
 
 # Define a dependency using HTTPBearer
 bearer_scheme = HTTPBearer()
 
 
-def jwt_required(
+async def jwt_required(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(bearer_scheme)],
 ):
     logging.debug("JWT required dependency called.")
-    return verify_jwt(credentials.credentials)
+    # A router presents the same token to prepare and download
+    verification = ctx.jwt_verifier.lookup(credentials.credentials)
+    if verification is None:
+        verification = await ctx.work_pools.run(
+            "auth", ctx.jwt_verifier.verify, credentials.credentials
+        )
+    return check_jwt_verification(verification)
+
+
+async def admin_required(
+    credentials: Annotated[HTTPAuthorizationCredentials, Depends(bearer_scheme)],
+):
+    if not ENV.admin_token:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin API is disabled, set PTAH_ADMIN_TOKEN to enable it",
+        )
+    if not hmac.compare_digest(credentials.credentials, ENV.admin_token):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid admin token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
 
 
-def get_credentials(
+async def get_credentials(
     credentials: Annotated[HTTPAuthorizationCredentials, Depends(bearer_scheme)],
 ):
     return credentials.credentials
 
 
-def check_mac_matches_payload(
+async def check_mac_matches_payload(
     mac: str, payload: Annotated[dict, Depends(jwt_required)]
 ) -> dict:
     mac = validate_mac(mac)
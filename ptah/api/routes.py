@@ -7,5 +7,5 @@ router.include_router(router_v1)
 
 
 @router.get("/")
-def get_root():
+async def get_root():
     return "Welcome to the Ptah API!"
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, Depends
+
+from .cache import router as cache_router
+from .certificates import router as certificates_router
+from .gitlab import router as gitlab_router
+from .vault import router as vault_router
+from ptah.api.dependencies import admin_required
+from ptah.env import ENV
+
+if ENV.deploy_env == "local":
+    router = APIRouter(prefix="/admin", tags=["Admin"])
+else:
+    router = APIRouter(
+        prefix="/admin",
+        tags=["Admin"],
+        dependencies=[Depends(admin_required)],
+    )
+
+router.include_router(vault_router)
+router.include_router(gitlab_router)
+router.include_router(cache_router)
+router.include_router(certificates_router)
@@ -0,0 +1,44 @@
+"""Admin endpoints exposing the disk usage of the caches."""
+
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from ptah.api.dependencies import get_app_context
+from ptah.contexts import AppContext
+
+router = APIRouter(prefix="/cache")
+
+
+@router.get("", summary="Disk usage of the caches")
+async def cache_usage(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns the entries, bytes, budget and evictions of each cache area,
+    and the usage of the build artifact cache.
+    """
+    # Sizing the areas walks their trees
+    areas = await ctx.work_pools.run("disk", ctx.cache_manager.usage)
+    artifacts = await ctx.work_pools.run("disk", ctx.artifact_cache.usage)
+    return JSONResponse(
+        content={
+            "areas": areas,
+            "artifacts": artifacts,
+        },
+        status_code=200,
+    )
+
+
+@router.post("/evict", summary="Evict cache entries over budget now")
+async def cache_evict(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Runs the eviction of every cache area without waiting for the next pass.
+    """
+    return JSONResponse(
+        content={"evicted": await ctx.work_pools.run("disk", ctx.cache_manager.evict)},
+        status_code=200,
+    )
@@ -0,0 +1,63 @@
+"""Admin endpoints managing the pool of pre-issued router certificates."""
+
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+
+from ptah.api.dependencies import get_app_context, get_config, read_secrets
+from ptah.contexts import AppContext
+from ptah.models import PtahConfig
+from ptah.models.build import BatchPrepareRequest
+
+router = APIRouter(prefix="/certificates")
+
+
+@router.get("/pool", summary="Pre-issued certificates metrics")
+async def certificate_pool_stats(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns the pooled, fresh and pending certificates, and the certificates
+    served from the pool or issued inline.
+    """
+    stats = await ctx.work_pools.run("disk", ctx.certificates.stats)
+    return JSONResponse(content=stats, status_code=200)
+
+
+@router.post("/pool", status_code=202, summary="Pre-issue router certificates")
+async def certificate_pool_issue(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    request_data: BatchPrepareRequest,
+    config: Annotated[PtahConfig, Depends(get_config)],
+    secrets: Annotated[dict, Depends(read_secrets)],
+):
+    """
+    Issues in the background the certificates of routers about to be prepared,
+    with the same body as a batch. Certificates already pooled and not close to
+    expiry are skipped.
+    """
+    if not ctx.certificates.enabled:
+        raise HTTPException(
+            status_code=409,
+            detail="The certificate pool is disabled, set CERTIFICATE_POOL_TRANSIT_KEY.",
+        )
+
+    profiles = {profile.name: profile for profile in config.ptah_profiles}
+    macs_by_profile: dict[str, list] = {}
+    for router_request in request_data.routers:
+        if router_request.profile not in profiles:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Profile {router_request.profile} not found.",
+            )
+        macs_by_profile.setdefault(router_request.profile, []).append(
+            router_request.mac
+        )
+
+    queued = 0
+    for profile_name, macs in macs_by_profile.items():
+        queued += await ctx.work_pools.run(
+            "disk", ctx.certificates.issue_ahead, profiles[profile_name], macs, secrets
+        )
+    return JSONResponse(content={"queued": queued}, status_code=202)
@@ -0,0 +1,39 @@
+"""Admin endpoints managing the GitLab metadata cache."""
+
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from ptah.api.dependencies import get_app_context
+from ptah.contexts import AppContext
+
+router = APIRouter(prefix="/gitlab")
+
+
+@router.get("/metadata", summary="GitLab metadata cache metrics")
+async def gitlab_metadata_stats(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns the size, hits, misses and ETag revalidations of the metadata cache.
+    """
+    return JSONResponse(
+        content=ctx.gitlab_metadata.stats(),
+        status_code=200,
+    )
+
+
+@router.delete("/metadata", summary="Invalidate the GitLab metadata cache")
+async def gitlab_metadata_invalidate(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    url_prefix: Optional[str] = None,
+):
+    """
+    Drops cached metadata, only for URLs starting with `url_prefix` if given,
+    so that the next prepare sees a release published upstream right away.
+    """
+    return JSONResponse(
+        content={"invalidated": ctx.gitlab_metadata.invalidate(url_prefix)},
+        status_code=200,
+    )
@@ -0,0 +1,72 @@
+"""Admin endpoints exposing the state of the Vault token, JWT and KV secret caches."""
+
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+
+from ptah.api.dependencies import get_app_context
+from ptah.contexts import AppContext
+
+router = APIRouter(prefix="/vault")
+
+
+@router.get("/token", summary="Vault token cache metrics")
+async def vault_token_stats(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns cache hits, logins and renewals of the process-wide Vault token.
+    """
+    return JSONResponse(
+        content=ctx.vault_token_manager.stats(),
+        status_code=200,
+    )
+
+
+@router.get("/jwt", summary="Router JWT verification cache metrics")
+async def jwt_verification_stats(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns the size of the verification cache, its hits and the tokens
+    verified locally or by Vault.
+    """
+    return JSONResponse(
+        content=ctx.jwt_verifier.stats(),
+        status_code=200,
+    )
+
+
+@router.get("/kv", summary="KV secret cache metrics")
+async def kv_secrets_stats(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+):
+    """
+    Returns the cached secrets (mount, path and version, never the values),
+    hits, reads and metadata version checks.
+    """
+    return JSONResponse(
+        content=ctx.kv_secrets.stats(),
+        status_code=200,
+    )
+
+
+@router.post("/kv/refresh", summary="Force a refresh of cached KV secrets")
+async def kv_secrets_refresh(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    mount: Optional[str] = None,
+    path: Optional[str] = None,
+):
+    """
+    Drops cached secrets, only those of `mount` and `path` if given, so that the
+    next prepare reads a rotated secret right away.
+    """
+    # Waits for the reads in flight of those secrets
+    invalidated = await ctx.work_pools.run(
+        "auth", ctx.kv_secrets.invalidate, mount, path
+    )
+    return JSONResponse(
+        content={"invalidated": invalidated},
+        status_code=200,
+    )
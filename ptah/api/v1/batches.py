@@ -0,0 +1,206 @@
+import logging
+import threading
+from concurrent.futures import Future, wait
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+
+from ptah.api.dependencies import (
+    admin_required,
+    get_app_context,
+    get_config_snapshot,
+    read_secrets,
+)
+from ptah.api.v1.build import binary_file_response, check_profile_exists
+from ptah.contexts import AppContext
+from ptah.env import ENV
+from ptah.models import (
+    BatchRouter,
+    BatchRouterState,
+    BuildBatch,
+    BuildJobState,
+    PortableMac,
+)
+from ptah.models.build import BatchPrepareRequest
+from ptah.utils.PtahConfigStore import PtahConfigSnapshot
+from ptah.utils.prepare_router import (
+    new_build_context,
+    prepare_router,
+    resolve_shared_files,
+)
+
+# Batches act on many routers at once, they are an operator API
+if ENV.deploy_env == "local":
+    router = APIRouter(prefix="/batches", tags=["Batches"])
+else:
+    router = APIRouter(
+        prefix="/batches",
+        tags=["Batches"],
+        dependencies=[Depends(admin_required)],
+    )
+
+
+def prepare_batch_router(
+    ctx: AppContext,
+    batch_router: BatchRouter,
+    shared,
+    secrets: dict,
+    config_generation: int,
+):
+    batch_router.state = BatchRouterState.PREPARING
+    try:
+        build_context = new_build_context(
+            ctx, batch_router.mac, shared.profile, secrets, config_generation
+        )
+        prepare_router(ctx, build_context, shared)
+        batch_router.state = BatchRouterState.PREPARED
+        batch_router.job = ctx.build_scheduler.submit(build_context)
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.exception("Failed to prepare %s", batch_router.mac)
+        batch_router.fail(str(exc))
+
+
+def process_batch(
+    ctx: AppContext,
+    config_snapshot: PtahConfigSnapshot,
+    secrets: dict,
+    batch: BuildBatch,
+):
+    """
+    Resolve the shared files once per profile, then prepare the routers in
+    parallel and hand their builds to the scheduler as soon as they are ready.
+    The prepares run on the "prepare" work pool, like those of the API, and at
+    most BATCH_PREPARE_CONCURRENCY of a batch are queued there at once so that
+    API prepares are not stuck behind a large batch.
+    """
+    routers_by_profile: dict[str, list[BatchRouter]] = {}
+    for batch_router in batch.routers.values():
+        routers_by_profile.setdefault(batch_router.profile_name, []).append(
+            batch_router
+        )
+
+    slots = threading.BoundedSemaphore(max(ENV.batch_prepare_concurrency, 1))
+    futures: list[Future] = []
+
+    def submit_prepare(*args):
+        slots.acquire()
+        future = ctx.work_pools.submit("prepare", prepare_batch_router, *args)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+
+    try:
+        for profile_name, batch_routers in routers_by_profile.items():
+            profile = check_profile_exists(profile_name, config_snapshot.config)
+            if profile is None:
+                for batch_router in batch_routers:
+                    batch_router.fail(f"Profile {profile_name} not found.")
+                continue
+
+            shared = new_build_context(
+                ctx,
+                batch_routers[0].mac,
+                profile,
+                secrets,
+                config_snapshot.generation,
+            )
+            try:
+                ctx.work_pools.submit(
+                    "prepare", resolve_shared_files, ctx, shared
+                ).result()
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.exception("Failed to resolve shared files of %s", profile_name)
+                for batch_router in batch_routers:
+                    batch_router.fail(str(exc))
+                continue
+
+            for batch_router in batch_routers:
+                submit_prepare(
+                    ctx,
+                    batch_router,
+                    shared,
+                    secrets,
+                    config_snapshot.generation,
+                )
+    finally:
+        wait(futures)
+
+
+def get_batch(ctx: AppContext, batch_id: str) -> BuildBatch:
+    batch = ctx.batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Batch {batch_id} not found.",
+        )
+    return batch
+
+
+@router.post("", status_code=202)
+async def submit_batch_endpoint(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    request_data: BatchPrepareRequest,
+    config_snapshot: Annotated[PtahConfigSnapshot, Depends(get_config_snapshot)],
+    secrets: Annotated[dict, Depends(read_secrets)],
+):
+    """
+    Prepare and build a list of routers, of one or several profiles.
+    Poll the batch for the progress of each router.
+    """
+    batch = BuildBatch(
+        [
+            BatchRouter(router_request.mac, router_request.profile)
+            for router_request in request_data.routers
+        ]
+    )
+    ctx.batches.submit(
+        batch,
+        lambda submitted: process_batch(ctx, config_snapshot, secrets, submitted),
+    )
+
+    return JSONResponse(
+        content={
+            **batch.to_dict(),
+            "status_url": f"/batches/{batch.batch_id}",
+        },
+        status_code=202,
+    )
+
+
+@router.get("/{batch_id}")
+async def batch_status_endpoint(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    batch_id: str,
+):
+    batch = get_batch(ctx, batch_id)
+    return JSONResponse(content=batch.to_dict(), status_code=200)
+
+
+@router.get("/{batch_id}/routers/{mac}/artifact")
+async def batch_router_artifact_endpoint(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
+    batch_id: str,
+    mac: PortableMac,
+):
+    batch = get_batch(ctx, batch_id)
+    batch_router = batch.routers.get(mac)
+    if batch_router is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"{mac} is not part of batch {batch_id}.",
+        )
+    job = batch_router.job
+    if batch_router.state == BatchRouterState.FAILED or (
+        job is not None and job.state == BuildJobState.FAILED
+    ):
+        raise HTTPException(
+            status_code=500,
+            detail=f"Build of {mac} failed: {batch_router.to_dict()['error']}",
+        )
+    if job is None or job.state != BuildJobState.DONE:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Build of {mac} is {batch_router.progress}.",
+        )
+
+    return binary_file_response(job.artifact_path)
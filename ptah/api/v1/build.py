@@ -1,21 +1,27 @@
+import json
 from pathlib import Path
-import subprocess
-from typing import Annotated, cast
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import FileResponse, JSONResponse
+import asyncio
+from typing import Annotated, AsyncIterator, Optional, cast
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 
 from ptah.models.build import BuildPrepareRequest
 from ptah.models import PtahConfig, PtahProfile
 from ptah.contexts import BuildContext, AppContext
-from ptah.models import RouterFilesOrganizer
 from ptah.models import PortableMac
-from ptah.models import Versions
-from ptah.utils.handle_router_specific_files import RouterSpecificFilesHandler
-from ptah.utils.handle_shared_files import SharedFilesHandler
-from ptah.utils.utils import recreate_dir
-from ptah.api.dependencies import check_mac_matches_payload, get_config, read_secrets
+from ptah.models import BuildJob, BuildJobState
+from ptah.utils.prepare_router import new_build_context, prepare_router
+from ptah.utils.PtahConfigStore import PtahConfigSnapshot
+from ptah.api.dependencies import (
+    check_mac_matches_payload,
+    get_config_snapshot,
+    read_secrets,
+)
 from ptah.env import ENV
 
+# Seconds between keep-alive comments on idle event streams
+EVENTS_HEARTBEAT = 15
+
 if ENV.deploy_env in ("local"):
     router = APIRouter(prefix="/build", tags=["Build"])
 else:
@@ -33,87 +39,76 @@ def check_profile_exists(profile: str, config: PtahConfig) -> PtahProfile:
     return None
 
 
-def run_make_build(profile: PtahProfile, mac: str) -> bool:
-    packages = " ".join(profile.packages) if profile.packages else ""
-    make_image_cmd = [
-        "make",
-        "image",
-        f"PROFILE={profile.openwrt_profile.name}",
-        f"PACKAGES={packages}",
-        f"EXTRA_IMAGE_NAME=ptah-{mac}",
-        f"BIN_DIR={ENV.output_path / mac}",
-        f"FILES={ENV.routers_files_path / mac}",
-    ]
-
-    profile_path = ENV.builders_path / profile.name
-    with open(profile_path / "builder_folder", encoding="utf-8") as f:
-        builder_name = f.readline().strip("\n")
-    builder_path = profile_path / builder_name
-
-    recreate_dir(ENV.output_path / mac)
-
-    try:
-        subprocess.run(make_image_cmd, check=True, cwd=builder_path)
-    except subprocess.CalledProcessError as exc:
+def get_build_context(ctx: AppContext, mac: PortableMac) -> BuildContext:
+    build_context = ctx.build_contexts.get(mac)
+    if build_context is None:
         raise HTTPException(
-            status_code=500,
-            detail="Build failed.",
-        ) from exc
+            status_code=404,
+            detail=f"Build context for {mac} not found. Please prepare the build first.",
+        )
+    return build_context
+
 
-    return True
+def get_mac_job(ctx: AppContext, mac: PortableMac, job_id: str) -> BuildJob:
+    job = ctx.build_scheduler.get_job(job_id)
+    if job is None or job.mac != mac:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Build job {job_id} not found for {mac}.",
+        )
+    return job
+
+
+def binary_file_response(binary_path: Path) -> FileResponse:
+    if not binary_path.exists():
+        raise HTTPException(
+            status_code=404,
+            detail="File not found",
+        )
+    download_binary_name = "ptah.bin"
+    return FileResponse(
+        path=binary_path,
+        filename=download_binary_name,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f"attachment; filename={download_binary_name}",
+        },
+    )
 
 
 @router.post("/prepare/{mac}")
-def build_endpoint(
+async def build_endpoint(
     request: Request,
     mac: PortableMac,
     request_data: BuildPrepareRequest,
-    config: Annotated[PtahConfig, Depends(get_config)],
+    config_snapshot: Annotated[PtahConfigSnapshot, Depends(get_config_snapshot)],
     secrets: Annotated[dict, Depends(read_secrets)],
 ):
     ctx = cast(AppContext, request.app.state.ctx)
-    build_contexts = ctx.build_contexts
     if not ctx:
         raise HTTPException(
             status_code=500,
             detail="Application context not initialized.",
         )
 
-    mac_fc = mac.to_filename_compliant()
+    config = config_snapshot.config
     if (ptah_profile := check_profile_exists(request_data.profile, config)) is None:
         return HTTPException(
             status_code=404,
             detail=f"Profile {request_data.profile} not found.",
         )
 
-    router_files = RouterFilesOrganizer(
-        mac=mac,
-    )
-
-    build_context = BuildContext(
-        mac=mac,
-        profile=ptah_profile,
-        secrets=secrets,
-        versions=Versions(ptah_profile),
-        router_files=router_files,
+    build_context = new_build_context(
+        ctx, mac, ptah_profile, secrets, config_snapshot.generation
     )
-    build_contexts[mac] = build_context
-
-    files_dest_path = Path(ENV.routers_files_path / mac_fc)
-    recreate_dir(files_dest_path)
-    sfh = SharedFilesHandler(build_context)
-
-    hrsf = RouterSpecificFilesHandler(build_context)
-    sfh.handle_shared_files()
-    hrsf.handle_router_specific_files()
-
-    router_files.merge_files_to_router_files()
+    await ctx.work_pools.run("prepare", prepare_router, ctx, build_context)
 
     return JSONResponse(
         content={
             "message": "Build prepared successfully.",
             "mac": mac,
             "ptah_version_hash": build_context.final_version,
+            "config_generation": build_context.config_generation,
             "download_url": f"/build/{mac}",
         },
         status_code=200,
@@ -121,7 +116,7 @@ def build_endpoint(
 
 
 @router.post("/{mac}")
-def download_build_endpoint(
+async def download_build_endpoint(
     request: Request,
     mac: PortableMac,
 ):
@@ -131,41 +126,139 @@ def download_build_endpoint(
             status_code=500,
             detail="Application context not initialized.",
         )
-    if mac not in ctx.build_contexts:
-        return HTTPException(
-            status_code=404,
-            detail=f"Build context for {mac} not found. Please prepare the build first.",
+    build_context = await ctx.work_pools.run("disk", get_build_context, ctx, mac)
+
+    # Builds go through the scheduler so that they count against its limits
+    job = await ctx.work_pools.run("disk", ctx.build_scheduler.submit, build_context)
+    await job.wait_async()
+    if job.state != BuildJobState.DONE:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Build failed: {job.error}",
         )
-    build_context = ctx.build_contexts[mac]
-    mac_fc = mac.to_filename_compliant()
 
-    run_make_build(
-        build_context.profile,
-        mac_fc,
-    )
+    return binary_file_response(job.artifact_path)
 
-    binary_name = build_context.profile.openwrt_profile.get_generated_binary_name(
-        mac_fc
+
+@router.post("/{mac}/jobs", status_code=202)
+async def submit_build_job_endpoint(
+    request: Request,
+    mac: PortableMac,
+):
+    """
+    Queue the build of a prepared router and return immediately.
+    Poll the job until it is done, then download its artifact.
+    """
+    ctx = cast(AppContext, request.app.state.ctx)
+    build_context = await ctx.work_pools.run("disk", get_build_context, ctx, mac)
+    job = await ctx.work_pools.run("disk", ctx.build_scheduler.submit, build_context)
+
+    return JSONResponse(
+        content={
+            **job.to_dict(),
+            "status_url": f"/build/{mac}/jobs/{job.job_id}",
+            "artifact_url": f"/build/{mac}/jobs/{job.job_id}/artifact",
+            "events_url": f"/build/{mac}/jobs/{job.job_id}/events",
+            "log_url": f"/build/{mac}/jobs/{job.job_id}/log",
+        },
+        status_code=202,
     )
-    binary_path = ENV.output_path / mac_fc / binary_name
 
-    if not binary_path.exists():
-        return HTTPException(
+
+@router.get("/{mac}/jobs/{job_id}")
+async def build_job_status_endpoint(
+    request: Request,
+    mac: PortableMac,
+    job_id: str,
+):
+    ctx = cast(AppContext, request.app.state.ctx)
+    job = get_mac_job(ctx, mac, job_id)
+    return JSONResponse(content=job.to_dict(), status_code=200)
+
+
+@router.get("/{mac}/jobs/{job_id}/artifact")
+async def build_job_artifact_endpoint(
+    request: Request,
+    mac: PortableMac,
+    job_id: str,
+):
+    ctx = cast(AppContext, request.app.state.ctx)
+    job = get_mac_job(ctx, mac, job_id)
+    if job.state == BuildJobState.FAILED:
+        raise HTTPException(
             status_code=500,
-            detail="Build failed.",
+            detail=f"Build failed: {job.error}",
+        )
+    if job.state != BuildJobState.DONE:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Build job {job_id} is {job.state.value}.",
         )
 
-    if not binary_path.exists():
+    return binary_file_response(job.artifact_path)
+
+
+async def build_job_events(job: BuildJob, last_event_id: int) -> AsyncIterator[str]:
+    """Server-sent events of a job, until it is finished."""
+    # Awaited across heartbeats until it resolves, wrapped once
+    changed: Optional[asyncio.Future] = None
+    while True:
+        events, closed = job.log.events_after(last_event_id)
+        if not events:
+            if closed:
+                return
+            if changed is None:
+                changed = asyncio.wrap_future(job.log.changed(last_event_id))
+            _, pending = await asyncio.wait({changed}, timeout=EVENTS_HEARTBEAT)
+            if pending:
+                # Keeps idle connections open through proxies
+                yield ": keep-alive\n\n"
+            else:
+                changed = None
+            continue
+        for event in events:
+            last_event_id = event.event_id
+            yield (
+                f"id: {event.event_id}\n"
+                f"event: {event.kind}\n"
+                f"data: {json.dumps(event.data)}\n\n"
+            )
+
+
+@router.get("/{mac}/jobs/{job_id}/events")
+async def build_job_events_endpoint(
+    request: Request,
+    mac: PortableMac,
+    job_id: str,
+    last_event_id: Annotated[Optional[int], Header()] = None,
+):
+    """
+    Follow a build job: `state` events, `phase` events (packages, rootfs,
+    squashfs, sysupgrade) and the `log` lines of `make image`. A reconnecting
+    client resumes after its Last-Event-ID.
+    """
+    ctx = cast(AppContext, request.app.state.ctx)
+    job = get_mac_job(ctx, mac, job_id)
+
+    return StreamingResponse(
+        build_job_events(job, last_event_id or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/{mac}/jobs/{job_id}/log")
+async def build_job_log_endpoint(
+    request: Request,
+    mac: PortableMac,
+    job_id: str,
+):
+    ctx = cast(AppContext, request.app.state.ctx)
+    job = get_mac_job(ctx, mac, job_id)
+    if job.log_path is None or not job.log_path.is_file():
         raise HTTPException(
             status_code=404,
-            detail="File not found",
+            detail=f"No build log for job {job_id}.",
         )
-    download_binary_name = "ptah.bin"
-    return FileResponse(
-        path=binary_path,
-        filename=download_binary_name,
-        media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename={download_binary_name}",
-        },
-    )
+
+    return FileResponse(path=job.log_path, media_type="text/plain")
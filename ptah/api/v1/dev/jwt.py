@@ -13,7 +13,8 @@ from rezel_vault_jwt.jwt_payload_builder import JwtPayloadBuilder
 from ptah.env import ENV
 from ptah.models.build import BuildPrepareRequest
 from ptah.models import PtahConfig, PtahProfile, PortableMac
-from ptah.api.dependencies import get_config, read_secrets
+from ptah.api.dependencies import get_app_context, get_config, read_secrets
+from ptah.contexts import AppContext
 
 router = APIRouter(
     prefix="/jwt",
@@ -80,8 +81,23 @@ def get_jwt_manager(
     )
 
 
+def issue_jwt(profile_name: str, config: PtahConfig, secrets: dict, mac: str) -> str:
+    jwt_manager = get_jwt_manager(profile_name, config, secrets)
+    jwt_payload_builder = JwtPayloadBuilder()
+    payload = jwt_payload_builder.create_ptah_payload(mac=mac)
+    return jwt_manager.issue_jwt(payload)
+
+
+def verify_profile_jwt(
+    profile_name: str, config: PtahConfig, secrets: dict, token: str
+) -> bool:
+    jwt_manager = get_jwt_manager(profile_name, config, secrets)
+    return jwt_manager.verify_jwt(token)
+
+
 @router.post("/encode/{mac}", summary="Issue a new JWT")
-def jwt_encode(
+async def jwt_encode(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
     mac: PortableMac,
     request_data: BuildPrepareRequest,
     config: Annotated[PtahConfig, Depends(get_config)],
@@ -92,15 +108,11 @@ def jwt_encode(
     The profile specified in the request body must contain a 'jwt_from_vault_transit' config.
     """
     try:
-        jwt_manager = get_jwt_manager(request_data.profile, config, secrets)
+        encoded_jwt = await ctx.work_pools.run(
+            "auth", issue_jwt, request_data.profile, config, secrets, mac
+        )
     except HTTPException as e:
         raise e
-
-    jwt_payload_builder = JwtPayloadBuilder()
-    payload = jwt_payload_builder.create_ptah_payload(mac=mac)
-
-    try:
-        encoded_jwt = jwt_manager.issue_jwt(payload)
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -118,7 +130,7 @@ def jwt_encode(
 
 
 @router.post("/decode", summary="Decode a JWT payload (no signature verification)")
-def jwt_decode(
+async def jwt_decode(
     payload: JwtPayload,
 ):
     """
@@ -136,7 +148,8 @@ def jwt_decode(
 
 
 @router.post("/verify", summary="Verify a JWT signature from Authorization header")
-def jwt_verify(
+async def jwt_verify(
+    ctx: Annotated[AppContext, Depends(get_app_context)],
     token: Annotated[HTTPAuthorizationCredentials, Security(bearer_scheme)],
     profile: Annotated[
         str, Query(description="The profile name used to issue the JWT.")
@@ -149,8 +162,9 @@ def jwt_verify(
     The JWT must be passed in the 'Authorization: Bearer <token>' header.
     """
     try:
-        jwt_manager = get_jwt_manager(profile, config, secrets)
-        is_valid = jwt_manager.verify_jwt(token.credentials)
+        is_valid = await ctx.work_pools.run(
+            "auth", verify_profile_jwt, profile, config, secrets, token.credentials
+        )
 
         if is_valid:
             return JSONResponse(
@@ -9,7 +9,7 @@ router = APIRouter(prefix="/ptah_profiles", tags=["Ptah Profiles"])
 
 
 @router.get("/")
-def build_endpoint(
+async def build_endpoint(
     config: Annotated[PtahConfig, Depends(get_config)],
 ):
     return JSONResponse(
@@ -19,7 +19,7 @@ def build_endpoint(
 
 
 @router.get("/names")
-def list_profiles(
+async def list_profiles(
     config: Annotated[PtahConfig, Depends(get_config)],
 ):
     """
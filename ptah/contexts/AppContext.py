@@ -1,8 +1,165 @@
-from typing import Dict
+from typing import Optional
 from ptah.contexts import BuildContext
-from ptah.models import PortableMac
+from ptah.env import ENV
+from ptah.models import PortableMac, RouterFilesOrganizer, Versions
+from ptah.utils.ArtifactCache import ArtifactCache
+from ptah.utils.BatchManager import BatchManager
+from ptah.utils.BuildContextStore import BuildContextStore
+from ptah.utils.BuilderSlotPool import BuilderSlotPool
+from ptah.utils.BuildScheduler import BuildScheduler
+from ptah.utils.CacheManager import CacheArea, CacheManager
+from ptah.utils.CertificatePool import CertificatePool
+from ptah.utils.DownloadCache import COMPLETE_MARKER, DownloadCache
+from ptah.utils.GitlabMetadataCache import GitlabMetadataCache
+from ptah.utils.HttpSessionPool import HttpSessionPool
+from ptah.utils.JwtVerifier import JwtVerifier
+from ptah.utils.K8sVaultTokenProcessing import K8sVaultTokenProcessing
+from ptah.utils.KvSecretCache import KvSecretCache
+from ptah.utils.ProfileLayerStore import ProfileLayerStore
+from ptah.utils.PtahConfigStore import PtahConfigStore
+from ptah.utils.VaultLimiter import VaultLimiter
+from ptah.utils.VaultTokenManager import VaultTokenManager
+from ptah.utils.WorkPools import WorkPools
 
 
 class AppContext:
     def __init__(self):
-        self.build_contexts: Dict[PortableMac, BuildContext] = {}
+        self.config_store = PtahConfigStore(ENV.config_path, ENV.config_reload_interval)
+        self.artifact_cache = ArtifactCache(
+            ENV.artifact_cache_path,
+            ENV.artifact_cache_max_bytes,
+            ENV.artifact_cache_max_age,
+        )
+        self.cache_manager = CacheManager(
+            ENV.cache_eviction_grace, ENV.cache_eviction_interval
+        )
+        for area in (
+            CacheArea(
+                "gitlab_releases",
+                ENV.gitlab_releases_output_path,
+                ENV.gitlab_releases_max_bytes,
+                COMPLETE_MARKER,
+            ),
+            CacheArea(
+                "routers_files", ENV.routers_files_path, ENV.routers_files_max_bytes
+            ),
+            CacheArea("output", ENV.output_path, ENV.output_max_bytes),
+        ):
+            self.cache_manager.add_area(area)
+        self.cache_manager.start()
+        self.profile_layers = ProfileLayerStore(
+            ENV.profile_layers_path, ENV.profile_layers_keep
+        )
+        self.build_scheduler = BuildScheduler(
+            self.artifact_cache,
+            BuilderSlotPool(ENV.builder_slots_path, ENV.build_slots_per_builder),
+            max_workers=ENV.build_workers,
+            max_per_profile=ENV.build_workers_per_profile,
+            job_retention=ENV.build_job_retention,
+            cache_manager=self.cache_manager,
+        )
+        self.work_pools = WorkPools(
+            {
+                "auth": ENV.auth_workers,
+                "prepare": ENV.prepare_workers,
+                "disk": ENV.disk_workers,
+            }
+        )
+        self.batches = BatchManager(ENV.batch_workers, ENV.build_job_retention)
+        self.http = HttpSessionPool(
+            pool_maxsize=ENV.http_pool_maxsize,
+            retries=ENV.http_retries,
+            backoff_factor=ENV.http_retry_backoff,
+        )
+        self.gitlab_metadata = GitlabMetadataCache(
+            self.http, ENV.gitlab_metadata_ttl, ENV.gitlab_metadata_max_entries
+        )
+        self.download_cache = DownloadCache(
+            ENV.gitlab_releases_output_path,
+            ENV.download_cache_scrub_interval,
+            on_corrupt=self.profile_layers.invalidate_source,
+        )
+        self.download_cache.start_scrubber()
+        self.vault_token_manager = VaultTokenManager(
+            K8sVaultTokenProcessing(ENV.vault_url, ENV.vault_role_name, self.http)
+        )
+        self.vault_limiter = VaultLimiter(ENV.vault_concurrency)
+        self.kv_secrets = KvSecretCache(
+            self.http, ENV.vault_url, ENV.kv_secret_cache_ttl, self.vault_limiter
+        )
+        self.certificates = CertificatePool(
+            ENV.certificate_pool_path,
+            self.http,
+            ENV.vault_url,
+            ENV.vault_transit_mount,
+            ENV.certificate_pool_transit_key,
+            renew_before=ENV.certificate_pool_renew_before,
+            max_workers=ENV.certificate_pool_workers,
+            vault_limiter=self.vault_limiter,
+            vault_token_manager=self.vault_token_manager,
+        )
+        self.jwt_verifier = JwtVerifier(
+            self.vault_token_manager,
+            self.http,
+            ENV.vault_url,
+            ENV.vault_transit_mount,
+            ENV.vault_transit_key,
+            ttl=ENV.jwt_cache_ttl,
+            negative_ttl=ENV.jwt_negative_cache_ttl,
+            max_entries=ENV.jwt_cache_max_entries,
+            local=ENV.jwt_local_verification,
+        )
+        self.build_contexts = BuildContextStore(
+            ENV.build_context_ttl,
+            ENV.build_context_max_entries,
+            ENV.build_context_db_path,
+            cache_manager=self.cache_manager,
+            restore=self.restore_build_context,
+        )
+        # Expired contexts hold secrets on disk, they go even without traffic
+        self.cache_manager.add_cleanup(self.build_contexts.expire)
+
+    def restore_build_context(self, record: dict) -> Optional[BuildContext]:
+        """Rebuild a persisted build context, None if it cannot be built anymore."""
+        config = self.config_store.snapshot().config
+        profile = next(
+            (p for p in config.ptah_profiles if p.name == record["profile_name"]),
+            None,
+        )
+        if profile is None:
+            return None
+        versions = Versions(profile)
+        # The first version is the hash of the profile, which must not have changed
+        if versions._versions[0] != record["versions"][0]:
+            return None
+        mac = PortableMac.validate(record["mac"])
+        if not (ENV.routers_files_path / mac.to_filename_compliant()).is_dir():
+            return None
+
+        versions._versions = list(record["versions"])
+        build_context = BuildContext(
+            mac=mac,
+            profile=profile,
+            # Secrets are only needed to prepare, they are never persisted
+            secrets={},
+            versions=versions,
+            router_files=RouterFilesOrganizer(mac),
+            config_generation=record["config_generation"],
+            http=self.http,
+            gitlab_metadata=self.gitlab_metadata,
+            download_cache=self.download_cache,
+        )
+        build_context.final_version = record["final_version"]
+        return build_context
+
+    def close(self):
+        self.work_pools.shutdown()
+        self.batches.shutdown()
+        self.certificates.shutdown()
+        self.build_scheduler.shutdown()
+        self.download_cache.stop()
+        self.cache_manager.stop()
+        self.build_contexts.close()
+        self.kv_secrets.close()
+        self.vault_token_manager.stop()
+        self.http.close()
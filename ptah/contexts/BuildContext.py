@@ -2,6 +2,9 @@ from ptah.models.PtahConfig import PtahProfile
 from ptah.models import RouterFilesOrganizer
 from ptah.models import PortableMac
 from ptah.models import Versions
+from ptah.utils.DownloadCache import DownloadCache
+from ptah.utils.GitlabMetadataCache import GitlabMetadataCache
+from ptah.utils.HttpSessionPool import HttpSessionPool
 
 
 class BuildContext:
@@ -11,6 +14,10 @@ class BuildContext:
     secrets: dict
     router_files: RouterFilesOrganizer
     final_version: str
+    config_generation: int
+    http: HttpSessionPool
+    gitlab_metadata: GitlabMetadataCache
+    download_cache: DownloadCache
 
     def __init__(
         self,
@@ -19,9 +26,17 @@ class BuildContext:
         secrets: dict,
         versions: Versions,
         router_files: RouterFilesOrganizer,
+        config_generation: int,
+        http: HttpSessionPool,
+        gitlab_metadata: GitlabMetadataCache,
+        download_cache: DownloadCache,
     ):
         self.mac = mac
         self.profile = profile
         self.secrets = secrets
         self.versions = versions
         self.router_files = router_files
+        self.config_generation = config_generation
+        self.http = http
+        self.gitlab_metadata = gitlab_metadata
+        self.download_cache = download_cache
@@ -51,20 +51,67 @@ class Env:  # pylint: disable=too-many-instance-attributes
     deploy_env: str
 
     config_path: Path
+    config_reload_interval: float
 
     openwrt_base_releases_url: HttpUrl
     openwrt_builder_file_ext: str
     git_repo_path: Path
     builders_path: Path
+    builder_slots_path: Path
     routers_files_path: Path
     output_path: Path
     gitlab_releases_output_path: Path
+    download_cache_scrub_interval: float
+    gitlab_releases_max_bytes: int
+    routers_files_max_bytes: int
+    output_max_bytes: int
+    cache_eviction_grace: float
+    cache_eviction_interval: float
     router_temporary_path: Path
+    router_files_assembly_mode: str
+    profile_layers_path: Path
+    profile_layers_keep: int
+    artifact_cache_path: Path
+    artifact_cache_max_bytes: int
+    artifact_cache_max_age: float
+    shared_files_concurrency: int
+    build_workers: int
+    build_workers_per_profile: int
+    build_slots_per_builder: int
+    build_job_retention: float
+    batch_workers: int
+    auth_workers: int
+    prepare_workers: int
+    disk_workers: int
+    batch_prepare_concurrency: int
+    build_context_ttl: float
+    build_context_max_entries: int
+    build_context_db_path: Path | None
 
     vault_url: HttpUrl
     vault_role_name: str
     vault_transit_mount: str
     vault_transit_key: str
+    vault_concurrency: int
+    kv_secret_cache_ttl: float
+    certificate_pool_path: Path
+    certificate_pool_transit_key: str | None
+    certificate_pool_renew_before: float
+    certificate_pool_workers: int
+
+    admin_token: str | None
+
+    jwt_cache_ttl: float
+    jwt_negative_cache_ttl: float
+    jwt_cache_max_entries: int
+    jwt_local_verification: bool
+
+    http_pool_maxsize: int
+    http_retries: int
+    http_retry_backoff: float
+
+    gitlab_metadata_ttl: float
+    gitlab_metadata_max_entries: int
 
     def __init__(self) -> None:
         """Load all variables."""
@@ -81,6 +128,9 @@ class Env:  # pylint: disable=too-many-instance-attributes
         self.config_path = Path(
             get_or_default("PTAH_CONFIG_PATH", "/opt/ptah_config.yaml")
         )
+        self.config_reload_interval = float(
+            get_or_default("PTAH_CONFIG_RELOAD_INTERVAL", "5")
+        )
 
         self.openwrt_base_releases_url = HttpUrl(
             get_or_default(
@@ -94,6 +144,9 @@ class Env:  # pylint: disable=too-many-instance-attributes
 
         self.git_repo_path = Path(get_or_default("GIT_REPO_PATH", "/opt/git"))
         self.builders_path = Path(get_or_default("BUILDERS_PATH", "/opt/builders"))
+        self.builder_slots_path = Path(
+            get_or_default("BUILDER_SLOTS_PATH", "/opt/builder_slots")
+        )
         self.routers_files_path = Path(
             get_or_default("ROUTERS_FILES_PATH", "/opt/routers_files")
         )
@@ -101,14 +154,118 @@ class Env:  # pylint: disable=too-many-instance-attributes
         self.gitlab_releases_output_path = Path(
             get_or_default("GITLAB_RELEASES_OUTPUT_PATH", "/opt/gitlab_releases")
         )
+        # 0 disables the background verification of cached downloads
+        self.download_cache_scrub_interval = float(
+            get_or_default("DOWNLOAD_CACHE_SCRUB_INTERVAL", "86400")
+        )
+        # Byte budgets of the cache areas, 0 means unlimited
+        self.gitlab_releases_max_bytes = int(
+            get_or_default("GITLAB_RELEASES_MAX_BYTES", str(10 * 1024**3))
+        )
+        self.routers_files_max_bytes = int(
+            get_or_default("ROUTERS_FILES_MAX_BYTES", str(2 * 1024**3))
+        )
+        self.output_max_bytes = int(
+            get_or_default("OUTPUT_MAX_BYTES", str(4 * 1024**3))
+        )
+        self.cache_eviction_grace = float(get_or_default("CACHE_EVICTION_GRACE", "600"))
+        self.cache_eviction_interval = float(
+            get_or_default("CACHE_EVICTION_INTERVAL", "300")
+        )
         self.router_temporary_path = Path(
             get_or_default("ROUTER_TEMPORARY_PATH", "/opt/temporary")
         )
+        # "link" hardlinks unchanged cached files into the router overlay, "copy" copies them
+        self.router_files_assembly_mode = get_or_default(
+            "ROUTER_FILES_ASSEMBLY_MODE", "link"
+        )
+        if self.router_files_assembly_mode not in ("link", "copy"):
+            raise EnvError("ROUTER_FILES_ASSEMBLY_MODE must be 'link' or 'copy'")
+        self.profile_layers_path = Path(
+            get_or_default("PROFILE_LAYERS_PATH", "/opt/profile_layers")
+        )
+        self.profile_layers_keep = int(get_or_default("PROFILE_LAYERS_KEEP", "3"))
+        self.artifact_cache_path = Path(
+            get_or_default("ARTIFACT_CACHE_PATH", "/opt/artifact_cache")
+        )
+        self.artifact_cache_max_bytes = int(
+            get_or_default("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024**3))
+        )
+        self.artifact_cache_max_age = float(
+            get_or_default("ARTIFACT_CACHE_MAX_AGE", "86400")
+        )
+        self.shared_files_concurrency = int(
+            get_or_default("SHARED_FILES_CONCURRENCY", "4")
+        )
+        self.build_workers = int(get_or_default("BUILD_WORKERS", "2"))
+        self.build_workers_per_profile = int(
+            get_or_default("BUILD_WORKERS_PER_PROFILE", "2")
+        )
+        # Builders are shared by the profiles of a target, sized like the pool
+        self.build_slots_per_builder = int(
+            get_or_default("BUILD_SLOTS_PER_BUILDER", str(self.build_workers))
+        )
+        self.build_job_retention = float(get_or_default("BUILD_JOB_RETENTION", "3600"))
+        self.batch_workers = int(get_or_default("BATCH_WORKERS", "2"))
+        self.batch_prepare_concurrency = int(
+            get_or_default("BATCH_PREPARE_CONCURRENCY", "8")
+        )
+        self.auth_workers = int(get_or_default("AUTH_WORKERS", "8"))
+        self.prepare_workers = int(get_or_default("PREPARE_WORKERS", "4"))
+        self.disk_workers = int(get_or_default("DISK_WORKERS", "2"))
+        self.build_context_ttl = float(get_or_default("BUILD_CONTEXT_TTL", "3600"))
+        self.build_context_max_entries = int(
+            get_or_default("BUILD_CONTEXT_MAX_ENTRIES", "1000")
+        )
+        # Unset keeps the build contexts in memory only
+        build_context_db_path = get_or_none("BUILD_CONTEXT_DB_PATH")
+        self.build_context_db_path = (
+            Path(build_context_db_path) if build_context_db_path else None
+        )
 
         self.vault_url = HttpUrl(get_or_default("VAULT_URL", "http://vault:8200"))
         self.vault_role_name = get_or_none("VAULT_ROLE_NAME")
         self.vault_transit_mount = get_or_raise("VAULT_TRANSIT_MOUNT")
         self.vault_transit_key = get_or_raise("VAULT_TRANSIT_KEY")
+        # Secret issuance calls in flight per Vault server, across all prepares
+        self.vault_concurrency = int(get_or_default("VAULT_CONCURRENCY", "8"))
+        # Past this, the KV metadata version is checked before serving a secret
+        self.kv_secret_cache_ttl = float(get_or_default("KV_SECRET_CACHE_TTL", "300"))
+        self.certificate_pool_path = Path(
+            get_or_default("CERTIFICATE_POOL_PATH", "/opt/certificate_pool")
+        )
+        # Transit encryption key of the pooled certificates, unset disables the pool
+        self.certificate_pool_transit_key = get_or_none("CERTIFICATE_POOL_TRANSIT_KEY")
+        self.certificate_pool_renew_before = float(
+            get_or_default("CERTIFICATE_POOL_RENEW_BEFORE", "604800")
+        )
+        self.certificate_pool_workers = int(
+            get_or_default("CERTIFICATE_POOL_WORKERS", "4")
+        )
+
+        self.admin_token = get_or_none("PTAH_ADMIN_TOKEN")
+
+        self.jwt_cache_ttl = float(get_or_default("JWT_CACHE_TTL", "300"))
+        self.jwt_negative_cache_ttl = float(
+            get_or_default("JWT_NEGATIVE_CACHE_TTL", "30")
+        )
+        self.jwt_cache_max_entries = int(
+            get_or_default("JWT_CACHE_MAX_ENTRIES", "10000")
+        )
+        # Verify router JWTs with the transit public keys instead of asking Vault
+        jwt_local_verification = get_or_default("JWT_LOCAL_VERIFICATION", "false")
+        if jwt_local_verification not in ("true", "false"):
+            raise EnvError("JWT_LOCAL_VERIFICATION must be 'true' or 'false'")
+        self.jwt_local_verification = jwt_local_verification == "true"
+
+        self.http_pool_maxsize = int(get_or_default("HTTP_POOL_MAXSIZE", "10"))
+        self.http_retries = int(get_or_default("HTTP_RETRIES", "3"))
+        self.http_retry_backoff = float(get_or_default("HTTP_RETRY_BACKOFF", "0.5"))
+
+        self.gitlab_metadata_ttl = float(get_or_default("GITLAB_METADATA_TTL", "60"))
+        self.gitlab_metadata_max_entries = int(
+            get_or_default("GITLAB_METADATA_MAX_ENTRIES", "1024")
+        )
 
 
 ENV = Env()
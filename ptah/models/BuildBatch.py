@@ -0,0 +1,90 @@
+import time
+import uuid
+from collections import Counter
+from enum import Enum
+from typing import Optional
+
+from ptah.models.BuildJob import BuildJob
+from ptah.models.PortableMac import PortableMac
+
+
+class BatchRouterState(str, Enum):
+    PENDING = "pending"
+    PREPARING = "preparing"
+    PREPARED = "prepared"
+    FAILED = "failed"
+
+
+class BatchRouter:
+    """A router of a batch, followed by its build job once prepared."""
+
+    mac: PortableMac
+    profile_name: str
+    state: BatchRouterState
+    error: Optional[str] = None
+    job: Optional[BuildJob] = None
+
+    def __init__(self, mac: PortableMac, profile_name: str):
+        self.mac = mac
+        self.profile_name = profile_name
+        self.state = BatchRouterState.PENDING
+
+    def fail(self, error: str):
+        self.state = BatchRouterState.FAILED
+        self.error = error
+
+    @property
+    def progress(self) -> str:
+        if self.job is not None:
+            return self.job.state.value
+        return self.state.value
+
+    @property
+    def finished(self) -> bool:
+        if self.job is not None:
+            return self.job.finished
+        return self.state == BatchRouterState.FAILED
+
+    def to_dict(self) -> dict:
+        return {
+            "mac": self.mac,
+            "profile": self.profile_name,
+            "state": self.progress,
+            "error": self.job.error if self.job is not None else self.error,
+            "job_id": self.job.job_id if self.job is not None else None,
+        }
+
+
+class BuildBatch:
+    batch_id: str
+    routers: dict[PortableMac, BatchRouter]
+    created_at: float
+
+    def __init__(self, routers: list[BatchRouter]):
+        self.batch_id = uuid.uuid4().hex
+        self.routers = {router.mac: router for router in routers}
+        self.created_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return all(router.finished for router in self.routers.values())
+
+    @property
+    def state(self) -> str:
+        routers = self.routers.values()
+        if any(router.job is None and not router.finished for router in routers):
+            return "preparing"
+        if not self.finished:
+            return "building"
+        return "done"
+
+    def to_dict(self) -> dict:
+        return {
+            "batch_id": self.batch_id,
+            "state": self.state,
+            "created_at": self.created_at,
+            "progress": dict(
+                Counter(router.progress for router in self.routers.values())
+            ),
+            "routers": [router.to_dict() for router in self.routers.values()],
+        }
@@ -0,0 +1,93 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import Future, wait
+from enum import Enum
+from pathlib import Path
+from typing import Optional
+
+from ptah.models.BuildLog import BuildLog
+from ptah.models.PortableMac import PortableMac
+
+
+class BuildJobState(str, Enum):
+    QUEUED = "queued"
+    PREPARING = "preparing"
+    BUILDING = "building"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class BuildJob:
+    job_id: str
+    mac: PortableMac
+    profile_name: str
+    version_hash: str
+    # Digest of the router specific files the job builds
+    files_digest: str
+    state: BuildJobState
+    error: Optional[str] = None
+    artifact_path: Optional[Path] = None
+    log_path: Optional[Path] = None
+    log: BuildLog
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def __init__(
+        self,
+        mac: PortableMac,
+        profile_name: str,
+        version_hash: str,
+        files_digest: str = "",
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.mac = mac
+        self.profile_name = profile_name
+        self.version_hash = version_hash
+        self.files_digest = files_digest
+        self.state = BuildJobState.QUEUED
+        self.created_at = time.time()
+        self.log = BuildLog()
+        # Resolved on finish, awaited by async handlers without holding a thread
+        self._finished: Future = Future()
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (BuildJobState.DONE, BuildJobState.FAILED)
+
+    def set_state(self, state: BuildJobState):
+        self.state = state
+        self.log.append("state", {"state": state.value})
+
+    def finish(self, state: BuildJobState, error: Optional[str] = None):
+        self.error = error
+        self.finished_at = time.time()
+        self.state = state
+        self.log.append("state", {"state": state.value, "error": error})
+        self.log.close()
+        self._finished.set_result(state)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the job is done or failed."""
+        wait([self._finished], timeout)
+        return self._finished.done()
+
+    async def wait_async(self):
+        """Wait until the job is done or failed, from the event loop."""
+        # Shielded, a cancelled waiter must not cancel the job future
+        await asyncio.shield(asyncio.wrap_future(self._finished))
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "mac": self.mac,
+            "profile": self.profile_name,
+            "ptah_version_hash": self.version_hash,
+            "state": self.state.value,
+            "phase": self.log.phase.value if self.log.phase is not None else None,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
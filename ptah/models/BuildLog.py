@@ -0,0 +1,100 @@
+import re
+import threading
+from collections import deque
+from concurrent.futures import Future
+from enum import Enum
+from typing import Optional
+
+
+class BuildPhase(str, Enum):
+    PACKAGES = "packages"
+    ROOTFS = "rootfs"
+    SQUASHFS = "squashfs"
+    SYSUPGRADE = "sysupgrade"
+
+
+# ImageBuilder output announcing each phase, in build order
+PHASE_PATTERNS = [
+    (BuildPhase.PACKAGES, re.compile(r"^Installing packages")),
+    (BuildPhase.ROOTFS, re.compile(r"^Finalizing root filesystem")),
+    (BuildPhase.SQUASHFS, re.compile(r"mksquashfs|\.squashfs")),
+    (BuildPhase.SYSUPGRADE, re.compile(r"sysupgrade")),
+]
+
+
+class BuildEvent:
+    event_id: int
+    kind: str
+    data: dict
+
+    def __init__(self, event_id: int, kind: str, data: dict):
+        self.event_id = event_id
+        self.kind = kind
+        self.data = data
+
+
+class BuildLog:
+    """
+    Events of a build job (state changes, phases and output lines), numbered so
+    that followers can resume after the last event they saw. Only the last
+    `max_events` are kept in memory, the full output is written to the build log
+    file.
+    """
+
+    max_events: int
+    phase: Optional[BuildPhase] = None
+    closed: bool = False
+
+    def __init__(self, max_events: int = 10000):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._events: deque[BuildEvent] = deque(maxlen=max_events)
+        self._last_id = 0
+        self._changed: Future = Future()
+
+    def _notify(self):
+        """Wake up the followers, must be called with the lock held."""
+        self._changed.set_result(None)
+        self._changed = Future()
+
+    def append(self, kind: str, data: dict):
+        with self._lock:
+            self._last_id += 1
+            self._events.append(BuildEvent(self._last_id, kind, data))
+            self._notify()
+
+    def _match_phase(self, line: str) -> Optional[BuildPhase]:
+        phases = list(BuildPhase)
+        current = phases.index(self.phase) if self.phase is not None else -1
+        # Phases only move forward, later output may mention earlier ones
+        for phase, pattern in PHASE_PATTERNS[current + 1 :]:
+            if pattern.search(line):
+                return phase
+        return None
+
+    def add_line(self, line: str):
+        phase = self._match_phase(line)
+        if phase is not None:
+            self.phase = phase
+            self.append("phase", {"phase": phase.value})
+        self.append("log", {"line": line})
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._notify()
+
+    def events_after(self, after_id: int) -> tuple[list[BuildEvent], bool]:
+        """Return the events after `after_id` and whether the log is closed."""
+        with self._lock:
+            events = [event for event in self._events if event.event_id > after_id]
+            return events, self.closed
+
+    def changed(self, after_id: int) -> Future:
+        """A future resolved once there are events after `after_id` or the log closes."""
+        with self._lock:
+            if self._last_id > after_id or self.closed:
+                done: Future = Future()
+                done.set_result(None)
+                return done
+            return self._changed
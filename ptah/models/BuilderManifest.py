@@ -0,0 +1,43 @@
+import os
+from pathlib import Path
+from typing import Dict, List
+
+from pydantic import BaseModel
+
+from ptah.models.PtahConfig import OpenWrtProfile
+
+
+class BuilderEntry(BaseModel):
+    # Name of the folder extracted from the ImageBuilder archive
+    folder: str
+    sha256: str
+    # Ptah profiles using this builder, an empty list means it can be collected
+    profiles: List[str] = []
+
+
+class BuilderManifest(BaseModel):
+    """Index of the ImageBuilders of the builder store, keyed by version, target and arch."""
+
+    builders: Dict[str, BuilderEntry] = {}
+
+    @staticmethod
+    def builder_key(openwrt_profile: OpenWrtProfile) -> str:
+        return (
+            f"{openwrt_profile.openwrt_version}-"
+            f"{openwrt_profile.target}-"
+            f"{openwrt_profile.arch}"
+        )
+
+    @classmethod
+    def load(cls, manifest_path: Path) -> "BuilderManifest":
+        if not manifest_path.is_file():
+            return cls()
+        return cls.model_validate_json(manifest_path.read_text(encoding="utf-8"))
+
+    def save(self, manifest_path: Path):
+        temporary_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+        temporary_path.write_text(self.model_dump_json(indent=2), encoding="utf-8")
+        os.replace(temporary_path, manifest_path)
+
+    def unreferenced(self) -> List[str]:
+        return [key for key, entry in self.builders.items() if not entry.profiles]
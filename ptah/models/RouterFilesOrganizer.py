@@ -1,77 +1,287 @@
+import fcntl
 import os
+from contextlib import contextmanager
 from pathlib import Path
 import re
-from shutil import copy2
+import stat
+import threading
+from shutil import copy2, copytree, rmtree
+from typing import Iterator, Optional
 
 from ptah.env import ENV
 from ptah.models import PortableMac
 from ptah.models import PathTransferHandler
-from ptah.utils.utils import recreate_dir
 
 
-def process_ptah_permissions_on_folder(
-    source_path: Path,
-    destination_path: Path,
-) -> None:
+def read_ptah_permissions(source_path: Path) -> list[tuple[str, int]]:
+    """Return the (relative path, mode) pairs listed in a folder's .ptah_permissions."""
     permission_file = source_path / ".ptah_permissions"
     if not permission_file.exists():
-        return
+        return []
     with open(permission_file, "r", encoding="utf-8") as f:
         permissions = f.readlines()
 
     permission_regex = (
         r"^\s*(?!#)(?P<octal>[0-7]{3})\s+(?P<path>(?!/|\./|\.\./)[^\s#]+)$"
     )
+    entries = []
     for line in permissions:
         match = re.match(permission_regex, line)
         if match:
-            octal = match.group("octal")
-            path = match.group("path")
-            destination_file = destination_path / str(path)
-            destination_file.chmod(int(octal, 8))
+            entries.append((match.group("path"), int(match.group("octal"), 8)))
+    return entries
 
 
-class RouterFilesOrganizer:
-    mac: PortableMac
+# Held while the router files of a MAC are assembled or snapshotted
+_router_files_locks: dict[str, threading.Lock] = {}
+_router_files_locks_lock = threading.Lock()
+
+
+@contextmanager
+def router_files_lock(mac: PortableMac) -> Iterator[None]:
+    mac_fc = mac.to_filename_compliant()
+    with _router_files_locks_lock:
+        mac_lock = _router_files_locks.setdefault(mac_fc, threading.Lock())
+    # The flock covers other worker processes
+    ENV.routers_files_path.mkdir(parents=True, exist_ok=True)
+    lock_path = ENV.routers_files_path / f".{mac_fc}.lock"
+    with mac_lock, open(lock_path, "a", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def link_or_copy(source: str, destination: str):
+    try:
+        os.link(source, destination)
+    except OSError:
+        copy2(source, destination)
+
+
+def _files_digest_path(mac: PortableMac) -> Path:
+    # Next to the router files, not inside them: they end up in the image
+    return ENV.routers_files_path / f".{mac.to_filename_compliant()}.digest"
+
+
+def _read_files_digest(mac: PortableMac) -> str:
+    try:
+        return _files_digest_path(mac).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ""
+
+
+def router_files_digest(mac: PortableMac) -> str:
+    """
+    Digest of the router specific files (certificates, JWTs, version files) of
+    the last assembly of a router, empty if it has none.
+    """
+    with router_files_lock(mac):
+        return _read_files_digest(mac)
+
+
+def snapshot_router_files(
+    mac: PortableMac, snapshot_path: Path
+) -> tuple[Optional[str], str]:
+    """
+    Hardlink the router files of a router into snapshot_path, so that a later
+    prepare of the same router cannot change what a build reads (assemblies never
+    write into an existing file). Returns the version found in the snapshot and
+    the digest of its router specific files.
+    """
+    with router_files_lock(mac):
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        copytree(
+            ENV.routers_files_path / mac.to_filename_compliant(),
+            snapshot_path,
+            symlinks=True,
+            copy_function=link_or_copy,
+        )
+        files_digest = _read_files_digest(mac)
+    version_path = snapshot_path / "etc" / "ptah_version"
+    if not version_path.is_file():
+        return None, files_digest
+    return version_path.read_text(encoding="utf-8").strip(), files_digest
+
+
+class PlannedFile:
+    source: Path
+    # None keeps the permissions of the source file
+    mode: Optional[int]
+
+    def __init__(self, source: Path, mode: Optional[int] = None):
+        self.source = source
+        self.mode = mode
+
+
+class FilesOrganizer:
+    """
+    Assemble a files tree (passed to the ImageBuilder FILES) out of transfer entries.
+
+    An optional base layer, a tree assembled earlier whose permissions are
+    final, is merged first and the entries are laid over it.
+    """
+
     file_transfer_entries: list[PathTransferHandler]
+    base_layer: Optional[Path]
 
-    def __init__(self, mac: PortableMac):
-        self.mac = mac
+    def __init__(self):
         self.file_transfer_entries = []
+        self.base_layer = None
 
-    # This method organizes and copies the router files:
-    # - Iterates over all files that the router needs.
-    # - If a file is a directory, merges its contents.
-    # - If a file is a regular file, it copies it.
-    def merge_files_to_router_files(self):
-        router_directory = ENV.routers_files_path / self.mac.to_filename_compliant()
-        recreate_dir(router_directory)
+    # This method computes the content of the files directory:
+    # - Starts from the base layer if there is one.
+    # - Iterates over all files that are needed, later entries win.
+    # - If a file is a directory, merges its contents and applies .ptah_permissions.
+    # - If a file is a regular file, it is placed at its destination.
+    def plan_files(
+        self,
+    ) -> tuple[dict[str, PlannedFile], set[str], dict[str, int]]:
+        files: dict[str, PlannedFile] = {}
+        directories: set[str] = set()
+        directory_modes: dict[str, int] = {}
+
+        if self.base_layer is not None:
+            for root, _, dir_files in os.walk(self.base_layer):
+                relative_path = Path(root).relative_to(self.base_layer)
+                directories.add(str(relative_path))
+                # Directory permissions of the layer are final too
+                directory_modes[str(relative_path)] = stat.S_IMODE(
+                    os.stat(root).st_mode
+                )
+                for file in dir_files:
+                    files[str(relative_path / file)] = PlannedFile(Path(root) / file)
 
         for file_handler in self.file_transfer_entries:
             source_path = file_handler.source
             if source_path.is_file():
-                destination_path = router_directory / file_handler.dest.relative_to("/")
-                destination_path.parent.mkdir(parents=True, exist_ok=True)
-                copy2(source_path, destination_path)
-                if not file_handler.permission:
-                    permission = int("644", 8)
-                else:
-                    permission = int(file_handler.permission, 8)
-                destination_path.chmod(permission)
+                destination = file_handler.dest.relative_to("/")
+                files[str(destination)] = PlannedFile(
+                    source_path, int(file_handler.permission or "644", 8)
+                )
+                directories.update(str(parent) for parent in destination.parents)
                 continue
 
-            # If it's a directory, recursively copy its contents
-            for root, _, files in os.walk(source_path):
-                root_directory_path = Path(root)
-                relative_path = root_directory_path.relative_to(source_path)
-                destination_subdir = router_directory / relative_path
-                destination_subdir.mkdir(parents=True, exist_ok=True)
-
-                for file in files:
-                    source_file = root_directory_path / file
-                    destination_file = destination_subdir / file
-                    copy2(source_file, destination_file)
-            process_ptah_permissions_on_folder(
-                source_path=source_path,
-                destination_path=router_directory,
-            )
+            for root, _, dir_files in os.walk(source_path):
+                relative_path = Path(root).relative_to(source_path)
+                directories.add(str(relative_path))
+                for file in dir_files:
+                    files[str(relative_path / file)] = PlannedFile(Path(root) / file)
+
+            for path, mode in read_ptah_permissions(source_path):
+                path = str(Path(path))
+                if path in files:
+                    files[path] = PlannedFile(files[path].source, mode)
+                elif path in directories:
+                    directory_modes[path] = mode
+
+        directories.discard(".")
+        return files, directories, directory_modes
+
+    @staticmethod
+    def is_up_to_date(
+        destination_stat: os.stat_result, source_stat: os.stat_result, mode: int
+    ) -> bool:
+        if stat.S_IMODE(destination_stat.st_mode) != mode:
+            return False
+        # Hardlink to the source
+        if (destination_stat.st_dev, destination_stat.st_ino) == (
+            source_stat.st_dev,
+            source_stat.st_ino,
+        ):
+            return True
+        # Copy made by copy2, which keeps the modification time
+        return (
+            destination_stat.st_size == source_stat.st_size
+            and destination_stat.st_mtime_ns == source_stat.st_mtime_ns
+        )
+
+    @staticmethod
+    def place_file(source: Path, destination: Path, mode: int, source_mode: int):
+        # Never write into an existing destination, it may be a hardlink to a cached file
+        if destination.is_dir() and not destination.is_symlink():
+            rmtree(destination)
+        else:
+            destination.unlink(missing_ok=True)
+
+        if ENV.router_files_assembly_mode == "link" and mode == source_mode:
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                # Different filesystem, fall back to a copy
+                pass
+        copy2(source, destination)
+        destination.chmod(mode)
+
+    # Only the paths that changed since the previous assembly of the directory are touched.
+    # With the "link" assembly mode, files whose permissions do not change are
+    # hardlinked to their (immutable) cached source instead of being copied.
+    def assemble(self, directory: Path):
+        directory.mkdir(parents=True, exist_ok=True)
+        files, directories, directory_modes = self.plan_files()
+
+        # Remove what the previous assembly had and this one does not
+        for root, dir_names, file_names in os.walk(directory, topdown=False):
+            relative_root = Path(root).relative_to(directory)
+            for file in file_names:
+                if str(relative_root / file) not in files:
+                    (Path(root) / file).unlink()
+            for dir_name in dir_names:
+                relative_dir = relative_root / dir_name
+                dir_path = Path(root) / dir_name
+                if dir_path.is_symlink():
+                    dir_path.unlink()
+                elif str(relative_dir) not in directories and not any(
+                    dir_path.iterdir()
+                ):
+                    dir_path.rmdir()
+
+        for relative_dir in sorted(directories):
+            directory_path = directory / relative_dir
+            if directory_path.is_file() or directory_path.is_symlink():
+                directory_path.unlink()
+            directory_path.mkdir(parents=True, exist_ok=True)
+            if relative_dir in directory_modes:
+                directory_path.chmod(directory_modes[relative_dir])
+
+        for relative_path, planned_file in files.items():
+            destination_path = directory / relative_path
+            source_stat = planned_file.source.stat()
+            source_mode = stat.S_IMODE(source_stat.st_mode)
+            mode = planned_file.mode if planned_file.mode is not None else source_mode
+            try:
+                destination_stat = destination_path.lstat()
+            except FileNotFoundError:
+                destination_stat = None
+            if (
+                destination_stat is not None
+                and stat.S_ISREG(destination_stat.st_mode)
+                and self.is_up_to_date(destination_stat, source_stat, mode)
+            ):
+                continue
+            self.place_file(planned_file.source, destination_path, mode, source_mode)
+
+        # The directory mtime tells when it was last assembled
+        os.utime(directory)
+
+
+class RouterFilesOrganizer(FilesOrganizer):
+    mac: PortableMac
+    # Digest of the router specific files, recorded with the assembly
+    files_digest: Optional[str]
+
+    def __init__(self, mac: PortableMac):
+        super().__init__()
+        self.mac = mac
+        self.files_digest = None
+
+    def merge_files_to_router_files(self):
+        with router_files_lock(self.mac):
+            self.assemble(ENV.routers_files_path / self.mac.to_filename_compliant())
+            digest_path = _files_digest_path(self.mac)
+            if self.files_digest is None:
+                digest_path.unlink(missing_ok=True)
+            else:
+                digest_path.write_text(self.files_digest, encoding="utf-8")
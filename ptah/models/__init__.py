@@ -12,3 +12,7 @@ from .RouterFilesOrganizer import RouterFilesOrganizer
 from .PortableMac import PortableMac
 from .PathTransferHandler import PathTransferHandler
 from .VaultResponses import VaultResponse, CertificateData, PtahSecretsData
+from .BuildLog import BuildLog, BuildEvent, BuildPhase
+from .BuildJob import BuildJob, BuildJobState
+from .BuildBatch import BuildBatch, BatchRouter, BatchRouterState
+from .BuilderManifest import BuilderManifest, BuilderEntry
@@ -1,5 +1,18 @@
-from pydantic import BaseModel
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from ptah.models.PortableMac import PortableMac
 
 
 class BuildPrepareRequest(BaseModel):
     profile: str
+
+
+class BatchRouterRequest(BaseModel):
+    mac: PortableMac
+    profile: str
+
+
+class BatchPrepareRequest(BaseModel):
+    routers: List[BatchRouterRequest] = Field(min_length=1)
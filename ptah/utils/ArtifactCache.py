@@ -0,0 +1,163 @@
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+
+class ArtifactCache:
+    """
+    On-disk cache of built sysupgrade binaries, keyed by ptah version hash, router
+    files digest and MAC.
+
+    Entries are written to a temporary file and renamed into place, so readers
+    never see a partial binary. When the cache grows over `max_bytes`, the least
+    recently used entries are evicted, except those used in the last
+    `eviction_grace` seconds (they may still be streamed to a router).
+    The version hash does not cover the router secrets the binary embeds, the
+    digest of the router specific files does: a prepare issuing new certificates
+    or JWTs misses the binaries built with the previous ones. Entries older than
+    `max_age` are not served either. The build log of an entry is kept
+    next to it and goes with it.
+    """
+
+    cache_path: Path
+    max_bytes: int
+    max_age: float
+    eviction_grace: float
+
+    def __init__(
+        self,
+        cache_path: Path,
+        max_bytes: int,
+        max_age: float,
+        eviction_grace: float = 300,
+    ):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.eviction_grace = eviction_grace
+        self._lock = threading.Lock()
+        if self.enabled:
+            self.cache_path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _entry_path(self, version_hash: str, files_digest: str, mac: str) -> Path:
+        key = hashlib.sha256(
+            f"{version_hash}:{files_digest}:{mac}".encode("utf-8")
+        ).hexdigest()
+        return self.cache_path / f"{key}.bin"
+
+    @contextmanager
+    def _exclusive(self):
+        # The file lock protects against other worker processes sharing the cache
+        with self._lock, open(self.cache_path / ".lock", "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get(self, version_hash: str, files_digest: str, mac: str) -> Optional[Path]:
+        """Return the cached binary for this build, or None on a cache miss."""
+        if not self.enabled:
+            return None
+        entry_path = self._entry_path(version_hash, files_digest, mac)
+        try:
+            stat = entry_path.stat()
+        except FileNotFoundError:
+            return None
+
+        # mtime is the time the entry was stored, atime the last time it was served
+        if time.time() - stat.st_mtime > self.max_age:
+            self._remove(entry_path)
+            return None
+        os.utime(entry_path, (time.time(), stat.st_mtime))
+        return entry_path
+
+    @staticmethod
+    def _remove(entry_path: Path):
+        entry_path.unlink(missing_ok=True)
+        entry_path.with_suffix(".log").unlink(missing_ok=True)
+
+    def _store(self, source_path: Path, entry_path: Path):
+        temporary_path = self.cache_path / f".{entry_path.name}.{uuid.uuid4().hex}"
+        try:
+            os.link(source_path, temporary_path)
+        except OSError:
+            shutil.copyfile(source_path, temporary_path)
+        os.replace(temporary_path, entry_path)
+
+    def get_log(self, version_hash: str, files_digest: str, mac: str) -> Optional[Path]:
+        """Return the build log stored with a cached binary, if any."""
+        if not self.enabled:
+            return None
+        log_path = self._entry_path(version_hash, files_digest, mac).with_suffix(".log")
+        return log_path if log_path.is_file() else None
+
+    def put(
+        self,
+        version_hash: str,
+        files_digest: str,
+        mac: str,
+        binary_path: Path,
+        log_path: Optional[Path] = None,
+    ) -> Path:
+        """Store a freshly built binary and return the path of the cache entry."""
+        if not self.enabled:
+            return binary_path
+        entry_path = self._entry_path(version_hash, files_digest, mac)
+        # The log first, so that a served entry always has its log
+        if log_path is not None and log_path.is_file():
+            self._store(log_path, entry_path.with_suffix(".log"))
+        self._store(binary_path, entry_path)
+
+        self.evict()
+        return entry_path
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        with self._exclusive():
+            entries = []
+            total_size = 0
+            for entry_path in self.cache_path.glob("*.bin"):
+                try:
+                    stat = entry_path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_atime, stat.st_size, entry_path))
+                total_size += stat.st_size
+
+            now = time.time()
+            for last_access, size, entry_path in sorted(entries):
+                if total_size <= self.max_bytes:
+                    break
+                if now - last_access < self.eviction_grace:
+                    continue
+                self._remove(entry_path)
+                total_size -= size
+                logging.info("Evicted cached artifact %s", entry_path.name)
+
+    def usage(self) -> dict:
+        entries = 0
+        total_size = 0
+        for entry_path in self.cache_path.glob("*.bin") if self.enabled else []:
+            try:
+                total_size += entry_path.stat().st_size
+            except FileNotFoundError:
+                continue
+            entries += 1
+        return {
+            "entries": entries,
+            "bytes": total_size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from ptah.models import BuildBatch
+
+
+class BatchManager:
+    """
+    Registry of build batches, each prepared by a task run on a bounded pool.
+
+    At most `max_workers` batches are prepared at once, their builds then go
+    through the build scheduler like any other. Finished batches are forgotten
+    after `retention` seconds.
+    """
+
+    max_workers: int
+    retention: float
+
+    def __init__(self, max_workers: int, retention: float):
+        self.max_workers = max_workers
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ptah-batch"
+        )
+        self._lock = threading.Lock()
+        self._batches: dict[str, BuildBatch] = {}
+        self._finished_at: dict[str, float] = {}
+
+    def _prune(self):
+        """Forget old finished batches, must be called with the lock held."""
+        now = time.time()
+        for batch_id, batch in list(self._batches.items()):
+            if not batch.finished:
+                continue
+            finished_at = self._finished_at.setdefault(batch_id, now)
+            if now - finished_at > self.retention:
+                del self._batches[batch_id]
+                del self._finished_at[batch_id]
+
+    def _run(self, batch: BuildBatch, task: Callable[[BuildBatch], None]):
+        try:
+            task(batch)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.exception("Batch %s failed", batch.batch_id)
+            for router in batch.routers.values():
+                if router.job is None and not router.finished:
+                    router.fail(str(exc))
+
+    def submit(self, batch: BuildBatch, task: Callable[[BuildBatch], None]):
+        with self._lock:
+            self._prune()
+            self._batches[batch.batch_id] = batch
+        self._executor.submit(self._run, batch, task)
+
+    def get(self, batch_id: str) -> Optional[BuildBatch]:
+        with self._lock:
+            self._prune()
+            return self._batches.get(batch_id)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
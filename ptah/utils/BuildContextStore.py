@@ -0,0 +1,248 @@
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from shutil import rmtree
+from typing import TYPE_CHECKING, Callable, Optional
+
+from ptah.env import ENV
+from ptah.models import PortableMac
+from ptah.utils.CacheManager import CacheManager
+
+if TYPE_CHECKING:
+    # The AppContext owns the store, avoid a circular import
+    from ptah.contexts import BuildContext
+
+
+class BuildContextStore:
+    """
+    Prepared build contexts, by router MAC.
+
+    A context expires `ttl` seconds after its prepare, and at most `max_entries`
+    contexts are kept (least recently used first out). The router files of a
+    stored context are pinned in the cache manager, they are needed by its
+    build. When a context goes, its router files and temporary files (which hold
+    its certificates and JWTs) are removed from the disk, unless an in-flight
+    prepare pinned them.
+
+    With a `db_path`, contexts are also recorded in SQLite so that a restart does
+    not force every router to prepare again. Secrets and file lists are never
+    persisted, `restore` rebuilds a context from the profile name, versions and
+    final version hash.
+    """
+
+    ttl: float
+    max_entries: int
+    db_path: Optional[Path]
+    cache_manager: Optional[CacheManager]
+    restore: Optional[Callable[[dict], Optional[BuildContext]]]
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        db_path: Optional[Path] = None,
+        cache_manager: Optional[CacheManager] = None,
+        restore: Optional[Callable[[dict], Optional[BuildContext]]] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max(max_entries, 1)
+        self.db_path = db_path
+        self.cache_manager = cache_manager
+        self.restore = restore
+        self._lock = threading.Lock()
+        # MAC -> (context, prepared at)
+        self._contexts: OrderedDict[PortableMac, tuple[BuildContext, float]] = (
+            OrderedDict()
+        )
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path is not None:
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS build_contexts ("
+                "mac TEXT PRIMARY KEY, profile_name TEXT NOT NULL, "
+                "versions TEXT NOT NULL, final_version TEXT NOT NULL, "
+                "config_generation INTEGER NOT NULL, prepared_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    # ---------------------------------- Persistence -------------------------------- #
+
+    def _db_save(self, build_context: BuildContext, prepared_at: float):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO build_contexts VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                str(build_context.mac),
+                build_context.profile.name,
+                json.dumps(build_context.versions._versions),
+                build_context.final_version,
+                build_context.config_generation,
+                prepared_at,
+            ),
+        )
+        self._db.commit()
+
+    def _db_load(self, mac: PortableMac) -> Optional[dict]:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT mac, profile_name, versions, final_version, config_generation, "
+            "prepared_at FROM build_contexts WHERE mac = ?",
+            (str(mac),),
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "mac": row[0],
+            "profile_name": row[1],
+            "versions": json.loads(row[2]),
+            "final_version": row[3],
+            "config_generation": row[4],
+            "prepared_at": row[5],
+        }
+
+    def _db_delete(self, macs: list[PortableMac]):
+        if self._db is None or not macs:
+            return
+        self._db.executemany(
+            "DELETE FROM build_contexts WHERE mac = ?", [(str(mac),) for mac in macs]
+        )
+        self._db.commit()
+
+    # ----------------------------------- Eviction ---------------------------------- #
+
+    def _set_pinned(self, mac: PortableMac, pinned: bool):
+        if self.cache_manager is None:
+            return
+        path = ENV.routers_files_path / mac.to_filename_compliant()
+        if pinned:
+            self.cache_manager.pin(path)
+        else:
+            self.cache_manager.unpin(path)
+
+    def _add(self, mac: PortableMac, build_context: BuildContext, prepared_at: float):
+        """Store a context, must be called with the lock held."""
+        if mac not in self._contexts:
+            self._set_pinned(mac, True)
+        self._contexts[mac] = (build_context, prepared_at)
+        self._contexts.move_to_end(mac)
+
+    def _drop(self, mac: PortableMac):
+        """Forget a context, must be called with the lock held."""
+        if self._contexts.pop(mac, None) is not None:
+            self._set_pinned(mac, False)
+
+    def _cleanup(self, macs: list[PortableMac]):
+        """Remove the files left on disk by evicted contexts."""
+        for mac in macs:
+            mac_fc = mac.to_filename_compliant()
+            for path in (
+                ENV.routers_files_path / mac_fc,
+                ENV.router_temporary_path / mac_fc,
+            ):
+                if self.cache_manager is not None and self.cache_manager.is_pinned(
+                    path
+                ):
+                    continue
+                rmtree(path, ignore_errors=True)
+
+    def _expired_macs(self, now: float) -> list[PortableMac]:
+        """Drop expired and surplus contexts, must be called with the lock held."""
+        evicted = [
+            mac
+            for mac, (_, prepared_at) in self._contexts.items()
+            if now - prepared_at > self.ttl
+        ]
+        for mac in evicted:
+            self._drop(mac)
+        while len(self._contexts) > self.max_entries:
+            mac = next(iter(self._contexts))
+            self._drop(mac)
+            evicted.append(mac)
+
+        if self._db is not None:
+            rows = self._db.execute(
+                "SELECT mac FROM build_contexts WHERE prepared_at < ?",
+                (now - self.ttl,),
+            ).fetchall()
+            evicted.extend(PortableMac(row[0]) for row in rows if row[0] not in evicted)
+        self._db_delete(evicted)
+        return evicted
+
+    def expire(self) -> int:
+        """Evict the expired contexts, returns how many were evicted."""
+        with self._lock:
+            evicted = self._expired_macs(time.time())
+        self._cleanup(evicted)
+        return len(evicted)
+
+    # ---------------------------------- Public API --------------------------------- #
+
+    def put(self, build_context: BuildContext):
+        now = time.time()
+        with self._lock:
+            self._add(build_context.mac, build_context, now)
+            self._db_save(build_context, now)
+            evicted = self._expired_macs(now)
+        if evicted:
+            logging.info("Evicted %d build contexts", len(evicted))
+        self._cleanup(evicted)
+
+    def get(self, mac: PortableMac) -> Optional[BuildContext]:
+        now = time.time()
+        with self._lock:
+            if mac in self._contexts:
+                build_context, prepared_at = self._contexts[mac]
+                if now - prepared_at <= self.ttl:
+                    self._contexts.move_to_end(mac)
+                    return build_context
+                stale = True
+            else:
+                stale = False
+            record = self._db_load(mac)
+
+        # Prepared before a restart
+        if record is not None and now - record["prepared_at"] <= self.ttl:
+            build_context = self.restore(record) if self.restore else None
+            if build_context is not None:
+                with self._lock:
+                    self._add(mac, build_context, record["prepared_at"])
+                return build_context
+
+        if stale or record is not None:
+            self.remove(mac)
+        return None
+
+    def remove(self, mac: PortableMac):
+        with self._lock:
+            self._drop(mac)
+            self._db_delete([mac])
+        self._cleanup([mac])
+
+    def __contains__(self, mac: PortableMac) -> bool:
+        return self.get(mac) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._contexts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._contexts),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "persistent": self._db is not None,
+            }
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from shutil import rmtree
+from typing import TYPE_CHECKING, Optional
+
+from ptah.env import ENV
+from ptah.models import BuildJob, BuildJobState
+from ptah.models.RouterFilesOrganizer import (
+    router_files_digest,
+    snapshot_router_files,
+)
+from ptah.utils.ArtifactCache import ArtifactCache
+from ptah.utils.BuilderSlotPool import BuilderSlotPool
+from ptah.utils.CacheManager import CacheManager
+from ptah.utils.build_image import BUILD_LOG_NAME, build_output_path, run_make_build
+
+if TYPE_CHECKING:
+    # The AppContext owns the scheduler, avoid a circular import
+    from ptah.contexts import BuildContext
+
+
+class BuildScheduler:
+    """
+    Queue of `make image` jobs run on a bounded pool of workers.
+
+    At most `max_workers` builds run at once, at most `max_per_profile` of them
+    for the same profile, and no more than the builder has slots for profiles
+    sharing a builder. Queued jobs are dispatched in submission order, skipping
+    jobs whose profile or builder is busy, so that a dispatched job never waits
+    for a slot while a job on another builder could run.
+    Finished jobs are forgotten after `job_retention` seconds.
+
+    A job builds from a snapshot of the router files taken when it is submitted,
+    so that a prepare of the same router in the meantime cannot change the files
+    of a binary cached under the job version and router files digest. The build tree of a queued or
+    running job is pinned in the cache manager.
+    """
+
+    artifact_cache: ArtifactCache
+    builder_slots: BuilderSlotPool
+    max_workers: int
+    max_per_profile: int
+    job_retention: float
+    cache_manager: Optional[CacheManager]
+
+    def __init__(
+        self,
+        artifact_cache: ArtifactCache,
+        builder_slots: BuilderSlotPool,
+        max_workers: int,
+        max_per_profile: int,
+        job_retention: float,
+        cache_manager: Optional[CacheManager] = None,
+    ):
+        self.artifact_cache = artifact_cache
+        self.builder_slots = builder_slots
+        self.max_workers = max_workers
+        self.max_per_profile = max_per_profile
+        self.job_retention = job_retention
+        self.cache_manager = cache_manager
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="ptah-build"
+        )
+        self._lock = threading.Lock()
+        self._jobs: dict[str, BuildJob] = {}
+        self._build_contexts: dict[str, BuildContext] = {}
+        self._queue: deque[BuildJob] = deque()
+        self._running = 0
+        self._running_per_profile: dict[str, int] = defaultdict(int)
+        self._running_per_builder: dict[str, int] = defaultdict(int)
+
+    # ---------------------------------- Dispatching -------------------------------- #
+
+    @staticmethod
+    def _job_paths(job: BuildJob) -> tuple:
+        return (ENV.output_path / job.mac.to_filename_compliant(),)
+
+    @staticmethod
+    def _files_snapshot_path(job: BuildJob) -> Path:
+        # Dot directories are not cache entries, the snapshot is never evicted
+        return ENV.routers_files_path / ".jobs" / job.job_id
+
+    def _snapshot_files(self, job: BuildJob):
+        snapshot_path = self._files_snapshot_path(job)
+        version, files_digest = snapshot_router_files(job.mac, snapshot_path)
+        if (
+            version is not None and version != job.version_hash
+        ) or files_digest != job.files_digest:
+            rmtree(snapshot_path, ignore_errors=True)
+            raise RuntimeError(
+                f"{job.mac} was prepared again since version {job.version_hash}, "
+                "build it again."
+            )
+
+    def _dispatch(self):
+        """Start queued jobs while slots are free, must be called with the lock held."""
+        for job in list(self._queue):
+            if self._running >= self.max_workers:
+                return
+            if self._running_per_profile[job.profile_name] >= self.max_per_profile:
+                continue
+            build_context = self._build_contexts[job.job_id]
+            builder_key = self.builder_slots.builder_key(build_context.profile)
+            if self._running_per_builder[builder_key] >= self.builder_slots.max_slots:
+                continue
+            self._queue.remove(job)
+            del self._build_contexts[job.job_id]
+            self._running += 1
+            self._running_per_profile[job.profile_name] += 1
+            self._running_per_builder[builder_key] += 1
+            self._executor.submit(self._run, job, build_context)
+
+    def _run(self, job: BuildJob, build_context: BuildContext):
+        mac_fc = build_context.mac.to_filename_compliant()
+        job.started_at = time.time()
+        try:
+            job.set_state(BuildJobState.PREPARING)
+            job.artifact_path = self.artifact_cache.get(
+                job.version_hash, job.files_digest, mac_fc
+            )
+            if job.artifact_path is None:
+                with self.builder_slots.acquire(build_context.profile) as builder:
+                    job.set_state(BuildJobState.BUILDING)
+                    output_path = build_output_path(mac_fc, job.job_id)
+                    job.log_path = output_path / BUILD_LOG_NAME
+                    binary_path = run_make_build(
+                        build_context.profile,
+                        mac_fc,
+                        builder,
+                        self._files_snapshot_path(job),
+                        output_path,
+                        job.log.add_line,
+                    )
+                job.artifact_path = self.artifact_cache.put(
+                    job.version_hash,
+                    job.files_digest,
+                    mac_fc,
+                    binary_path,
+                    job.log_path,
+                )
+            job.log_path = (
+                self.artifact_cache.get_log(job.version_hash, job.files_digest, mac_fc)
+                or job.log_path
+            )
+            job.finish(BuildJobState.DONE)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.exception("Build job %s for %s failed", job.job_id, job.mac)
+            job.finish(BuildJobState.FAILED, str(exc))
+        finally:
+            rmtree(self._files_snapshot_path(job), ignore_errors=True)
+            if self.cache_manager is not None:
+                for path in self._job_paths(job):
+                    self.cache_manager.unpin(path)
+            with self._lock:
+                self._running -= 1
+                self._running_per_profile[job.profile_name] -= 1
+                self._running_per_builder[
+                    self.builder_slots.builder_key(build_context.profile)
+                ] -= 1
+                self._dispatch()
+
+    def _prune(self):
+        """Forget old finished jobs, must be called with the lock held."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.job_retention:
+                del self._jobs[job_id]
+                # The artifact cache keeps its own link or copy of the binary and log
+                rmtree(
+                    build_output_path(job.mac.to_filename_compliant(), job_id),
+                    ignore_errors=True,
+                )
+
+    # ---------------------------------- Public API --------------------------------- #
+
+    def submit(self, build_context: BuildContext) -> BuildJob:
+        """
+        Queue a build for a prepared router and return its job.
+        An unfinished job building the same version for the same router is reused.
+        """
+        version_hash = build_context.final_version
+        mac_fc = build_context.mac.to_filename_compliant()
+        # Read from the disk, restored contexts do not know it
+        files_digest = router_files_digest(build_context.mac)
+        with self._lock:
+            self._prune()
+            for job in self._jobs.values():
+                if (
+                    job.mac == build_context.mac
+                    and job.version_hash == version_hash
+                    and job.files_digest == files_digest
+                    and not job.finished
+                ):
+                    return job
+
+            job = BuildJob(
+                build_context.mac,
+                build_context.profile.name,
+                version_hash,
+                files_digest,
+            )
+            self._jobs[job.job_id] = job
+
+            # Cached binaries do not need a build slot
+            cached = self.artifact_cache.get(version_hash, files_digest, mac_fc)
+            if cached is not None:
+                job.artifact_path = cached
+                job.log_path = self.artifact_cache.get_log(
+                    version_hash, files_digest, mac_fc
+                )
+                job.finish(BuildJobState.DONE)
+                return job
+
+            if self.cache_manager is not None:
+                for path in self._job_paths(job):
+                    self.cache_manager.pin(path)
+
+        # Outside the lock, other submissions do not wait for the disk
+        try:
+            self._snapshot_files(job)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning("Cannot snapshot the files of %s: %s", job.mac, exc)
+            if self.cache_manager is not None:
+                for path in self._job_paths(job):
+                    self.cache_manager.unpin(path)
+            job.finish(BuildJobState.FAILED, str(exc))
+            return job
+
+        with self._lock:
+            self._build_contexts[job.job_id] = build_context
+            self._queue.append(job)
+            self._dispatch()
+        return job
+
+    def get_job(self, job_id: str) -> Optional[BuildJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "running": self._running,
+                "max_workers": self.max_workers,
+                "max_per_profile": self.max_per_profile,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._queue:
+                job.finish(BuildJobState.FAILED, "Server is shutting down.")
+            self._queue.clear()
+            self._build_contexts.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
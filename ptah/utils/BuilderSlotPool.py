@@ -0,0 +1,111 @@
+import fcntl
+import logging
+import subprocess
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import rmtree
+from typing import Iterator, Optional, TextIO
+
+from ptah.models import BuilderManifest, PtahProfile
+from ptah.utils.builder_store import get_builder_path
+
+
+class BuilderSlotPool:
+    """
+    Isolated ImageBuilder working trees, so that builds can run in parallel.
+
+    Slots belong to a builder of the store, so profiles sharing an ImageBuilder
+    share its `max_slots` slots (BUILD_SLOTS_PER_BUILDER, the number of build
+    workers by default). Nothing is ever built in the extracted builder of the
+    store, it stays pristine. Every slot is a copy of it created on first use
+    with `cp --reflink=auto` (copy-on-write where the filesystem supports it) and
+    kept for later builds. A slot is held with an exclusive flock, which also works
+    across worker processes, and its previous root filesystem is cleaned before
+    it is handed out again.
+
+    Waiters are woken when a slot of this process is released, and check again
+    every `poll_interval` seconds for slots released by other processes.
+    """
+
+    slots_path: Path
+    max_slots: int
+
+    def __init__(self, slots_path: Path, max_slots: int):
+        self.slots_path = slots_path
+        self.max_slots = max(max_slots, 1)
+        self._released = threading.Condition()
+
+    @staticmethod
+    def builder_key(profile: PtahProfile) -> str:
+        """Key of the builder whose slots a profile uses."""
+        return BuilderManifest.builder_key(profile.openwrt_profile)
+
+    def _slot_path(self, profile: PtahProfile, slot: int) -> Path:
+        return self.slots_path / self.builder_key(profile) / f"slot-{slot}"
+
+    def _try_lock(self, profile: PtahProfile, slot: int) -> Optional[TextIO]:
+        lock_path = self.slots_path / self.builder_key(profile) / f"slot-{slot}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(lock_path, "a", encoding="utf-8")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _clone_slot(self, pristine_path: Path, slot_path: Path):
+        # Slots cloned while the store was still built in lack it, they are recreated
+        source_marker = slot_path / ".ptah_slot_pristine_source"
+        if source_marker.is_file() and source_marker.read_text() == str(pristine_path):
+            return
+        if slot_path.exists():
+            rmtree(slot_path)
+
+        logging.info("Creating builder slot %s from %s", slot_path, pristine_path)
+        clone_path = slot_path.parent / f".{slot_path.name}.{uuid.uuid4().hex}"
+        subprocess.run(
+            ["cp", "-a", "--reflink=auto", str(pristine_path), str(clone_path)],
+            check=True,
+        )
+        # Should the store have been built in, the clone starts clean anyway
+        rmtree(clone_path / "tmp", ignore_errors=True)
+        self._reset_slot(clone_path)
+        source_marker = clone_path / ".ptah_slot_pristine_source"
+        source_marker.write_text(str(pristine_path))
+        clone_path.rename(slot_path)
+
+    @staticmethod
+    def _reset_slot(slot_path: Path):
+        # Root filesystems left behind by a previous (maybe interrupted) build
+        for root_dir in slot_path.glob("build_dir/target-*/root*-*"):
+            if root_dir.is_dir():
+                rmtree(root_dir, ignore_errors=True)
+
+    @contextmanager
+    def acquire(
+        self, profile: PtahProfile, poll_interval: float = 1.0
+    ) -> Iterator[Path]:
+        """Wait for a free slot of the profile and yield its builder path."""
+        lock_file = None
+        with self._released:
+            while lock_file is None:
+                for slot in range(self.max_slots):
+                    lock_file = self._try_lock(profile, slot)
+                    if lock_file is not None:
+                        break
+                else:
+                    self._released.wait(poll_interval)
+
+        try:
+            slot_path = self._slot_path(profile, slot)
+            self._clone_slot(get_builder_path(profile.openwrt_profile), slot_path)
+            self._reset_slot(slot_path)
+            yield slot_path
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            with self._released:
+                self._released.notify_all()
@@ -0,0 +1,246 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable, Iterator, Optional
+
+
+class CacheEntry:
+    path: Path
+    last_access: float
+    size: int
+    # Bytes of files also linked from outside the entry, evicting does not free them
+    shared_size: int
+
+    def __init__(self, path: Path, last_access: float, size: int, shared_size: int = 0):
+        self.path = path
+        self.last_access = last_access
+        self.size = size
+        self.shared_size = shared_size
+
+
+def directory_usage(path: Path) -> tuple[int, int]:
+    """
+    Bytes used by the files of a directory (hardlinked files counted once), and
+    the part of it whose files are also linked from outside the directory.
+    """
+    links: Counter[tuple[int, int]] = Counter()
+    stats: dict[tuple[int, int], os.stat_result] = {}
+    for root, _, file_names in os.walk(path):
+        for file in file_names:
+            try:
+                stat = os.lstat(os.path.join(root, file))
+            except FileNotFoundError:
+                continue
+            links[(stat.st_dev, stat.st_ino)] += 1
+            stats[(stat.st_dev, stat.st_ino)] = stat
+    size = sum(stat.st_size for stat in stats.values())
+    shared_size = sum(
+        stat.st_size for inode, stat in stats.items() if stat.st_nlink > links[inode]
+    )
+    return size, shared_size
+
+
+class CacheArea:
+    """
+    A directory whose entries are evicted least recently used first.
+
+    Without a marker, the entries are the subdirectories of the area and their
+    mtime is their last access. With a marker, the entries are the directories
+    containing that file (at any depth) and the marker mtime is their last access.
+    """
+
+    name: str
+    path: Path
+    max_bytes: int
+    marker: Optional[str]
+
+    def __init__(
+        self, name: str, path: Path, max_bytes: int, marker: Optional[str] = None
+    ):
+        self.name = name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.marker = marker
+
+    def entry_paths(self) -> Iterator[tuple[Path, Path]]:
+        """Yield (entry, path whose mtime is the last access) pairs."""
+        if not self.path.is_dir():
+            return
+        if self.marker is None:
+            for entry_path in self.path.iterdir():
+                if entry_path.is_dir() and not entry_path.name.startswith("."):
+                    yield entry_path, entry_path
+            return
+        for root, dir_names, file_names in os.walk(self.path):
+            if self.marker in file_names:
+                dir_names.clear()
+                yield Path(root), Path(root) / self.marker
+            else:
+                dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+
+    def entries(self) -> list[CacheEntry]:
+        entries = []
+        for entry_path, access_path in self.entry_paths():
+            try:
+                last_access = access_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append(
+                CacheEntry(entry_path, last_access, *directory_usage(entry_path))
+            )
+        return entries
+
+
+class CacheManager:
+    """
+    Byte budgets for the on-disk cache areas (downloads, router files, build trees).
+
+    When an area grows over its budget, its least recently accessed entries are
+    removed, except the pinned ones (referenced by an in-flight prepare or build,
+    or a stored build context) and those accessed in the last `eviction_grace`
+    seconds. A budget of 0 means unlimited. Eviction runs every `interval`
+    seconds in a daemon thread, after the cleanups registered with `add_cleanup`
+    (which may release pins).
+
+    Budgets count the bytes an area references, hardlinked files once per
+    entry. Profile layers and router overlays hardlink the files of the download
+    cache, so evicting a download entry does not free the bytes of files still
+    linked from a layer or overlay, and the disk usage of the areas together may
+    exceed the sum of their budgets. `usage` reports those bytes as
+    `shared_bytes`, they are freed when the layers or overlays go.
+    """
+
+    areas: dict[str, CacheArea]
+    eviction_grace: float
+    interval: float
+
+    def __init__(self, eviction_grace: float, interval: float):
+        self.areas = {}
+        self.eviction_grace = eviction_grace
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pins: Counter[Path] = Counter()
+        self._evicted = Counter()
+        self._stopped = threading.Event()
+        self._evictor: Optional[threading.Thread] = None
+        self._cleanups: list[Callable[[], object]] = []
+
+    def add_area(self, area: CacheArea):
+        self.areas[area.name] = area
+
+    def add_cleanup(self, cleanup: Callable[[], object]):
+        self._cleanups.append(cleanup)
+
+    # ----------------------------------- Pinning ----------------------------------- #
+
+    def pin(self, path: Path):
+        with self._lock:
+            self._pins[path] += 1
+
+    def unpin(self, path: Path):
+        with self._lock:
+            self._pins[path] -= 1
+            if self._pins[path] <= 0:
+                del self._pins[path]
+
+    @contextmanager
+    def pinned(self, *paths: Path) -> Iterator[None]:
+        """Protect paths from eviction while the block runs."""
+        for path in paths:
+            self.pin(path)
+        try:
+            yield
+        finally:
+            for path in paths:
+                self.unpin(path)
+
+    def is_pinned(self, entry_path: Path) -> bool:
+        with self._lock:
+            return any(
+                pin == entry_path
+                or pin in entry_path.parents
+                or entry_path in pin.parents
+                for pin in self._pins
+            )
+
+    # ----------------------------------- Eviction ---------------------------------- #
+
+    def evict_area(self, area: CacheArea) -> int:
+        """Evict LRU entries of an area until it fits in its budget."""
+        if area.max_bytes <= 0:
+            return 0
+        entries = area.entries()
+        total_size = sum(entry.size for entry in entries)
+        now = time.time()
+        evicted = 0
+        for entry in sorted(entries, key=lambda entry: entry.last_access):
+            if total_size <= area.max_bytes:
+                break
+            if now - entry.last_access < self.eviction_grace:
+                continue
+            if self.is_pinned(entry.path):
+                continue
+            # Renamed first, so that the entry disappears at once
+            trash_path = (
+                entry.path.parent / f".{entry.path.name}.{uuid.uuid4().hex}.del"
+            )
+            try:
+                entry.path.rename(trash_path)
+            except FileNotFoundError:
+                continue
+            rmtree(trash_path, ignore_errors=True)
+            total_size -= entry.size
+            evicted += 1
+            logging.info("Evicted %s from the %s cache", entry.path, area.name)
+        with self._lock:
+            self._evicted[area.name] += evicted
+        return evicted
+
+    def evict(self) -> dict[str, int]:
+        for cleanup in self._cleanups:
+            try:
+                cleanup()
+            except Exception as exc:  # pylint: disable=broad-except
+                logging.warning("Cache cleanup failed: %s", exc)
+        return {name: self.evict_area(area) for name, area in self.areas.items()}
+
+    def usage(self) -> dict:
+        usage = {}
+        for name, area in self.areas.items():
+            entries = area.entries()
+            usage[name] = {
+                "path": str(area.path),
+                "entries": len(entries),
+                "bytes": sum(entry.size for entry in entries),
+                "shared_bytes": sum(entry.shared_size for entry in entries),
+                "max_bytes": area.max_bytes,
+                "pinned": sum(self.is_pinned(entry.path) for entry in entries),
+                "evicted": self._evicted[name],
+            }
+        return usage
+
+    def _evict_loop(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.evict()
+            except OSError as exc:
+                logging.warning("Cache eviction failed: %s", exc)
+
+    def start(self):
+        if self.interval <= 0 or self._evictor is not None:
+            return
+        self._evictor = threading.Thread(
+            target=self._evict_loop, name="cache-evictor", daemon=True
+        )
+        self._evictor.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._evictor is not None:
+            self._evictor.join(timeout=5)
@@ -0,0 +1,364 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional, cast
+
+
+from ptah.models import PortableMac, PtahProfile, VaultResponse
+from ptah.models.PtahConfig import VaultCertificates
+from ptah.models.VaultResponses import CertificateData
+from ptah.utils.HttpSessionPool import HttpSessionPool
+from ptah.utils.utils import build_url
+from ptah.utils.VaultLimiter import VaultLimiter
+from ptah.utils.VaultTokenManager import VaultTokenManager
+
+
+def certificate_common_name(mac: PortableMac, vault_certificates: VaultCertificates):
+    return f"{mac.to_filename_compliant()}{vault_certificates.cn_suffix}"
+
+
+def issue_vault_certificate(
+    http: HttpSessionPool,
+    vault_url: str,
+    vault_token: str,
+    vault_certificates: VaultCertificates,
+    common_name: str,
+) -> CertificateData:
+    """Have the Vault PKI issue a certificate and its private key."""
+    vault_pki_role_url = build_url(
+        str(vault_url),
+        "v1",
+        vault_certificates.pki_mount,
+        "issue",
+        vault_certificates.pki_role,
+    )
+    request = http.post(
+        vault_pki_role_url,
+        headers={"X-Vault-Token": vault_token},
+        json={
+            "common_name": common_name,
+            "format": "pem",
+        },
+        timeout=10,
+    )
+    request.raise_for_status()
+    return cast(CertificateData, VaultResponse.model_validate_json(request.text).data)
+
+
+class CertificatePool:
+    """
+    Router certificates issued ahead of their prepare.
+
+    Issuing makes Vault generate a key pair, the slowest step of a prepare. The
+    pool issues the certificates of expected routers in the background, on
+    `max_workers` threads, and keeps them on disk encrypted with the Vault transit
+    key `transit_key`. Only the expiration is stored in clear, entries are found
+    by a hash of the PKI mount, role and common name. A prepare uses
+    the pooled certificate of its router unless it expires within
+    `renew_before` seconds, and certificates issued inline are pooled for the
+    next prepare. Without a transit key, the pool is disabled.
+
+    Background jobs resolve the Kubernetes Vault token when they run, through
+    `vault_token_manager`, the token of the request that queued them may have
+    been replaced since. A pool error never fails a prepare, the certificate is
+    issued inline instead.
+    """
+
+    pool_path: Path
+    http: HttpSessionPool
+    vault_url: str
+    transit_mount: str
+    transit_key: Optional[str]
+    renew_before: float
+    max_workers: int
+    vault_limiter: VaultLimiter
+    vault_token_manager: Optional[VaultTokenManager]
+
+    def __init__(
+        self,
+        pool_path: Path,
+        http: HttpSessionPool,
+        vault_url: str,
+        transit_mount: str,
+        transit_key: Optional[str],
+        renew_before: float,
+        max_workers: int,
+        vault_limiter: VaultLimiter,
+        vault_token_manager: Optional[VaultTokenManager] = None,
+    ):
+        self.pool_path = pool_path
+        self.http = http
+        self.vault_url = vault_url
+        self.transit_mount = transit_mount
+        self.transit_key = transit_key
+        self.renew_before = renew_before
+        self.max_workers = max(max_workers, 1)
+        self.vault_limiter = vault_limiter
+        self.vault_token_manager = vault_token_manager
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="ptah-certificates"
+        )
+        self._lock = threading.Lock()
+        self._pending: set[Path] = set()
+        self.metrics = {
+            "hits": 0,
+            "misses": 0,
+            "issued": 0,
+            "failures": 0,
+        }
+        if self.enabled:
+            self.pool_path.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.transit_key)
+
+    def _entry_path(
+        self, vault_certificates: VaultCertificates, common_name: str
+    ) -> Path:
+        key = hashlib.sha256(
+            "\0".join(
+                (vault_certificates.pki_mount, vault_certificates.pki_role, common_name)
+            ).encode("utf-8")
+        ).hexdigest()
+        return self.pool_path / f"{key}.json"
+
+    # ---------------------------------- Encryption --------------------------------- #
+
+    def _transit(self, operation: str, vault_token: str, body: dict) -> dict:
+        url = build_url(
+            str(self.vault_url), "v1", self.transit_mount, operation, self.transit_key
+        )
+        with self.vault_limiter.slot(self.vault_url):
+            response = self.http.post(
+                url, headers={"X-Vault-Token": vault_token}, json=body, timeout=10
+            )
+        response.raise_for_status()
+        return response.json()["data"]
+
+    def _encrypt(self, vault_token: str, certificate: CertificateData) -> str:
+        plaintext = base64.b64encode(certificate.model_dump_json().encode("utf-8"))
+        data = self._transit("encrypt", vault_token, {"plaintext": plaintext.decode()})
+        return data["ciphertext"]
+
+    def _decrypt(self, vault_token: str, ciphertext: str) -> CertificateData:
+        data = self._transit("decrypt", vault_token, {"ciphertext": ciphertext})
+        return CertificateData.model_validate_json(base64.b64decode(data["plaintext"]))
+
+    # ----------------------------------- Storage ----------------------------------- #
+
+    def _read_entry(self, entry_path: Path) -> Optional[dict]:
+        """The pool entry at entry_path, None if it is missing or unusable."""
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            not isinstance(entry, dict)
+            or not isinstance(entry.get("expiration"), (int, float))
+            or not isinstance(entry.get("ciphertext"), str)
+        ):
+            return None
+        return entry
+
+    def _is_fresh(self, entry: Optional[dict]) -> bool:
+        return (
+            entry is not None and entry["expiration"] - time.time() > self.renew_before
+        )
+
+    def _token_getter(
+        self, vault_certificates: VaultCertificates, vault_token: str
+    ) -> Callable[[], str]:
+        """How a background job gets its Vault token when it runs."""
+        if (
+            vault_certificates.credentials.vault_token == "K8S_VAULT_TOKEN"
+            and self.vault_token_manager is not None
+        ):
+            return self.vault_token_manager.get_token
+        return lambda: vault_token
+
+    def store(
+        self,
+        vault_token: str,
+        vault_certificates: VaultCertificates,
+        common_name: str,
+        certificate: CertificateData,
+    ):
+        """Encrypt a certificate and write it to the pool."""
+        entry_path = self._entry_path(vault_certificates, common_name)
+        entry = {
+            "expiration": certificate.expiration,
+            "ciphertext": self._encrypt(vault_token, certificate),
+        }
+        temporary_path = self.pool_path / f".{entry_path.name}.{uuid.uuid4().hex}"
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temporary_path, entry_path)
+
+    def _issue(
+        self,
+        get_vault_token: Callable[[], str],
+        vault_certificates: VaultCertificates,
+        common_name: str,
+        certificate: Optional[CertificateData] = None,
+    ):
+        entry_path = self._entry_path(vault_certificates, common_name)
+        try:
+            vault_token = get_vault_token()
+            if certificate is None:
+                with self.vault_limiter.slot(self.vault_url):
+                    certificate = issue_vault_certificate(
+                        self.http,
+                        self.vault_url,
+                        vault_token,
+                        vault_certificates,
+                        common_name,
+                    )
+            self.store(vault_token, vault_certificates, common_name, certificate)
+            with self._lock:
+                self.metrics["issued"] += 1
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning(
+                "Failed to pool the certificate of %s: %s", common_name, exc
+            )
+            with self._lock:
+                self.metrics["failures"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(entry_path)
+
+    def _submit(
+        self,
+        get_vault_token: Callable[[], str],
+        vault_certificates: VaultCertificates,
+        common_name: str,
+        certificate: Optional[CertificateData] = None,
+    ) -> bool:
+        entry_path = self._entry_path(vault_certificates, common_name)
+        with self._lock:
+            if entry_path in self._pending:
+                return False
+            self._pending.add(entry_path)
+        self._executor.submit(
+            self._issue, get_vault_token, vault_certificates, common_name, certificate
+        )
+        return True
+
+    # ---------------------------------- Public API --------------------------------- #
+
+    def get(
+        self,
+        vault_token: str,
+        vault_certificates: VaultCertificates,
+        common_name: str,
+    ) -> Optional[CertificateData]:
+        """The pooled certificate of a router, None if it must be issued now."""
+        if not self.enabled:
+            return None
+        try:
+            entry = self._read_entry(self._entry_path(vault_certificates, common_name))
+            certificate = (
+                self._decrypt(vault_token, entry["ciphertext"])
+                if self._is_fresh(entry)
+                else None
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            # Issuing inline still works
+            logging.warning(
+                "Failed to read the pooled certificate of %s: %s", common_name, exc
+            )
+            certificate = None
+        if certificate is None:
+            with self._lock:
+                self.metrics["misses"] += 1
+            return None
+        with self._lock:
+            self.metrics["hits"] += 1
+        return certificate
+
+    def keep(
+        self,
+        vault_token: str,
+        vault_certificates: VaultCertificates,
+        common_name: str,
+        certificate: CertificateData,
+    ):
+        """Pool a certificate issued inline, in the background."""
+        if self.enabled:
+            self._submit(
+                self._token_getter(vault_certificates, vault_token),
+                vault_certificates,
+                common_name,
+                certificate,
+            )
+
+    def issue_ahead(
+        self, profile: PtahProfile, macs: list[PortableMac], secrets: dict
+    ) -> int:
+        """
+        Queue the issuance of the certificates of routers about to be prepared,
+        returns how many were queued. Fresh and pending certificates are skipped.
+        """
+        if not self.enabled:
+            raise RuntimeError("The certificate pool is disabled.")
+        self.prune()
+        certificate_entries = [
+            file_entry.vault_certificates
+            for file_entry in profile.files.router_specific_files or []
+            if file_entry.type == "vault_certificates" and file_entry.vault_certificates
+        ]
+        queued = 0
+        for mac in macs:
+            for vault_certificates in certificate_entries:
+                common_name = certificate_common_name(mac, vault_certificates)
+                entry_path = self._entry_path(vault_certificates, common_name)
+                if self._is_fresh(self._read_entry(entry_path)):
+                    continue
+                get_vault_token = self._token_getter(
+                    vault_certificates,
+                    secrets[vault_certificates.credentials.vault_token],
+                )
+                queued += self._submit(get_vault_token, vault_certificates, common_name)
+        return queued
+
+    def prune(self) -> int:
+        """Remove the expired certificates, returns how many were removed."""
+        removed = 0
+        for entry_path in self.pool_path.glob("*.json") if self.enabled else []:
+            entry = self._read_entry(entry_path)
+            if entry is None or entry["expiration"] <= time.time():
+                try:
+                    entry_path.unlink(missing_ok=True)
+                except OSError as exc:
+                    logging.warning("Failed to remove %s: %s", entry_path, exc)
+                    continue
+                removed += 1
+        return removed
+
+    def stats(self) -> dict:
+        entries = 0
+        fresh = 0
+        for entry_path in self.pool_path.glob("*.json") if self.enabled else []:
+            entries += 1
+            fresh += self._is_fresh(self._read_entry(entry_path))
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": entries,
+                "fresh": fresh,
+                "pending": len(self._pending),
+                "renew_before": self.renew_before,
+                **self.metrics,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,193 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import rmtree
+from typing import Callable, Iterator, Optional
+
+from ptah.utils.utils import file_sha256
+
+COMPLETE_MARKER = ".ptah_complete"
+
+
+class DownloadCache:
+    """
+    Directories of downloaded upstream content, populated atomically.
+
+    An entry is populated in a staging directory next to its final path,
+    verified, marked complete and renamed into place, so a crash or a concurrent
+    prepare never sees a half-populated entry. A directory without the
+    completion marker is not an entry and is fetched again. Concurrent fetches of
+    the same entry wait for a single download, in this process (thread lock)
+    and across worker processes (flock).
+
+    Entries whose marker records hashes (package files, extracted sources) are
+    re-verified by `scrub`, in a background thread every `scrub_interval`
+    seconds, and evicted when corrupt. `on_corrupt` is then called with the
+    entry path, for what was built out of its files (they may be hardlinked).
+    """
+
+    root: Path
+    scrub_interval: float
+    on_corrupt: Optional[Callable[[Path], object]]
+
+    def __init__(
+        self,
+        root: Path,
+        scrub_interval: float = 0,
+        on_corrupt: Optional[Callable[[Path], object]] = None,
+    ):
+        self.root = root
+        self.scrub_interval = scrub_interval
+        self.on_corrupt = on_corrupt
+        self._lock = threading.Lock()
+        self._key_locks: dict[Path, threading.Lock] = {}
+        self._stopped = threading.Event()
+        self._scrubber: Optional[threading.Thread] = None
+
+    @staticmethod
+    def is_complete(entry_path: Path) -> bool:
+        return (entry_path / COMPLETE_MARKER).is_file()
+
+    @staticmethod
+    def read_marker(entry_path: Path) -> dict:
+        with open(entry_path / COMPLETE_MARKER, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def touch(entry_path: Path):
+        """Record an access to the entry, the marker mtime drives LRU eviction."""
+        try:
+            os.utime(entry_path / COMPLETE_MARKER)
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _entry_lock(self, entry_path: Path) -> Iterator[None]:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(entry_path, threading.Lock())
+        lock_path = entry_path.parent / f".{entry_path.name}.lock"
+        with key_lock, open(lock_path, "a", encoding="utf-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(
+        self,
+        entry_path: Path,
+        populate: Callable[[Path], Optional[dict]],
+        verify: Optional[Callable[[Path], None]] = None,
+    ) -> Path:
+        """
+        Return entry_path once it is complete, populating it first if needed.
+        `populate` downloads into the staging directory it is given and may return
+        metadata stored in the completion marker. `verify` raises if the staged
+        content is not usable, in which case nothing is committed.
+        """
+        if self.is_complete(entry_path):
+            self.touch(entry_path)
+            return entry_path
+
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._entry_lock(entry_path):
+            if self.is_complete(entry_path):
+                return entry_path
+            if entry_path.exists():
+                logging.warning("Removing incomplete cache entry %s", entry_path)
+                rmtree(entry_path)
+
+            staging_path = (
+                entry_path.parent / f".{entry_path.name}.{uuid.uuid4().hex}.tmp"
+            )
+            staging_path.mkdir()
+            try:
+                metadata = populate(staging_path) or {}
+                if verify is not None:
+                    verify(staging_path)
+                marker = {"completed_at": time.time(), **metadata}
+                with open(staging_path / COMPLETE_MARKER, "w", encoding="utf-8") as f:
+                    json.dump(marker, f)
+                staging_path.rename(entry_path)
+            except BaseException:
+                rmtree(staging_path, ignore_errors=True)
+                raise
+        return entry_path
+
+    # ---------------------------------- Scrubbing ---------------------------------- #
+
+    @staticmethod
+    def verify_entry(entry_path: Path, marker: dict) -> bool:
+        """Check the content of an entry against the hashes of its marker."""
+        expected = {}
+        if "file_name" in marker and "file_sha256" in marker:
+            expected[entry_path / marker["file_name"]] = marker["file_sha256"]
+        for relative_path, sha256 in marker.get("files", {}).items():
+            expected[entry_path / "source" / relative_path] = sha256
+        for path, sha256 in expected.items():
+            try:
+                if file_sha256(path) != sha256:
+                    return False
+            except FileNotFoundError:
+                return False
+        return True
+
+    def evict(self, entry_path: Path):
+        # Renamed first, so that the entry disappears at once
+        trash_path = entry_path.parent / f".{entry_path.name}.{uuid.uuid4().hex}.del"
+        entry_path.rename(trash_path)
+        rmtree(trash_path, ignore_errors=True)
+
+    def scrub(self) -> int:
+        """Re-verify every cached entry and evict the corrupt ones."""
+        evicted = 0
+        for root, dir_names, file_names in os.walk(self.root):
+            if COMPLETE_MARKER not in file_names:
+                # Skip staging and trash directories
+                dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+                continue
+            # Do not descend into the entry itself
+            dir_names.clear()
+            entry_path = Path(root)
+            with self._entry_lock(entry_path):
+                try:
+                    marker = self.read_marker(entry_path)
+                except (FileNotFoundError, ValueError):
+                    continue
+                if self.verify_entry(entry_path, marker):
+                    continue
+                logging.warning("Evicting corrupt cache entry %s", entry_path)
+                self.evict(entry_path)
+                evicted += 1
+            # Layers built from it must go too, they may hardlink the bad files
+            if self.on_corrupt is not None:
+                self.on_corrupt(entry_path)
+        return evicted
+
+    def _scrub_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.scrub()
+            except OSError as exc:
+                logging.warning("Download cache scrub failed: %s", exc)
+            self._stopped.wait(self.scrub_interval)
+
+    def start_scrubber(self):
+        """Scrub now and then every scrub_interval seconds, in a daemon thread."""
+        if self.scrub_interval <= 0 or self._scrubber is not None:
+            return
+        self._scrubber = threading.Thread(
+            target=self._scrub_loop, name="download-cache-scrubber", daemon=True
+        )
+        self._scrubber.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._scrubber is not None:
+            self._scrubber.join(timeout=5)
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Optional
+
+from requests.structures import CaseInsensitiveDict
+
+from ptah.utils.HttpSessionPool import HttpSessionPool
+
+
+class MetadataResponse:
+    """The parts of a GitLab API response kept in the metadata cache."""
+
+    status_code: int
+    headers: CaseInsensitiveDict
+    content: bytes
+
+    def __init__(self, status_code: int, headers: CaseInsensitiveDict, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class MetadataEntry:
+    response: MetadataResponse
+    etag: Optional[str]
+    expires_at: float
+
+    def __init__(self, response: MetadataResponse, expires_at: float):
+        self.response = response
+        self.etag = response.headers.get("ETag")
+        self.expires_at = expires_at
+
+
+class GitlabMetadataCache:
+    """
+    Cache of GitLab metadata requests (release info, package listings, archive names).
+
+    Successful answers are served from memory for `ttl` seconds. Past that,
+    they are revalidated with If-None-Match when GitLab sent an ETag, so an
+    unchanged release costs a 304 instead of a full answer. Concurrent requests
+    for the same key share a single upstream call. Keys include a hash of the
+    token, so callers with different credentials never share entries.
+    """
+
+    http: HttpSessionPool
+    ttl: float
+    max_entries: int
+
+    def __init__(self, http: HttpSessionPool, ttl: float, max_entries: int):
+        self.http = http
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, MetadataEntry] = OrderedDict()
+        self._inflight: dict[tuple, Future] = {}
+        self._hits = 0
+        self._misses = 0
+        self._revalidations = 0
+
+    @staticmethod
+    def _key(method: str, url: str, token: str, params: Optional[dict]) -> tuple:
+        token_hash = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        return (
+            method,
+            str(url),
+            tuple(sorted((params or {}).items())),
+            token_hash,
+        )
+
+    def _fetch(
+        self,
+        method: str,
+        url: str,
+        headers: dict,
+        params: Optional[dict],
+        timeout: float,
+        entry: Optional[MetadataEntry],
+    ) -> MetadataEntry | MetadataResponse:
+        headers = dict(headers)
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        response = self.http.request(
+            method,
+            url,
+            headers=headers,
+            params=params,
+            timeout=timeout,
+            allow_redirects=method != "HEAD",
+        )
+        with response:
+            if response.status_code == 304 and entry is not None:
+                with self._lock:
+                    self._revalidations += 1
+                entry.expires_at = time.monotonic() + self.ttl
+                return entry
+            result = MetadataResponse(
+                response.status_code,
+                CaseInsensitiveDict(response.headers),
+                response.content,
+            )
+        if result.status_code != 200:
+            return result
+        return MetadataEntry(result, time.monotonic() + self.ttl)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        token: str,
+        headers: dict,
+        params: Optional[dict] = None,
+        timeout: float = 40,
+    ) -> MetadataResponse:
+        """Send a metadata request, or answer it from the cache."""
+        key = self._key(method, url, token, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry.response
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                self._misses += 1
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            result = future.result()
+            return result.response if isinstance(result, MetadataEntry) else result
+
+        try:
+            result = self._fetch(method, url, headers, params, timeout, entry)
+        except BaseException as exc:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(exc)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            if isinstance(result, MetadataEntry):
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        future.set_result(result)
+        return result.response if isinstance(result, MetadataEntry) else result
+
+    def get(self, url: str, token: str, headers: dict, **kwargs) -> MetadataResponse:
+        return self.request("GET", url, token, headers, **kwargs)
+
+    def head(self, url: str, token: str, headers: dict, **kwargs) -> MetadataResponse:
+        return self.request("HEAD", url, token, headers, **kwargs)
+
+    def invalidate(self, url_prefix: Optional[str] = None) -> int:
+        """Drop the entries whose URL starts with url_prefix (all of them by default)."""
+        with self._lock:
+            keys = [
+                key
+                for key in self._entries
+                if url_prefix is None or key[1].startswith(url_prefix)
+            ]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "revalidations": self._revalidations,
+            }
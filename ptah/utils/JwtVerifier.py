@@ -0,0 +1,266 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import jwt
+import requests
+from rezel_vault_jwt.jwt_transit_manager import JwtTransitManager
+
+from ptah.utils.HttpSessionPool import HttpSessionPool
+from ptah.utils.VaultTokenManager import VaultTokenManager
+
+# JWS algorithm of the signatures made by each type of transit key
+TRANSIT_ALGORITHMS = {
+    "ecdsa-p256": "ES256",
+    "ecdsa-p384": "ES384",
+    "ecdsa-p521": "ES512",
+    "ed25519": "EdDSA",
+    "rsa-2048": "PS256",
+    "rsa-3072": "PS256",
+    "rsa-4096": "PS256",
+}
+
+# Seconds between two fetches of the transit public keys, a token with an unknown
+# key version cannot make the verifier fetch them more often
+PUBLIC_KEYS_REFRESH_INTERVAL = 60
+
+
+class JwtVerification:
+    valid: bool
+    payload: Optional[dict]
+    expires_at: float
+
+    def __init__(self, valid: bool, payload: Optional[dict], expires_at: float):
+        self.valid = valid
+        self.payload = payload
+        self.expires_at = expires_at
+
+
+class JwtVerifier:
+    """
+    Verification of the router JWTs signed with the Vault transit key.
+
+    Results are cached by token digest: valid tokens until their `exp` (at most
+    `ttl` seconds), invalid ones for `negative_ttl` seconds. Errors are never
+    cached. A token past its `exp` is invalid, whatever its signature. With
+    `local`, the public keys of the transit key are fetched on first use (and
+    again on an unknown key version, at most every
+    PUBLIC_KEYS_REFRESH_INTERVAL seconds) and signatures are checked
+    in-process. A token that does not verify locally (unknown key version,
+    signature format) is still checked by Vault, only Vault's answer makes it
+    invalid.
+    """
+
+    vault_token_manager: VaultTokenManager
+    http: HttpSessionPool
+    vault_url: str
+    transit_mount: str
+    transit_key: str
+    ttl: float
+    negative_ttl: float
+    max_entries: int
+    local: bool
+
+    def __init__(
+        self,
+        vault_token_manager: VaultTokenManager,
+        http: HttpSessionPool,
+        vault_url: str,
+        transit_mount: str,
+        transit_key: str,
+        ttl: float,
+        negative_ttl: float,
+        max_entries: int,
+        local: bool = False,
+    ):
+        self.vault_token_manager = vault_token_manager
+        self.http = http
+        self.vault_url = vault_url
+        self.transit_mount = transit_mount
+        self.transit_key = transit_key
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max(max_entries, 1)
+        self.local = local
+        if local and not jwt.algorithms.has_crypto:
+            logging.warning(
+                "Local JWT verification needs the cryptography package, "
+                "verifying with Vault instead"
+            )
+            self.local = False
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, JwtVerification] = OrderedDict()
+        self._public_keys: Optional[dict[int, str]] = None
+        self._algorithm: Optional[str] = None
+        self._keys_lock = threading.Lock()
+        self._keys_loaded_at = float("-inf")
+        self.metrics = {
+            "hits": 0,
+            "local": 0,
+            "vault": 0,
+        }
+
+    @staticmethod
+    def _digest(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    # ----------------------------------- Caching ----------------------------------- #
+
+    def lookup(self, token: str) -> Optional[JwtVerification]:
+        """The cached verification of a token, without any Vault call."""
+        digest = self._digest(token)
+        with self._lock:
+            verification = self._entries.get(digest)
+            if verification is None:
+                return None
+            if verification.expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            self.metrics["hits"] += 1
+            return verification
+
+    def _store(self, token: str, verification: JwtVerification, source: str):
+        with self._lock:
+            self.metrics[source] += 1
+            self._entries[self._digest(token)] = verification
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # ------------------------------ Local verification ----------------------------- #
+
+    def _load_public_keys(self):
+        with self._keys_lock:
+            if time.monotonic() - self._keys_loaded_at < PUBLIC_KEYS_REFRESH_INTERVAL:
+                return
+            # Failures count too, an unreachable Vault is not asked on every token
+            self._keys_loaded_at = time.monotonic()
+            self._fetch_public_keys()
+
+    def _fetch_public_keys(self):
+        vault_url = str(self.vault_url).rstrip("/")
+        url = f"{vault_url}/v1/{self.transit_mount}/keys/{self.transit_key}"
+        response = self.http.get(
+            url,
+            headers={"X-Vault-Token": self.vault_token_manager.get_token()},
+            timeout=10,
+        )
+        response.raise_for_status()
+        data = response.json()["data"]
+        self._algorithm = TRANSIT_ALGORITHMS.get(data["type"])
+        self._public_keys = {
+            int(version): key["public_key"]
+            for version, key in data["keys"].items()
+            if isinstance(key, dict) and key.get("public_key")
+        }
+
+    @staticmethod
+    def _key_version(token: str) -> Optional[int]:
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            return None
+        try:
+            return int(str(kid).rsplit(":v", 1)[-1])
+        except ValueError:
+            return None
+
+    def _verify_locally(self, token: str) -> Optional[dict]:
+        """The payload of a token whose signature checks out locally, else None."""
+        version = self._key_version(token)
+        if self._public_keys is None or (
+            version is not None and version not in self._public_keys
+        ):
+            # First use, or the key was rotated since
+            self._load_public_keys()
+        if self._algorithm is None:
+            return None
+
+        public_keys = self._public_keys or {}
+        candidates = (
+            [public_keys[version]] if version in public_keys else public_keys.values()
+        )
+        for public_key in candidates:
+            try:
+                # Only the signature, as with Vault verify
+                return jwt.decode(
+                    token,
+                    public_key,
+                    algorithms=[self._algorithm],
+                    options={
+                        "verify_exp": False,
+                        "verify_nbf": False,
+                        "verify_iat": False,
+                        "verify_aud": False,
+                        "verify_iss": False,
+                    },
+                )
+            except jwt.InvalidTokenError:
+                continue
+        return None
+
+    # ------------------------------ Vault verification ----------------------------- #
+
+    def _verify_with_vault(self, token: str) -> bool:
+        vault_token = self.vault_token_manager.get_token()
+        jwt_manager = JwtTransitManager(
+            vault_token=vault_token,
+            vault_base_url=self.vault_url,
+            transit_mount=self.transit_mount,
+            transit_key=self.transit_key,
+        )
+        try:
+            return jwt_manager.verify_jwt(token)
+        except requests.HTTPError as exc:
+            # Vault rejected our token, log in again on the next call
+            if exc.response is not None and exc.response.status_code == 403:
+                self.vault_token_manager.invalidate(vault_token)
+            raise
+
+    # ---------------------------------- Public API --------------------------------- #
+
+    def verify(self, token: str) -> JwtVerification:
+        """Verify a token, from the cache when possible."""
+        verification = self.lookup(token)
+        if verification is not None:
+            return verification
+
+        now = time.time()
+        payload = None
+        if self.local:
+            try:
+                payload = self._verify_locally(token)
+            except (requests.RequestException, jwt.PyJWTError, KeyError) as exc:
+                logging.warning("Local JWT verification failed: %s", exc)
+
+        source = "local"
+        if payload is None:
+            source = "vault"
+            if not self._verify_with_vault(token):
+                verification = JwtVerification(False, None, now + self.negative_ttl)
+                self._store(token, verification, source)
+                return verification
+            payload = JwtTransitManager.decode_jwt(token)
+
+        expires_at = now + self.ttl
+        if isinstance(payload.get("exp"), (int, float)):
+            if payload["exp"] <= now:
+                verification = JwtVerification(False, None, now + self.negative_ttl)
+                self._store(token, verification, source)
+                return verification
+            expires_at = min(expires_at, payload["exp"])
+        verification = JwtVerification(True, payload, expires_at)
+        self._store(token, verification, source)
+        return verification
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "local_verification": self.local,
+                **self.metrics,
+            }
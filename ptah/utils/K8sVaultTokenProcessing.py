@@ -1,10 +1,18 @@
 import requests
 
+from ptah.utils.HttpSessionPool import HttpSessionPool
+
 
 class K8sVaultTokenProcessing:
-    def __init__(self, vault_url: str, vault_role_name: str):
+    def __init__(
+        self,
+        vault_url: str,
+        vault_role_name: str,
+        http: HttpSessionPool | None = None,
+    ):
         self.vault_url = vault_url
         self.vault_role_name = vault_role_name
+        self.http = http if http is not None else requests
 
     def get_ksa_jwt(self) -> str:
         """Retrieves the KSA JWT from the Kubernetes service account."""
@@ -13,7 +21,8 @@ class K8sVaultTokenProcessing:
         ) as f:
             return f.read()
 
-    def get_vault_token(self) -> str:
+    def login(self) -> dict:
+        """Logs in to Vault with the KSA JWT and returns the `auth` block of the response."""
         headers = {
             "Content-Type": "application/json",
         }
@@ -24,7 +33,23 @@ class K8sVaultTokenProcessing:
         }
 
         url = f"{self.vault_url}/v1/auth/kubernetes/login"
-        response = requests.post(url, headers=headers, json=body, timeout=10)
+        response = self.http.post(url, headers=headers, json=body, timeout=10)
+
+        response.raise_for_status()
+        return response.json()["auth"]
+
+    def get_vault_token(self) -> str:
+        return self.login()["client_token"]
+
+    def renew_token(self, token: str) -> dict:
+        """Renews the lease of a token and returns the `auth` block of the response."""
+        url = f"{self.vault_url}/v1/auth/token/renew-self"
+        response = self.http.post(url, headers={"X-Vault-Token": token}, timeout=10)
+
+        response.raise_for_status()
+        return response.json()["auth"]
 
+    def revoke_token(self, token: str) -> None:
+        url = f"{self.vault_url}/v1/auth/token/revoke-self"
+        response = self.http.post(url, headers={"X-Vault-Token": token}, timeout=10)
         response.raise_for_status()
-        return response.json()["auth"]["client_token"]
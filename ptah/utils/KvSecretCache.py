@@ -0,0 +1,196 @@
+import hashlib
+import threading
+import time
+from typing import Optional, cast
+
+import requests
+
+from ptah.models import VaultResponse
+from ptah.models.VaultResponses import KvData
+from ptah.utils.HttpSessionPool import HttpSessionPool
+from ptah.utils.utils import build_url
+from ptah.utils.VaultLimiter import VaultLimiter
+
+
+class KvSecretEntry:
+    fields: dict[str, bytes]
+    version: Optional[int]
+    checked_at: float
+
+    def __init__(self, fields: dict[str, bytes], version: Optional[int]):
+        self.fields = fields
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    def clear(self):
+        """Drop the references of the cache to the secret values."""
+        self.fields.clear()
+
+
+class KvSecretCache:
+    """
+    Secrets read from Vault KV v2, by (mount, path, Vault token).
+
+    The token is part of the key (as a digest), so a secret is only served to
+    callers whose token read it from Vault. A secret is served from memory for
+    `ttl` seconds. Past that, the version in its KV metadata is checked and the
+    secret is only read again if it changed. Concurrent reads of the same secret
+    wait for a single request.
+
+    Values are immutable bytes, shared with the callers. Replacing or
+    invalidating an entry drops the references of the cache, it does not
+    overwrite the values: Python strings and bytes cannot be wiped, and copies
+    remain in the HTTP response and the parsed model until garbage collected.
+    """
+
+    http: HttpSessionPool
+    vault_url: str
+    ttl: float
+    vault_limiter: VaultLimiter
+
+    def __init__(
+        self,
+        http: HttpSessionPool,
+        vault_url: str,
+        ttl: float,
+        vault_limiter: VaultLimiter,
+    ):
+        self.http = http
+        self.vault_url = vault_url
+        self.ttl = ttl
+        self.vault_limiter = vault_limiter
+        self._lock = threading.Lock()
+        # One lock per secret, shared by the tokens, so that token rotations do
+        # not leave locks behind
+        self._key_locks: dict[tuple[str, str], threading.Lock] = {}
+        # (mount, path, token digest) -> entry
+        self._entries: dict[tuple[str, str, str], KvSecretEntry] = {}
+        self.metrics = {
+            "hits": 0,
+            "reads": 0,
+            "version_checks": 0,
+        }
+
+    def _read(self, vault_token: str, mount: str, path: str) -> KvSecretEntry:
+        url = build_url(str(self.vault_url), "v1", mount, "data", path)
+        with self.vault_limiter.slot(self.vault_url):
+            response = self.http.get(
+                url, headers={"X-Vault-Token": vault_token}, timeout=10
+            )
+        response.raise_for_status()
+
+        kv_data = cast(KvData, VaultResponse.model_validate_json(response.text).data)
+        fields = {
+            name: value.encode("utf-8")
+            for name, value in kv_data.data.model_dump().items()
+            if isinstance(value, str)
+        }
+        return KvSecretEntry(fields, kv_data.metadata.get("version"))
+
+    def _current_version(
+        self, vault_token: str, mount: str, path: str
+    ) -> Optional[int]:
+        """Version of the secret in Vault, None if the metadata cannot be read."""
+        url = build_url(str(self.vault_url), "v1", mount, "metadata", path)
+        try:
+            with self.vault_limiter.slot(self.vault_url):
+                response = self.http.get(
+                    url, headers={"X-Vault-Token": vault_token}, timeout=10
+                )
+            response.raise_for_status()
+            return response.json()["data"]["current_version"]
+        except (requests.RequestException, KeyError, ValueError):
+            return None
+
+    @staticmethod
+    def _token_digest(vault_token: str) -> str:
+        return hashlib.sha256(vault_token.encode("utf-8")).hexdigest()
+
+    def _drop_stale(self, key: tuple[str, str, str]):
+        """Forget the expired entries of the same secret read with other tokens."""
+        now = time.monotonic()
+        with self._lock:
+            for other_key in list(self._entries):
+                if (
+                    other_key[:2] == key[:2]
+                    and other_key != key
+                    and now - self._entries[other_key].checked_at > self.ttl
+                ):
+                    # Not cleared, a reader of that token may be using it
+                    del self._entries[other_key]
+
+    def get(self, vault_token: str, mount: str, path: str, field: str) -> bytes:
+        """Return a field of a KV secret, reading Vault only when needed."""
+        key = (mount, path, self._token_digest(vault_token))
+        with self._lock:
+            key_lock = self._key_locks.setdefault((mount, path), threading.Lock())
+
+        with key_lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.checked_at > self.ttl:
+                self.metrics["version_checks"] += 1
+                version = self._current_version(vault_token, mount, path)
+                if version is not None and version == entry.version:
+                    entry.checked_at = time.monotonic()
+                else:
+                    entry = None
+
+            if entry is None:
+                self.metrics["reads"] += 1
+                entry = self._read(vault_token, mount, path)
+                with self._lock:
+                    previous = self._entries.get(key)
+                    self._entries[key] = entry
+                if previous is not None:
+                    previous.clear()
+                # Left behind by tokens replaced since (re-login)
+                self._drop_stale(key)
+            else:
+                self.metrics["hits"] += 1
+
+            if field not in entry.fields:
+                raise ValueError(f"Field '{field}' not found in secret {mount}/{path}.")
+            return entry.fields[field]
+
+    def invalidate(
+        self, mount: Optional[str] = None, path: Optional[str] = None
+    ) -> int:
+        """Forget the secrets matching mount and path (all of them by default)."""
+        with self._lock:
+            keys = [
+                key
+                for key in self._entries
+                if (mount is None or key[0] == mount)
+                and (path is None or key[1] == path)
+            ]
+        invalidated = 0
+        for key in keys:
+            # Not while a reader refreshes the entry
+            with self._key_locks[key[:2]]:
+                with self._lock:
+                    entry = self._entries.pop(key, None)
+                if entry is not None:
+                    entry.clear()
+                    invalidated += 1
+        return invalidated
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "secrets": [
+                    {
+                        "mount": mount,
+                        "path": path,
+                        "token": token_digest[:12],
+                        "version": entry.version,
+                        "checked_ago": now - entry.checked_at,
+                    }
+                    for (mount, path, token_digest), entry in self._entries.items()
+                ],
+                **self.metrics,
+            }
+
+    def close(self):
+        self.invalidate()
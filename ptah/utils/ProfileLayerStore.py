@@ -0,0 +1,154 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from shutil import rmtree
+from typing import Iterator
+
+from ptah.models import PathTransferHandler, PtahProfile
+from ptah.models.RouterFilesOrganizer import FilesOrganizer
+
+
+class ProfileLayerStore:
+    """
+    Shared files layers, assembled once per profile and upstream versions.
+
+    Everything the shared files of a profile contribute is the same for every
+    router, so it is assembled into a layer keyed by the versions list (which
+    starts with the hash of the profile config). A layer is built in a staging
+    directory and renamed into place, it is never modified afterwards and router
+    overlays are assembled on top of it. Only the `keep_per_profile` most recently
+    used layers of a profile are kept.
+
+    Layers hardlink the files of the download cache, so the sources of each layer
+    are recorded next to it and `invalidate_source` drops the layers built from
+    a cache entry found corrupt.
+    """
+
+    layers_path: Path
+    keep_per_profile: int
+
+    def __init__(self, layers_path: Path, keep_per_profile: int):
+        self.layers_path = layers_path
+        self.keep_per_profile = max(keep_per_profile, 1)
+        self._lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def layer_key(versions: list[str]) -> str:
+        _hash = hashlib.sha256()
+        for version in versions:
+            _hash.update(version.encode("utf-8"))
+            _hash.update(b"\0")
+        return _hash.hexdigest()
+
+    @staticmethod
+    def _sources_path(profile_path: Path, key: str) -> Path:
+        # Not inside the layer, whose content ends up in the image
+        return profile_path / f".{key}.sources"
+
+    def _remove_layer(self, profile_path: Path, layer_path: Path):
+        rmtree(layer_path, ignore_errors=True)
+        (profile_path / f".{layer_path.name}.lock").unlink(missing_ok=True)
+        self._sources_path(profile_path, layer_path.name).unlink(missing_ok=True)
+
+    @contextmanager
+    def _key_lock(self, profile_path: Path, key: str) -> Iterator[None]:
+        # One builder per layer in this process, the flock covers other workers
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock, open(
+            profile_path / f".{key}.lock", "a", encoding="utf-8"
+        ) as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_or_create(
+        self,
+        profile: PtahProfile,
+        versions: list[str],
+        file_transfer_entries: list[PathTransferHandler],
+    ) -> Path:
+        """Return the layer of these shared files, assembling it on first use."""
+        key = self.layer_key(versions)
+        profile_path = self.layers_path / profile.name
+        layer_path = profile_path / key
+
+        if not layer_path.is_dir():
+            profile_path.mkdir(parents=True, exist_ok=True)
+            with self._key_lock(profile_path, key):
+                if not layer_path.is_dir():
+                    staging_path = profile_path / f".{key}.{uuid.uuid4().hex}"
+                    organizer = FilesOrganizer()
+                    organizer.file_transfer_entries = list(file_transfer_entries)
+                    with open(
+                        self._sources_path(profile_path, key), "w", encoding="utf-8"
+                    ) as f:
+                        json.dump(
+                            [str(entry.source) for entry in file_transfer_entries], f
+                        )
+                    try:
+                        organizer.assemble(staging_path)
+                        staging_path.rename(layer_path)
+                    except BaseException:
+                        rmtree(staging_path, ignore_errors=True)
+                        raise
+                    logging.info("Assembled shared files layer %s", layer_path)
+            self.prune(profile_path, layer_path)
+
+        # The directory mtime tells when the layer was last used
+        os.utime(layer_path)
+        return layer_path
+
+    def prune(self, profile_path: Path, current_layer: Path):
+        """Remove the least recently used layers of a profile over the limit."""
+        layers = []
+        for layer_path in profile_path.iterdir():
+            if (
+                layer_path.name.startswith(".")
+                or layer_path == current_layer
+                or not layer_path.is_dir()
+            ):
+                continue
+            try:
+                layers.append((layer_path.stat().st_mtime, layer_path))
+            except FileNotFoundError:
+                continue
+
+        for _, layer_path in sorted(layers, reverse=True)[self.keep_per_profile - 1 :]:
+            logging.info("Removing unused shared files layer %s", layer_path)
+            self._remove_layer(profile_path, layer_path)
+
+    def invalidate_source(self, entry_path: Path) -> int:
+        """Remove the layers with files from entry_path, returns how many were removed."""
+        removed = 0
+        for sources_path in self.layers_path.glob("*/.*.sources"):
+            try:
+                with open(sources_path, "r", encoding="utf-8") as f:
+                    sources = [Path(source) for source in json.load(f)]
+            except (FileNotFoundError, ValueError):
+                continue
+            if not any(
+                source == entry_path or entry_path in source.parents
+                for source in sources
+            ):
+                continue
+            profile_path = sources_path.parent
+            key = sources_path.name[1 : -len(".sources")]
+            logging.warning(
+                "Removing shared files layer %s, built from %s",
+                profile_path / key,
+                entry_path,
+            )
+            with self._key_lock(profile_path, key):
+                removed += (profile_path / key).is_dir()
+                self._remove_layer(profile_path, profile_path / key)
+        return removed
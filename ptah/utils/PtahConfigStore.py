@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+from pathlib import Path
+
+from ptah.models import PtahConfig
+from ptah.utils.utils import load_ptah_config
+
+
+class PtahConfigSnapshot:
+    generation: int
+    config: PtahConfig
+
+    def __init__(self, generation: int, config: PtahConfig):
+        self.generation = generation
+        self.config = config
+
+
+class PtahConfigStore:
+    """
+    Keeps the validated ptah config in memory and reloads it when the file changes.
+
+    The file is stat'ed at most once every `reload_interval` seconds. A new
+    snapshot (with an incremented generation) is only swapped in once the new
+    content has been parsed and validated, so a broken edit keeps serving the
+    previous configuration.
+    """
+
+    config_path: Path
+    reload_interval: float
+
+    def __init__(self, config_path: Path, reload_interval: float):
+        self.config_path = config_path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._file_id = self._stat_config_file()
+        self._snapshot = PtahConfigSnapshot(1, load_ptah_config(config_path))
+        self._last_check = time.monotonic()
+
+    def _stat_config_file(self) -> tuple[int, int, int, int]:
+        # stat() follows symlinks, so Kubernetes ConfigMap swaps show up as a new inode
+        stat = self.config_path.stat()
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _reload_if_changed(self):
+        # Only one thread checks the file, the others keep the current snapshot
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._last_check = time.monotonic()
+            try:
+                file_id = self._stat_config_file()
+            except OSError as exc:
+                logging.warning("Cannot stat config %s: %s", self.config_path, exc)
+                return
+            if file_id == self._file_id:
+                return
+
+            # Remember the file even if it is invalid, to avoid parsing it again and again
+            self._file_id = file_id
+            try:
+                config = load_ptah_config(self.config_path)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception(
+                    "Invalid config %s, keeping generation %d",
+                    self.config_path,
+                    self._snapshot.generation,
+                )
+                return
+
+            self._snapshot = PtahConfigSnapshot(self._snapshot.generation + 1, config)
+            logging.info(
+                "Reloaded config %s (generation %d)",
+                self.config_path,
+                self._snapshot.generation,
+            )
+        finally:
+            self._lock.release()
+
+    def snapshot(self) -> PtahConfigSnapshot:
+        """Return the current config snapshot, reloading it first if the file changed."""
+        if time.monotonic() - self._last_check >= self.reload_interval:
+            self._reload_if_changed()
+        return self._snapshot
+
+    @property
+    def generation(self) -> int:
+        return self._snapshot.generation
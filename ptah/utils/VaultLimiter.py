@@ -0,0 +1,29 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class VaultLimiter:
+    """
+    Bound on the Vault calls in flight, per Vault server.
+
+    Prepares issue their secrets concurrently, and batches prepare many routers
+    at once, so the limit is shared by every prepare of the process.
+    """
+
+    max_concurrency: int
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max(max_concurrency, 1)
+        self._lock = threading.Lock()
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+
+    @contextmanager
+    def slot(self, vault_url: str) -> Iterator[None]:
+        """Hold one of the call slots of a Vault server while the block runs."""
+        with self._lock:
+            semaphore = self._semaphores.setdefault(
+                str(vault_url), threading.BoundedSemaphore(self.max_concurrency)
+            )
+        with semaphore:
+            yield
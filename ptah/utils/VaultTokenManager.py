@@ -0,0 +1,186 @@
+import logging
+import math
+import threading
+import time
+from typing import Optional
+
+import requests
+
+from ptah.utils.K8sVaultTokenProcessing import K8sVaultTokenProcessing
+
+
+class VaultTokenManager:
+    """
+    Process-wide cache of the Vault token obtained through Kubernetes auth.
+
+    The lease returned by the login is tracked and the token is renewed in a
+    background thread once `renew_fraction` of it has elapsed. A new login only
+    happens when the token cannot be renewed, has expired, or was rejected by
+    Vault (see `invalidate`). Replaced tokens are revoked.
+    """
+
+    token_processing: K8sVaultTokenProcessing
+    renew_fraction: float
+    min_ttl: float
+    metrics: dict[str, int]
+
+    def __init__(
+        self,
+        token_processing: K8sVaultTokenProcessing,
+        renew_fraction: float = 2 / 3,
+        min_ttl: float = 10.0,
+    ):
+        self.token_processing = token_processing
+        self.renew_fraction = renew_fraction
+        self.min_ttl = min_ttl
+        self.metrics = {
+            "cache_hits": 0,
+            "logins": 0,
+            "renewals": 0,
+            "renewal_failures": 0,
+            "invalidations": 0,
+        }
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+
+        self._token: Optional[str] = None
+        self._renewable = False
+        self._lease_duration = 0
+        self._lease_start = 0.0
+
+    # ------------------------------- Lease tracking -------------------------------- #
+
+    def _store_auth(self, auth: dict):
+        self._token = auth["client_token"]
+        self._renewable = bool(auth.get("renewable", False))
+        self._lease_duration = int(auth.get("lease_duration", 0))
+        self._lease_start = time.monotonic()
+
+    def _expires_at(self) -> float:
+        # A lease duration of 0 means the token never expires
+        if self._lease_duration <= 0:
+            return math.inf
+        return self._lease_start + self._lease_duration
+
+    def _renew_at(self) -> float:
+        if self._lease_duration <= 0:
+            return math.inf
+        return self._lease_start + self._lease_duration * self.renew_fraction
+
+    def _revoke_quietly(self, token: str):
+        try:
+            self.token_processing.revoke_token(token)
+        except requests.RequestException as exc:
+            logging.warning("Failed to revoke replaced Vault token: %s", exc)
+
+    def _login(self):
+        """Log in again, must be called with the lock held."""
+        previous_token = self._token
+        self._store_auth(self.token_processing.login())
+        self.metrics["logins"] += 1
+        if previous_token and previous_token != self._token:
+            self._revoke_quietly(previous_token)
+
+        if self._renewer is None and not self._stopped.is_set():
+            self._renewer = threading.Thread(
+                target=self._renew_loop, name="vault-token-renewer", daemon=True
+            )
+            self._renewer.start()
+        self._wakeup.set()
+
+    # ------------------------------- Background renewal ---------------------------- #
+
+    def _refresh(self):
+        with self._lock:
+            token = self._token
+            renewable = self._renewable
+        if token is None:
+            return
+
+        auth = None
+        if renewable:
+            try:
+                auth = self.token_processing.renew_token(token)
+            except (requests.RequestException, KeyError) as exc:
+                self.metrics["renewal_failures"] += 1
+                logging.warning("Failed to renew Vault token: %s", exc)
+
+        with self._lock:
+            if self._token != token:
+                # Someone logged in again in the meantime
+                return
+            if (
+                auth is not None
+                and int(auth.get("lease_duration", 0)) > 2 * self.min_ttl
+            ):
+                self._store_auth(auth)
+                self.metrics["renewals"] += 1
+                return
+            # Not renewable, renewal failed or max TTL reached: log in again
+            try:
+                self._login()
+            except requests.RequestException as exc:
+                logging.warning("Failed to log in to Vault: %s", exc)
+
+    def _renew_loop(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                renew_at = self._renew_at() if self._token is not None else math.inf
+            delay = renew_at - time.monotonic()
+            if delay <= 0:
+                self._refresh()
+                with self._lock:
+                    # Back off before retrying if neither renewal nor login worked
+                    retry = (
+                        self._token is not None and self._renew_at() <= time.monotonic()
+                    )
+                delay = self.min_ttl if retry else 0
+            if delay > 0:
+                self._wakeup.wait(None if math.isinf(delay) else max(delay, 1.0))
+                self._wakeup.clear()
+
+    # ---------------------------------- Public API --------------------------------- #
+
+    def get_token(self) -> str:
+        with self._lock:
+            if (
+                self._token is not None
+                and time.monotonic() < self._expires_at() - self.min_ttl
+            ):
+                self.metrics["cache_hits"] += 1
+                return self._token
+            self._login()
+            return self._token
+
+    def invalidate(self, token: Optional[str]):
+        """Forget a token that Vault rejected, so that the next call logs in again."""
+        with self._lock:
+            if token is not None and token == self._token:
+                self._token = None
+                self.metrics["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            ttl = None
+            if self._token is not None and self._lease_duration > 0:
+                ttl = max(self._expires_at() - time.monotonic(), 0.0)
+            return {
+                **self.metrics,
+                "has_token": self._token is not None,
+                "renewable": self._renewable,
+                "ttl": ttl,
+            }
+
+    def stop(self):
+        """Stop the renewal thread and revoke the current token."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._renewer is not None:
+            self._renewer.join(timeout=5)
+        with self._lock:
+            if self._token is not None:
+                self._revoke_quietly(self._token)
+                self._token = None
@@ -0,0 +1,49 @@
+import asyncio
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class WorkPools:
+    """
+    Bounded executors for the blocking work of the request handlers.
+
+    Handlers are async and hand their blocking calls to the pool of their kind
+    of work (Vault calls, router prepares, disk scans), so that a burst of slow
+    prepares cannot take the threads of the cheap endpoints and health checks.
+    Background tasks (batches) use the same pools through `submit`, so that they
+    count against the same limits. Builds are not run here, they go through the
+    build scheduler.
+    """
+
+    sizes: dict[str, int]
+
+    def __init__(self, sizes: dict[str, int]):
+        self.sizes = sizes
+        self._executors = {
+            kind: ThreadPoolExecutor(
+                max_workers=max(size, 1), thread_name_prefix=f"ptah-{kind}"
+            )
+            for kind, size in sizes.items()
+        }
+
+    async def run(
+        self, kind: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> T:
+        """Run func in the pool of `kind` and wait for its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executors[kind], functools.partial(func, *args, **kwargs)
+        )
+
+    def submit(
+        self, kind: str, func: Callable[..., T], *args: Any, **kwargs: Any
+    ) -> Future:
+        """Queue func in the pool of `kind`, from a thread outside the event loop."""
+        return self._executors[kind].submit(func, *args, **kwargs)
+
+    def shutdown(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
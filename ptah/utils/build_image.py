@@ -0,0 +1,78 @@
+import subprocess
+from collections import deque
+from pathlib import Path
+from typing import Callable, Optional
+
+from ptah.env import ENV
+from ptah.models import PtahProfile
+from ptah.utils.utils import recreate_dir
+
+
+BUILD_LOG_NAME = "build.log"
+
+
+class ImageBuildError(RuntimeError):
+    """The ImageBuilder failed to produce the sysupgrade binary."""
+
+
+def build_output_path(mac: str, job_id: str) -> Path:
+    """Directory of the binary and log of a build job, one per job."""
+    return ENV.output_path / mac / job_id
+
+
+def run_make_build(
+    profile: PtahProfile,
+    mac: str,
+    builder_path: Path,
+    files_path: Path,
+    output_path: Path,
+    on_line: Optional[Callable[[str], None]] = None,
+) -> Path:
+    """
+    Run `make image` for a router in the given ImageBuilder tree, with the
+    router files found in files_path, and return the path of the generated binary
+    (in output_path). The output is written to the build log next to the binary
+    as it comes, and each line is passed to `on_line`.
+    """
+    packages = " ".join(profile.packages) if profile.packages else ""
+    make_image_cmd = [
+        "make",
+        "image",
+        f"PROFILE={profile.openwrt_profile.name}",
+        f"PACKAGES={packages}",
+        f"EXTRA_IMAGE_NAME=ptah-{mac}",
+        f"BIN_DIR={output_path}",
+        f"FILES={files_path}",
+    ]
+
+    recreate_dir(output_path)
+
+    # Last lines of output, to tell why a build failed
+    tail: deque[str] = deque(maxlen=10)
+    with open(
+        output_path / BUILD_LOG_NAME, "w", encoding="utf-8", buffering=1
+    ) as log_file, subprocess.Popen(
+        make_image_cmd,
+        cwd=builder_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+    ) as process:
+        for line in process.stdout:
+            log_file.write(line)
+            line = line.rstrip("\n")
+            tail.append(line)
+            if on_line is not None:
+                on_line(line)
+        returncode = process.wait()
+
+    if returncode != 0:
+        output = "\n".join(tail)
+        raise ImageBuildError(f"make image failed for {mac}:\n{output}")
+
+    binary_name = profile.openwrt_profile.get_generated_binary_name(mac)
+    binary_path = output_path / binary_name
+    if not binary_path.exists():
+        raise ImageBuildError(f"make image did not produce {binary_name}")
+    return binary_path
@@ -0,0 +1,49 @@
+import logging
+from pathlib import Path
+from shutil import rmtree
+
+from ptah.env import ENV
+from ptah.models.BuilderManifest import BuilderManifest
+from ptah.models.PtahConfig import OpenWrtProfile
+
+
+def get_builder_store_path() -> Path:
+    return ENV.builders_path / "store"
+
+
+def get_builder_manifest_path() -> Path:
+    return ENV.builders_path / "manifest.json"
+
+
+def load_builder_manifest() -> BuilderManifest:
+    return BuilderManifest.load(get_builder_manifest_path())
+
+
+def get_builder_path(openwrt_profile: OpenWrtProfile) -> Path:
+    """Return the path of the extracted ImageBuilder used by an OpenWrt profile."""
+    key = BuilderManifest.builder_key(openwrt_profile)
+    entry = load_builder_manifest().builders.get(key)
+    if entry is None:
+        raise ValueError(
+            f"No ImageBuilder for {key} in the builder store, "
+            "run prepare_environment.py with a config using it."
+        )
+    return get_builder_store_path() / key / entry.folder
+
+
+def collect_unused_builders(manifest: BuilderManifest) -> list[str]:
+    """
+    Remove the builders no profile references anymore, and any leftover
+    directory of the store that the manifest does not know about.
+    """
+    store_path = get_builder_store_path()
+    removed = manifest.unreferenced()
+    for key in removed:
+        del manifest.builders[key]
+
+    if store_path.is_dir():
+        for builder_dir in store_path.iterdir():
+            if builder_dir.name not in manifest.builders:
+                logging.info("Removing unused ImageBuilder %s", builder_dir.name)
+                rmtree(builder_dir)
+    return removed
@@ -1,60 +1,81 @@
 import jwt
-import requests
 
+from functools import partial
 from pathlib import Path
-from typing import cast
+from typing import Callable
 from rezel_vault_jwt.jwt_transit_manager import JwtTransitManager
 from rezel_vault_jwt.jwt_payload_builder import JwtPayloadBuilder
 
 from ptah.contexts import BuildContext
 from ptah.env import ENV
 from ptah.models import PathTransferHandler, SpecificFileEntry
-from ptah.models import VaultResponse
-from ptah.models.VaultResponses import CertificateData, PtahSecretsData
-from ptah.utils.utils import build_url, echo_to_file, recreate_dir
+from ptah.utils.utils import (
+    directory_sha256,
+    echo_to_file,
+    recreate_dir,
+    run_concurrently,
+)
+from ptah.utils.CertificatePool import (
+    CertificatePool,
+    certificate_common_name,
+    issue_vault_certificate,
+)
+from ptah.utils.KvSecretCache import KvSecretCache
+from ptah.utils.VaultLimiter import VaultLimiter
 
 
 class RouterSpecificFilesHandler:
-    def __init__(self, build_context: BuildContext):
+    """
+    Issue the secrets of a router (certificates, JWTs) and write its files.
+
+    Entries are independent Vault calls, they are issued concurrently within the
+    limit of the Vault limiter, then applied in config order. The version files
+    are written once every entry is done.
+    """
+
+    def __init__(
+        self,
+        build_context: BuildContext,
+        vault_limiter: VaultLimiter,
+        kv_secrets: KvSecretCache,
+        certificates: CertificatePool,
+    ):
         self.build_context = build_context
+        self.vault_limiter = vault_limiter
+        self.kv_secrets = kv_secrets
+        self.certificates = certificates
         self.jwt_payload_builder = JwtPayloadBuilder()
 
     def handle_vault_certificates(
         self, file_entry: SpecificFileEntry, temporary_dir: Path
-    ):
+    ) -> list[PathTransferHandler]:
         """
         Handle vault certificates for the router.
         """
         if not file_entry.vault_certificates:
             raise ValueError("Vault certificates information is missing.")
         vault_certificates = file_entry.vault_certificates
-        vault_pki_role_url = build_url(
-            str(ENV.vault_url),
-            "v1",
-            vault_certificates.pki_mount,
-            "issue",
-            vault_certificates.pki_role,
-        )
-
         vault_token = self.build_context.secrets[
             vault_certificates.credentials.vault_token
         ]
-        cert_cn = f"{self.build_context.mac.to_filename_compliant()}{vault_certificates.cn_suffix}"
-
-        request = requests.post(
-            vault_pki_role_url,
-            headers={"X-Vault-Token": vault_token},
-            json={
-                "common_name": cert_cn,
-                "format": "pem",
-            },
-            timeout=10,
-        )
-        request.raise_for_status()
+        cert_cn = certificate_common_name(self.build_context.mac, vault_certificates)
 
-        vault_cert_data = cast(
-            CertificateData, VaultResponse.model_validate_json(request.text).data
+        # Issuing generates a key pair, use a pre-issued certificate if there is one
+        vault_cert_data = self.certificates.get(
+            vault_token, vault_certificates, cert_cn
         )
+        if vault_cert_data is None:
+            with self.vault_limiter.slot(ENV.vault_url):
+                vault_cert_data = issue_vault_certificate(
+                    self.build_context.http,
+                    ENV.vault_url,
+                    vault_token,
+                    vault_certificates,
+                    cert_cn,
+                )
+            self.certificates.keep(
+                vault_token, vault_certificates, cert_cn, vault_cert_data
+            )
         cert_data = vault_cert_data.certificate
         key_data = vault_cert_data.private_key
 
@@ -65,6 +86,7 @@ class RouterSpecificFilesHandler:
             (key_file_name, key_data),
         ]
 
+        file_transfer_entries = []
         for filename, content in cert_files:
             temp_path = temporary_dir / filename
             with open(temp_path, "w", encoding="utf-8") as f:
@@ -72,42 +94,27 @@ class RouterSpecificFilesHandler:
 
             destination_path = Path(vault_certificates.destination) / filename
 
-            self.build_context.router_files.file_transfer_entries.append(
+            file_transfer_entries.append(
                 PathTransferHandler(source=temp_path, dest=destination_path)
             )
+        return file_transfer_entries
 
     def handle_jwt_from_vault_secrets(
         self,
         file_entry: SpecificFileEntry,
         temporary_dir: Path,
-    ):
+    ) -> list[PathTransferHandler]:
         """
         Handle JWT secrets from vault for the router.
         """
         if not file_entry.jwt_from_vault_secrets:
             raise ValueError("JWT from Vault secrets information is missing.")
         jwt_secrets = file_entry.jwt_from_vault_secrets
-        vault_kv_path = build_url(
-            str(ENV.vault_url),
-            "v1",
-            jwt_secrets.kv_mount,
-            "data",
-            jwt_secrets.kv_path,
-        )
         vault_token = self.build_context.secrets[jwt_secrets.credentials.vault_token]
-
-        request = requests.get(
-            vault_kv_path,
-            headers={"X-Vault-Token": vault_token},
-            timeout=10,
+        # The signing secret is the same for every router
+        jwt_secret = self.kv_secrets.get(
+            vault_token, jwt_secrets.kv_mount, jwt_secrets.kv_path, "jwt_secret_1"
         )
-        request.raise_for_status()
-
-        ptah_secrets_data = cast(
-            PtahSecretsData,
-            VaultResponse.model_validate_json(request.text).data.data,
-        )
-        jwt_secret = ptah_secrets_data.jwt_secret_1
 
         payload = self.jwt_payload_builder.create_ptah_payload(
             mac=self.build_context.mac
@@ -122,15 +129,13 @@ class RouterSpecificFilesHandler:
 
         destination_path = Path(jwt_secrets.destination) / jwt_file_name
 
-        self.build_context.router_files.file_transfer_entries.append(
-            PathTransferHandler(source=temp_path, dest=destination_path)
-        )
+        return [PathTransferHandler(source=temp_path, dest=destination_path)]
 
     def handle_jwt_from_vault_transit(
         self,
         file_entry: SpecificFileEntry,
         temporary_dir: Path,
-    ):
+    ) -> list[PathTransferHandler]:
         """
         Handle JWT secrets from vault for the router.
         """
@@ -148,7 +153,8 @@ class RouterSpecificFilesHandler:
         payload = self.jwt_payload_builder.create_ptah_payload(
             mac=self.build_context.mac
         )
-        encoded = jwt_manager.issue_jwt(payload)
+        with self.vault_limiter.slot(ENV.vault_url):
+            encoded = jwt_manager.issue_jwt(payload)
 
         jwt_file_name = f"{file_entry.name}.jwt"
         temp_path = temporary_dir / jwt_file_name
@@ -157,9 +163,18 @@ class RouterSpecificFilesHandler:
 
         destination_path = Path(jwt_transit.destination) / jwt_file_name
 
-        self.build_context.router_files.file_transfer_entries.append(
-            PathTransferHandler(source=temp_path, dest=destination_path)
-        )
+        return [PathTransferHandler(source=temp_path, dest=destination_path)]
+
+    def get_file_entry_handler(
+        self, file_entry: SpecificFileEntry
+    ) -> Callable[[SpecificFileEntry, Path], list[PathTransferHandler]]:
+        if file_entry.type == "vault_certificates":
+            return self.handle_vault_certificates
+        if file_entry.type == "jwt_from_vault_secrets":
+            return self.handle_jwt_from_vault_secrets
+        if file_entry.type == "jwt_from_vault_transit":
+            return self.handle_jwt_from_vault_transit
+        raise ValueError(f"Unknown file entry type: {file_entry.type}")
 
     def handle_router_specific_files(self):
         """
@@ -174,15 +189,18 @@ class RouterSpecificFilesHandler:
         router_files_config = self.build_context.profile.files.router_specific_files
         if not router_files_config:
             return
-        for file_entry in router_files_config:
-            if file_entry.type == "vault_certificates":
-                self.handle_vault_certificates(file_entry, router_temp_dir)
-            elif file_entry.type == "jwt_from_vault_secrets":
-                self.handle_jwt_from_vault_secrets(file_entry, router_temp_dir)
-            elif file_entry.type == "jwt_from_vault_transit":
-                self.handle_jwt_from_vault_transit(file_entry, router_temp_dir)
-            else:
-                raise ValueError(f"Unknown file entry type: {file_entry.type}")
+        tasks = [
+            partial(
+                self.get_file_entry_handler(file_entry), file_entry, router_temp_dir
+            )
+            for file_entry in router_files_config
+        ]
+
+        # Issued concurrently, applied in config order
+        for file_transfer_entries in run_concurrently(tasks, len(tasks)):
+            self.build_context.router_files.file_transfer_entries.extend(
+                file_transfer_entries
+            )
 
         self.build_context.final_version = (
             self.build_context.versions.compute_versions_hash()
@@ -207,3 +225,7 @@ class RouterSpecificFilesHandler:
                 dest=Path("/etc/stack_env"),
             )
         )
+
+        # The versions hash does not cover the secrets, cached binaries are also
+        # keyed by this digest
+        self.build_context.router_files.files_digest = directory_sha256(router_temp_dir)
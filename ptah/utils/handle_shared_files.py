@@ -1,30 +1,44 @@
+import hashlib
 import logging
-from pathlib import Path
+import os
+import tarfile
+import threading
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path, PurePosixPath
+from typing import Callable, Optional, TypeVar
 
 import requests
 import re
-import zipfile
 
 from pydantic import HttpUrl
 from ptah.env import ENV
 from ptah.models import FileEntry, GitlabRelease, PathTransferHandler
 from ptah.contexts import BuildContext
-from ptah.models.PtahConfig import GenericPackage
-from ptah.utils.utils import build_url
+from ptah.models.PtahConfig import GenericPackage, Source
+from ptah.utils.CacheManager import CacheManager
+from ptah.utils.GitlabMetadataCache import GitlabMetadataCache, MetadataResponse
+from ptah.utils.HttpSessionPool import HttpSessionPool
+from ptah.utils.ProfileLayerStore import ProfileLayerStore
+from ptah.utils.utils import build_url, run_concurrently
+
+T = TypeVar("T")
 
 
 def fetch_gitlab_api(
-    url: HttpUrl, token: str, params: dict = None
-) -> requests.Response:
-    """Send GET request to GitLab API with token."""
-    return requests.get(
-        url, headers={"PRIVATE-TOKEN": token}, params=params, timeout=40
+    metadata: GitlabMetadataCache, url: HttpUrl, token: str, params: dict = None
+) -> MetadataResponse:
+    """Send GET request to GitLab API with token, through the metadata cache."""
+    return metadata.get(
+        url, token, headers={"PRIVATE-TOKEN": token}, params=params, timeout=40
     )
 
 
-def get_gitlab_release_info(release_url: HttpUrl, token: str) -> dict:
+def get_gitlab_release_info(
+    metadata: GitlabMetadataCache, release_url: HttpUrl, token: str
+) -> dict:
     """Retrieve release metadata from GitLab."""
-    response = fetch_gitlab_api(release_url, token)
+    response = fetch_gitlab_api(metadata, release_url, token)
     if response.status_code == 200:
         return response.json()
     raise ValueError(f"Failed to fetch release information: {response.status_code}")
@@ -39,6 +53,7 @@ def extract_sha_from_filename(filename: str) -> str:
 
 
 def get_gitlab_generic_package_info(
+    metadata: GitlabMetadataCache,
     gitlab_url: HttpUrl,
     project_id: str,
     package_name: str,
@@ -49,7 +64,7 @@ def get_gitlab_generic_package_info(
         str(gitlab_url), "api/v4/projects", project_id, "packages"
     )
     params = {"package_name": package_name, "package_type": "generic", "per_page": 100}
-    response = fetch_gitlab_api(list_packages_api_url, token, params=params)
+    response = fetch_gitlab_api(metadata, list_packages_api_url, token, params=params)
     if response.status_code != 200:
         raise ValueError(
             f"Failed to fetch package list for '{package_name}': {response.status_code}"
@@ -76,7 +91,7 @@ def get_gitlab_generic_package_info(
         "package_files",
     )
 
-    files_response = fetch_gitlab_api(package_files_api_url, token)
+    files_response = fetch_gitlab_api(metadata, package_files_api_url, token)
     if files_response.status_code != 200:
         raise ValueError(
             f"Failed to fetch files for package ID '{package_id}': {files_response.status_code}"
@@ -84,13 +99,21 @@ def get_gitlab_generic_package_info(
     return files_response.json()
 
 
-def download_gitlab_file(url: HttpUrl, download_dir: Path, token: str) -> str:
+def download_gitlab_file(
+    http: HttpSessionPool,
+    url: HttpUrl,
+    download_dir: Path,
+    token: str,
+    expected_sha256: Optional[str] = None,
+) -> str:
     """
     Download an asset from a GitLab release and save it to the specified directory.
+    When expected_sha256 is given, the content is hashed while it is written and
+    the file is removed if it does not match.
     Returns the downloaded filename.
     """
     headers = {"Authorization": f"Bearer {token}"}
-    with requests.get(url, headers=headers, stream=True, timeout=40) as response:
+    with http.get(url, headers=headers, stream=True, timeout=40) as response:
         response.raise_for_status()
 
         content_disposition = response.headers.get("Content-Disposition", "")
@@ -101,35 +124,64 @@ def download_gitlab_file(url: HttpUrl, download_dir: Path, token: str) -> str:
         filename = match.group(1)
         file_path = download_dir / filename
 
+        sha256 = hashlib.sha256()
         with open(file_path, "wb") as output_file:
             for chunk in response.iter_content(chunk_size=8192):
+                sha256.update(chunk)
                 output_file.write(chunk)
 
+    if expected_sha256 is not None and sha256.hexdigest() != expected_sha256:
+        file_path.unlink()
+        raise ValueError(
+            f"Checksum mismatch for {filename}: "
+            f"expected {expected_sha256}, got {sha256.hexdigest()}"
+        )
     return filename
 
 
-def get_gitlab_archive_filename(url: HttpUrl, token: str) -> str:
+def get_gitlab_archive_filename(
+    metadata: GitlabMetadataCache, url: HttpUrl, token: str
+) -> str:
     headers = {"Authorization": f"Bearer {token}"}
 
-    with requests.head(url, headers=headers, timeout=30) as response:
-        response.raise_for_status()
-        content_disposition = response.headers.get("Content-Disposition", "")
-        match = re.search(r'filename="([^"]+)"', content_disposition)
-        if not match:
-            raise ValueError(
-                "Filename could not be extracted from 'Content-Disposition' header."
-            )
-        filename = match.group(1)
-        return filename
+    response = metadata.head(url, token, headers=headers, timeout=30)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to resolve archive of {url}: {response.status_code}")
+    content_disposition = response.headers.get("Content-Disposition", "")
+    match = re.search(r'filename="([^"]+)"', content_disposition)
+    if not match:
+        raise ValueError(
+            "Filename could not be extracted from 'Content-Disposition' header."
+        )
+    filename = match.group(1)
+    return filename
+
+
+def run_in_slot(
+    download_slots: Optional[threading.Semaphore], task: Callable[..., T], *args
+) -> T:
+    """Run a download once one of the download slots is free."""
+    with download_slots if download_slots is not None else nullcontext():
+        return task(*args)
 
 
 def download_gitlab_release_files(
+    http: HttpSessionPool,
     release_config: GitlabRelease,
     release_info: dict,
     token: str,
     target_dir: Path,
-) -> None:
-    """Download assets and source from a GitLab release into target directory."""
+    max_workers: int = 1,
+    download_slots: Optional[threading.Semaphore] = None,
+) -> dict[str, str]:
+    """
+    Download assets and source from a GitLab release into target directory.
+    Up to `max_workers` downloads run at the same time, each holding one of
+    `download_slots` when given.
+    Returns the sha256 of the extracted source files.
+    """
+
+    downloads: list[Callable[[], str | dict[str, str]]] = []
 
     if release_config.assets:
         asset_links = release_info["assets"]["links"]
@@ -138,7 +190,17 @@ def download_gitlab_release_files(
         for expected_asset in release_config.assets:
             if expected_asset.name not in asset_url_map:
                 raise ValueError(f"Asset '{expected_asset.name}' not found in release.")
-            download_gitlab_file(asset_url_map[expected_asset.name], target_dir, token)
+            downloads.append(
+                partial(
+                    run_in_slot,
+                    download_slots,
+                    download_gitlab_file,
+                    http,
+                    asset_url_map[expected_asset.name],
+                    target_dir,
+                    token,
+                )
+            )
 
     if release_config.source:
 
@@ -147,41 +209,200 @@ def download_gitlab_release_files(
             "api/v4/projects",
             release_config.project_id,
             "repository",
-            "archive.zip",
+            "archive.tar.gz",
         )
 
-        zip_filename = download_gitlab_file(archive_url, target_dir, token)
-
-        with zipfile.ZipFile(target_dir / zip_filename, "r") as zip_ref:
-            zip_ref.extractall(target_dir)
+        downloads.append(
+            partial(
+                run_in_slot,
+                download_slots,
+                download_gitlab_repo_archive,
+                http,
+                archive_url,
+                token,
+                target_dir,
+                release_config.source.paths,
+            )
+        )
 
-        extracted_dir = target_dir / Path(zip_filename).stem
-        extracted_dir.rename(target_dir / "source")
+    results = run_concurrently(downloads, max_workers)
+    return results[-1] if release_config.source else {}
 
 
 def download_gitlab_repo_archive(
+    http: HttpSessionPool,
+    archive_url: HttpUrl,
+    token: str,
+    target_dir: Path,
+    paths: list[Path],
+) -> dict[str, str]:
+    """
+    Stream a repository tar.gz archive into target_dir/source, keeping only the
+    members under `paths`. The archive is never written to disk.
+    Returns the sha256 of each extracted file, by path relative to the source.
+    """
+    headers = {"Authorization": f"Bearer {token}"}
+    # GitLab can restrict the archive to a single path
+    params = {"path": str(paths[0])} if len(paths) == 1 else None
+    wanted_paths = [PurePosixPath(path) for path in paths]
+    source_dir = target_dir / "source"
+    source_dir.mkdir()
+    file_hashes = {}
+
+    with http.get(
+        archive_url, headers=headers, params=params, stream=True, timeout=40
+    ) as response:
+        response.raise_for_status()
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as tar:
+            for member in tar:
+                # Members are under a "<project>-<sha>" top folder
+                parts = PurePosixPath(member.name).parts
+                if len(parts) < 2:
+                    continue
+                relative_path = PurePosixPath(*parts[1:])
+                if not any(
+                    relative_path == path or path in relative_path.parents
+                    for path in wanted_paths
+                ):
+                    continue
+
+                member.name = str(relative_path)
+                # Rejects absolute paths and links escaping the source folder
+                member = tarfile.data_filter(member, str(source_dir))
+                if not member.isreg():
+                    tar.extract(member, source_dir, filter="data")
+                    continue
+
+                file_path = source_dir / member.name
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                sha256 = hashlib.sha256()
+                with tar.extractfile(member) as src, open(file_path, "wb") as dst:
+                    while chunk := src.read(1024 * 1024):
+                        sha256.update(chunk)
+                        dst.write(chunk)
+                file_path.chmod(member.mode)
+                os.utime(file_path, (member.mtime, member.mtime))
+                file_hashes[member.name] = sha256.hexdigest()
+
+    return file_hashes
+
+
+def populate_gitlab_repo_archive(
+    http: HttpSessionPool,
     archive_url: HttpUrl,
     token: str,
+    archive_commit_sha: str,
+    paths: list[Path],
     target_dir: Path,
-) -> None:
-    zip_filename = download_gitlab_file(archive_url, target_dir, token)
+) -> dict:
+    file_hashes = download_gitlab_repo_archive(
+        http, archive_url, token, target_dir, paths
+    )
+    return {"commit_sha": archive_commit_sha, "files": file_hashes}
 
-    with zipfile.ZipFile(target_dir / zip_filename, "r") as zip_ref:
-        zip_ref.extractall(target_dir)
 
-    extracted_dir = target_dir / Path(zip_filename).stem
-    extracted_dir.rename(target_dir / "source")
+def populate_gitlab_package_file(
+    http: HttpSessionPool,
+    url: HttpUrl,
+    token: str,
+    file_sha256: str,
+    target_dir: Path,
+) -> dict:
+    filename = download_gitlab_file(http, url, target_dir, token, file_sha256)
+    return {"file_name": filename, "file_sha256": file_sha256}
+
+
+def check_package_file(filename: str, package_output_dir: Path) -> None:
+    if not (package_output_dir / filename).is_file():
+        raise ValueError(f"Downloaded package file '{filename}' not found.")
+
+
+def source_transfer_entries(
+    source: Source, output_dir: Path
+) -> list[PathTransferHandler]:
+    """Source paths of a downloaded archive, raises if one is missing."""
+    file_transfer_entries = []
+    for source_path in source.paths:
+        full_source_path = output_dir / "source" / source_path
+        if not full_source_path.is_dir():
+            raise ValueError(f"Source path '{source_path}' not found.")
+        file_transfer_entries.append(
+            PathTransferHandler(
+                source=full_source_path,
+                dest=Path("/"),
+            )
+        )
+    return file_transfer_entries
+
+
+class SharedFileResult:
+    """Versions and files contributed by a single shared file entry."""
+
+    versions: list[str]
+    file_transfer_entries: list[PathTransferHandler]
+
+    def __init__(self):
+        self.versions = []
+        self.file_transfer_entries = []
+
+    def extend(self, other: "SharedFileResult"):
+        self.versions.extend(other.versions)
+        self.file_transfer_entries.extend(other.file_transfer_entries)
 
 
 class SharedFilesHandler:
-    def __init__(self, build_context: BuildContext):
-        self.build_context = build_context
+    """
+    Resolve and download the shared files of a profile.
+
+    Entries are resolved on a pool of `max_workers` threads. Downloads, wherever
+    they are started from, share `max_workers` download slots, so a prepare never
+    has more downloads running at once. Results are then applied to the build
+    context in config order, so the version hash stays deterministic.
+    With a profile layer store, the files are assembled once into a layer shared
+    by every router of the profile, used as the base of the router files.
+
+    The download cache entries used are pinned in the cache manager until the
+    layer is assembled (it hardlinks their files), so that a slow prepare does
+    not have its sources evicted under it.
+    """
 
-    def handle_gitlab_release_file(self, file_entry: FileEntry):
+    def __init__(
+        self,
+        build_context: BuildContext,
+        max_workers: int = 1,
+        profile_layers: Optional[ProfileLayerStore] = None,
+        cache_manager: Optional[CacheManager] = None,
+    ):
+        self.build_context = build_context
+        self.max_workers = max_workers
+        self.profile_layers = profile_layers
+        self.cache_manager = cache_manager
+        self.download_slots = threading.BoundedSemaphore(max(max_workers, 1))
+        self._pins_lock = threading.Lock()
+        self._pins: list[Path] = []
+
+    def pin(self, entry_path: Path):
+        """Protect a download cache entry until the shared files are handled."""
+        if self.cache_manager is None:
+            return
+        self.cache_manager.pin(entry_path)
+        with self._pins_lock:
+            self._pins.append(entry_path)
+
+    def unpin_all(self):
+        if self.cache_manager is None:
+            return
+        with self._pins_lock:
+            pins, self._pins = self._pins, []
+        for entry_path in pins:
+            self.cache_manager.unpin(entry_path)
+
+    def handle_gitlab_release_file(self, file_entry: FileEntry) -> SharedFileResult:
         """Process GitLab release-based file entry."""
         if not file_entry.gitlab_release:
             raise ValueError("GitLab release information is missing.")
 
+        result = SharedFileResult()
         token_name = file_entry.gitlab_release.credentials.token
         token = self.build_context.secrets[token_name]
         gitlab_release = file_entry.gitlab_release
@@ -192,31 +413,63 @@ class SharedFilesHandler:
             "releases",
             gitlab_release.release_path,
         )
-        release_info = get_gitlab_release_info(release_url, token)
+        release_info = get_gitlab_release_info(
+            self.build_context.gitlab_metadata, release_url, token
+        )
         release_tag = str(release_info["tag_name"])
 
-        self.build_context.versions._versions.append(f"{file_entry.name}{release_tag}")
+        result.versions.append(f"{file_entry.name}{release_tag}")
 
         release_output_dir = (
             Path(ENV.gitlab_releases_output_path) / file_entry.name / release_tag
         )
 
-        if not release_output_dir.is_dir():
-            release_output_dir.mkdir(parents=True, exist_ok=True)
-            download_gitlab_release_files(
-                file_entry.gitlab_release,
+        self.pin(release_output_dir)
+        self.build_context.download_cache.fetch(
+            release_output_dir,
+            partial(
+                self.populate_gitlab_release,
+                file_entry,
                 release_info,
                 token,
-                release_output_dir,
-            )
+            ),
+            partial(self.release_transfer_entries, file_entry),
+        )
+        result.file_transfer_entries.extend(
+            self.release_transfer_entries(file_entry, release_output_dir)
+        )
+        return result
+
+    def populate_gitlab_release(
+        self,
+        file_entry: FileEntry,
+        release_info: dict,
+        token: str,
+        target_dir: Path,
+    ) -> dict:
+        file_hashes = download_gitlab_release_files(
+            self.build_context.http,
+            file_entry.gitlab_release,
+            release_info,
+            token,
+            target_dir,
+            self.max_workers,
+            self.download_slots,
+        )
+        return {"release_tag": str(release_info["tag_name"]), "files": file_hashes}
 
+    def release_transfer_entries(
+        self, file_entry: FileEntry, release_output_dir: Path
+    ) -> list[PathTransferHandler]:
+        """Files of a downloaded release, raises if an expected one is missing."""
+        file_transfer_entries = []
         downloaded_files = {item.name for item in release_output_dir.iterdir()}
 
         if file_entry.gitlab_release.assets:
             for asset in file_entry.gitlab_release.assets:
                 if asset.name not in downloaded_files:
                     raise ValueError(f"Expected asset '{asset.name}' not found.")
-                self.build_context.router_files.file_transfer_entries.append(
+                file_transfer_entries.append(
                     PathTransferHandler(
                         source=release_output_dir / asset.name,
                         dest=asset.destination,
@@ -225,21 +478,19 @@ class SharedFilesHandler:
                 )
 
         if file_entry.gitlab_release.source:
-            for source_path in file_entry.gitlab_release.source.paths:
-                full_source_path = release_output_dir / "source" / source_path
-                if not full_source_path.is_dir():
-                    raise ValueError(f"Source path '{source_path}' not found.")
-                self.build_context.router_files.file_transfer_entries.append(
-                    PathTransferHandler(
-                        source=full_source_path,
-                        dest=Path("/"),
-                    )
+            file_transfer_entries.extend(
+                source_transfer_entries(
+                    file_entry.gitlab_release.source, release_output_dir
                 )
+            )
+
+        return file_transfer_entries
 
-    def handle_gitlab_repo_archive(self, file_entry: FileEntry):
+    def handle_gitlab_repo_archive(self, file_entry: FileEntry) -> SharedFileResult:
         if not file_entry.gitlab_repo_archive:
             raise ValueError("GitLab repo archive information is missing.")
 
+        result = SharedFileResult()
         token_name = file_entry.gitlab_repo_archive.credentials.token
         token = self.build_context.secrets[token_name]
         gitlab_repo_archive = file_entry.gitlab_repo_archive
@@ -249,114 +500,196 @@ class SharedFilesHandler:
             "api/v4/projects",
             gitlab_repo_archive.project_id,
             "repository",
-            "archive.zip?sha=" + gitlab_repo_archive.sha,
+            "archive.tar.gz?sha=" + gitlab_repo_archive.sha,
         )
         archive_commit_sha = extract_sha_from_filename(
-            get_gitlab_archive_filename(archive_url, token)
+            get_gitlab_archive_filename(
+                self.build_context.gitlab_metadata, archive_url, token
+            )
         )
 
         repo_archive_output_dir = (
             Path(ENV.gitlab_releases_output_path) / file_entry.name / archive_commit_sha
         )
 
-        if not repo_archive_output_dir.is_dir():
-            repo_archive_output_dir.mkdir(parents=True, exist_ok=True)
-            download_gitlab_repo_archive(
+        source = file_entry.gitlab_repo_archive.source
+        self.pin(repo_archive_output_dir)
+        self.build_context.download_cache.fetch(
+            repo_archive_output_dir,
+            partial(
+                run_in_slot,
+                self.download_slots,
+                populate_gitlab_repo_archive,
+                self.build_context.http,
                 archive_url,
                 token,
-                repo_archive_output_dir,
-            )
+                archive_commit_sha,
+                source.paths,
+            ),
+            partial(source_transfer_entries, source),
+        )
 
-        self.build_context.versions._versions.append(
-            f"{file_entry.name}{archive_commit_sha}"
+        result.versions.append(f"{file_entry.name}{archive_commit_sha}")
+        result.file_transfer_entries.extend(
+            source_transfer_entries(source, repo_archive_output_dir)
         )
 
-        for source_path in file_entry.gitlab_repo_archive.source.paths:
-            full_source_path = repo_archive_output_dir / "source" / source_path
-            if not full_source_path.is_dir():
-                raise ValueError(f"Source path '{source_path}' not found.")
-            self.build_context.router_files.file_transfer_entries.append(
+        return result
+
+    def handle_gitlab_generic_package(
+        self,
+        file_entry: FileEntry,
+        generic_pkg: GenericPackage,
+        token: str,
+    ) -> tuple[SharedFileResult, list[Callable[[], Path]]]:
+        """
+        Resolve a single generic package of a GitLab packages-based file entry.
+        Returns its result and the downloads of its files missing from the cache.
+        """
+        result = SharedFileResult()
+        gitlab_packages_config = file_entry.gitlab_packages
+        package_files_list = get_gitlab_generic_package_info(
+            self.build_context.gitlab_metadata,
+            gitlab_packages_config.gitlab_url,
+            gitlab_packages_config.project_id,
+            generic_pkg.name,
+            generic_pkg.version,
+            token,
+        )
+        package_files_metadata = {f["file_name"]: f for f in package_files_list}
+        downloads: list[Callable[[], Path]] = []
+        for file_to_download in generic_pkg.files:
+            if file_to_download.name not in package_files_metadata:
+                raise ValueError(
+                    f"File '{file_to_download.name}' not found in package "
+                    f"'{generic_pkg.name}' version '{generic_pkg.version}'."
+                )
+
+            file_metadata = package_files_metadata[file_to_download.name]
+            file_sha256 = str(file_metadata["file_sha256"])
+
+            result.versions.append(
+                f"{file_entry.name}:{generic_pkg.name}:{file_sha256}"
+            )
+
+            package_output_dir = (
+                ENV.gitlab_releases_output_path
+                / file_entry.name
+                / generic_pkg.name
+                / file_sha256
+            )
+            downloaded_file_path = package_output_dir / file_to_download.name
+
+            download_cache = self.build_context.download_cache
+            self.pin(package_output_dir)
+            if download_cache.is_complete(package_output_dir):
+                # A use all the same, for the LRU eviction of the cache
+                download_cache.touch(package_output_dir)
+            else:
+                download_url = build_url(
+                    str(gitlab_packages_config.gitlab_url),
+                    "api/v4/projects",
+                    gitlab_packages_config.project_id,
+                    "packages/generic",
+                    generic_pkg.name,
+                    generic_pkg.version,
+                    file_to_download.name,
+                )
+                downloads.append(
+                    partial(
+                        download_cache.fetch,
+                        package_output_dir,
+                        partial(
+                            run_in_slot,
+                            self.download_slots,
+                            populate_gitlab_package_file,
+                            self.build_context.http,
+                            download_url,
+                            token,
+                            file_sha256,
+                        ),
+                        partial(check_package_file, file_to_download.name),
+                    )
+                )
+
+            result.file_transfer_entries.append(
                 PathTransferHandler(
-                    source=full_source_path,
-                    dest=Path("/"),
+                    source=downloaded_file_path,
+                    dest=file_to_download.destination,
+                    permission=file_to_download.permission,
                 )
             )
 
-    def handle_gitlab_packages(self, file_entry: FileEntry):
+        return result, downloads
+
+    def handle_gitlab_packages(self, file_entry: FileEntry) -> SharedFileResult:
         """Process GitLab generic packages-based file entry."""
         if not file_entry.gitlab_packages:
             raise ValueError("GitLab packages information is missing.")
 
         token_name = file_entry.gitlab_packages.credentials.token
         token = self.build_context.secrets[token_name]
-        gitlab_packages_config = file_entry.gitlab_packages
-
-        for generic_pkg in gitlab_packages_config.generic_packages:
-            package_files_list = get_gitlab_generic_package_info(
-                gitlab_packages_config.gitlab_url,
-                gitlab_packages_config.project_id,
-                generic_pkg.name,
-                generic_pkg.version,
-                token,
-            )
-            package_files_metadata = {f["file_name"]: f for f in package_files_list}
-            for file_to_download in generic_pkg.files:
-                if file_to_download.name not in package_files_metadata:
-                    raise ValueError(
-                        f"File '{file_to_download.name}' not found in package "
-                        f"'{generic_pkg.name}' version '{generic_pkg.version}'."
-                    )
-
-                file_metadata = package_files_metadata[file_to_download.name]
-                file_sha256 = str(file_metadata["file_sha256"])
-
-                self.build_context.versions._versions.append(
-                    f"{file_entry.name}:{generic_pkg.name}:{file_sha256}"
-                )
 
-                package_output_dir = (
-                    ENV.gitlab_releases_output_path
-                    / file_entry.name
-                    / generic_pkg.name
-                    / file_sha256
-                )
-                downloaded_file_path = package_output_dir / file_to_download.name
-
-                if not downloaded_file_path.is_file():
-                    package_output_dir.mkdir(parents=True, exist_ok=True)
-                    download_url = build_url(
-                        str(gitlab_packages_config.gitlab_url),
-                        "api/v4/projects",
-                        gitlab_packages_config.project_id,
-                        "packages/generic",
-                        generic_pkg.name,
-                        generic_pkg.version,
-                        file_to_download.name,
-                    )
-                    download_gitlab_file(download_url, package_output_dir, token)
-
-                self.build_context.router_files.file_transfer_entries.append(
-                    PathTransferHandler(
-                        source=downloaded_file_path,
-                        dest=file_to_download.destination,
-                        permission=file_to_download.permission,
-                    )
-                )
+        result = SharedFileResult()
+        downloads: list[Callable[[], Path]] = []
+        for package_result, package_downloads in run_concurrently(
+            [
+                partial(self.handle_gitlab_generic_package, file_entry, pkg, token)
+                for pkg in file_entry.gitlab_packages.generic_packages
+            ],
+            self.max_workers,
+        ):
+            result.extend(package_result)
+            downloads.extend(package_downloads)
+
+        # The files of every package, in a single pool
+        run_concurrently(downloads, self.max_workers)
+        return result
+
+    def get_file_entry_handler(
+        self, file_entry: FileEntry
+    ) -> Callable[[FileEntry], SharedFileResult]:
+        if file_entry.type == "git":
+            raise NotImplementedError("Git repository handling is not implemented yet.")
+        elif file_entry.type == "local":
+            raise NotImplementedError("Local file handling is not implemented yet.")
+        elif file_entry.type == "gitlab_release":
+            return self.handle_gitlab_release_file
+        elif file_entry.type == "gitlab_repo_archive":
+            return self.handle_gitlab_repo_archive
+        elif file_entry.type == "gitlab_packages":
+            return self.handle_gitlab_packages
+        else:
+            raise ValueError(f"Unsupported file type: {file_entry.type}")
 
     def handle_shared_files(self):
         """Handle all shared files in the current profile."""
-        for file_entry in self.build_context.profile.files.profile_shared_files:
-            if file_entry.type == "git":
-                raise NotImplementedError(
-                    "Git repository handling is not implemented yet."
-                )
-            elif file_entry.type == "local":
-                raise NotImplementedError("Local file handling is not implemented yet.")
-            elif file_entry.type == "gitlab_release":
-                self.handle_gitlab_release_file(file_entry)
-            elif file_entry.type == "gitlab_repo_archive":
-                self.handle_gitlab_repo_archive(file_entry)
-            elif file_entry.type == "gitlab_packages":
-                self.handle_gitlab_packages(file_entry)
-            else:
-                raise ValueError(f"Unsupported file type: {file_entry.type}")
+        try:
+            self._handle_shared_files()
+        finally:
+            self.unpin_all()
+
+    def _handle_shared_files(self):
+        file_entries = self.build_context.profile.files.profile_shared_files
+        tasks = [
+            partial(self.get_file_entry_handler(file_entry), file_entry)
+            for file_entry in file_entries
+        ]
+
+        # Apply results in config order so that the version hash is deterministic
+        shared_files = SharedFileResult()
+        for result in run_concurrently(tasks, self.max_workers):
+            shared_files.extend(result)
+        self.build_context.versions._versions.extend(shared_files.versions)
+
+        router_files = self.build_context.router_files
+        if self.profile_layers is None:
+            router_files.file_transfer_entries.extend(
+                shared_files.file_transfer_entries
+            )
+            return
+        router_files.base_layer = self.profile_layers.get_or_create(
+            self.build_context.profile,
+            self.build_context.versions._versions,
+            shared_files.file_transfer_entries,
+        )
@@ -0,0 +1,101 @@
+from typing import Optional
+
+import requests
+
+from ptah.contexts import AppContext, BuildContext
+from ptah.env import ENV
+from ptah.models import PortableMac, PtahProfile, RouterFilesOrganizer, Versions
+from ptah.utils.handle_router_specific_files import RouterSpecificFilesHandler
+from ptah.utils.handle_shared_files import SharedFilesHandler
+
+
+def new_build_context(
+    ctx: AppContext,
+    mac: PortableMac,
+    profile: PtahProfile,
+    secrets: dict,
+    config_generation: int,
+) -> BuildContext:
+    return BuildContext(
+        mac=mac,
+        profile=profile,
+        secrets=secrets,
+        versions=Versions(profile),
+        router_files=RouterFilesOrganizer(mac=mac),
+        config_generation=config_generation,
+        http=ctx.http,
+        gitlab_metadata=ctx.gitlab_metadata,
+        download_cache=ctx.download_cache,
+    )
+
+
+def is_vault_response(response: requests.Response) -> bool:
+    return str(response.url).startswith(str(ENV.vault_url).rstrip("/") + "/")
+
+
+def invalidate_rejected_vault_token(ctx: AppContext, secrets: dict, exc: Exception):
+    # Vault rejected the cached token, log in again on the next call. A 403 from
+    # GitLab (bad project token) says nothing about the Vault token.
+    if (
+        isinstance(exc, requests.HTTPError)
+        and exc.response is not None
+        and exc.response.status_code == 403
+        and is_vault_response(exc.response)
+    ):
+        ctx.vault_token_manager.invalidate(secrets.get("K8S_VAULT_TOKEN"))
+
+
+def resolve_shared_files(ctx: AppContext, build_context: BuildContext):
+    sfh = SharedFilesHandler(
+        build_context,
+        ENV.shared_files_concurrency,
+        ctx.profile_layers,
+        ctx.cache_manager,
+    )
+    try:
+        sfh.handle_shared_files()
+    except requests.HTTPError as exc:
+        invalidate_rejected_vault_token(ctx, build_context.secrets, exc)
+        raise
+
+
+def copy_shared_files(shared: BuildContext, build_context: BuildContext):
+    """Reuse the shared files resolved for another router of the same profile."""
+    build_context.versions._versions = list(shared.versions._versions)
+    build_context.router_files.base_layer = shared.router_files.base_layer
+    build_context.router_files.file_transfer_entries = list(
+        shared.router_files.file_transfer_entries
+    )
+
+
+def prepare_router(
+    ctx: AppContext,
+    build_context: BuildContext,
+    shared: Optional[BuildContext] = None,
+):
+    """
+    Prepare the files of a router and store its build context.
+    With `shared`, the shared files already resolved for that context are reused.
+    """
+    mac_fc = build_context.mac.to_filename_compliant()
+    with ctx.cache_manager.pinned(
+        ENV.routers_files_path / mac_fc, ENV.router_temporary_path / mac_fc
+    ):
+        if shared is None:
+            resolve_shared_files(ctx, build_context)
+        else:
+            copy_shared_files(shared, build_context)
+
+        hrsf = RouterSpecificFilesHandler(
+            build_context, ctx.vault_limiter, ctx.kv_secrets, ctx.certificates
+        )
+        try:
+            hrsf.handle_router_specific_files()
+        except requests.HTTPError as exc:
+            invalidate_rejected_vault_token(ctx, build_context.secrets, exc)
+            raise
+
+        build_context.router_files.merge_files_to_router_files()
+
+    # Only fully prepared routers can be built
+    ctx.build_contexts.put(build_context)
@@ -1,5 +1,7 @@
+import hashlib
 import os
-from typing import Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Optional, Dict, TypeVar
 from urllib.parse import urljoin
 from pathlib import Path
 from shutil import rmtree
@@ -7,11 +9,12 @@ from shutil import rmtree
 from pydantic import HttpUrl
 import yaml
 import zstandard as zstd
-import io
 import tarfile
 
 from ptah.models import PtahConfig, FileEntry, Credential
 
+T = TypeVar("T")
+
 
 def load_ptah_config(config_path: Path) -> PtahConfig:
     if not config_path.is_file():
@@ -26,12 +29,40 @@ def mac_to_filename_compliant(mac: str) -> str:
     return mac.replace(":", "-").replace("_", "-").replace(".", "_")
 
 
+def extract_tar_zst_stream(compressed_stream: BinaryIO, output_dir: Path):
+    """
+    Extract a .tar.zst stream (a file or an HTTP response body) into output_dir.
+    The archive is decompressed and extracted on the fly, so memory use is
+    bounded whatever its size.
+    """
+    dctx = zstd.ZstdDecompressor()
+    with dctx.stream_reader(compressed_stream) as reader:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            tar.extractall(path=output_dir, filter="tar")
+
+
 def extract_tar_zst(input_path: Path, output_dir: Path):
     with open(input_path, "rb") as compressed_file:
-        dctx = zstd.ZstdDecompressor()
-        with dctx.stream_reader(compressed_file) as reader:
-            with tarfile.open(fileobj=io.BytesIO(reader.read()), mode="r|") as tar:
-                tar.extractall(path=output_dir, filter="tar")
+        extract_tar_zst_stream(compressed_file, output_dir)
+
+
+def file_sha256(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def directory_sha256(path: Path) -> str:
+    """Digest of the relative paths and contents of the files under path."""
+    sha256 = hashlib.sha256()
+    for file_path in sorted(p for p in path.rglob("*") if p.is_file()):
+        sha256.update(str(file_path.relative_to(path)).encode("utf-8"))
+        sha256.update(b"\0")
+        sha256.update(file_sha256(file_path).encode("utf-8"))
+        sha256.update(b"\0")
+    return sha256.hexdigest()
 
 
 def build_git_http_url(url: HttpUrl, username: str, password: str) -> str:
@@ -87,3 +118,15 @@ def build_url(base_url: str, *parts: str) -> str:
     for part in parts:
         url = urljoin(url, part.strip("/") + "/")
     return url.rstrip("/")
+
+
+def run_concurrently(tasks: list[Callable[[], T]], max_workers: int) -> list[T]:
+    """
+    Run tasks on a bounded thread pool and return their results in input order.
+    The first exception raised by a task is re-raised.
+    """
+    if max_workers <= 1 or len(tasks) <= 1:
+        return [task() for task in tasks]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        return [future.result() for future in futures]
@@ -0,0 +1,8 @@
+import os
+import sys
+from pathlib import Path
+
+# ptah.env reads its settings at import time
+os.environ.setdefault("VAULT_TRANSIT_MOUNT", "transit")
+os.environ.setdefault("VAULT_TRANSIT_KEY", "ptah")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,69 @@
+import os
+import time
+
+from ptah.utils.ArtifactCache import ArtifactCache
+
+
+def make_binary(tmp_path, content=b"binary", name="sysupgrade.bin"):
+    # The cache hardlinks the binary, every build has its own output file
+    binary_path = tmp_path / name
+    binary_path.write_bytes(content)
+    return binary_path
+
+
+def test_hit_needs_same_version_files_digest_and_mac(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024**2, max_age=3600)
+    cache.put("v1", "digest1", "aa-bb", make_binary(tmp_path))
+
+    assert cache.get("v1", "digest1", "aa-bb") is not None
+    assert cache.get("v2", "digest1", "aa-bb") is None
+    assert cache.get("v1", "digest1", "cc-dd") is None
+
+
+def test_new_router_secrets_miss_the_old_binary(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024**2, max_age=3600)
+    cache.put("v1", "old-certificates", "aa-bb", make_binary(tmp_path))
+
+    # Same versions, certificates issued again by a new prepare
+    assert cache.get("v1", "new-certificates", "aa-bb") is None
+
+
+def test_log_is_stored_with_the_binary(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024**2, max_age=3600)
+    log_path = tmp_path / "build.log"
+    log_path.write_text("make image\n")
+    cache.put("v1", "digest1", "aa-bb", make_binary(tmp_path), log_path)
+
+    assert cache.get_log("v1", "digest1", "aa-bb").read_text() == "make image\n"
+    assert cache.get_log("v1", "digest2", "aa-bb") is None
+
+
+def test_expired_entry_is_removed(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=1024**2, max_age=60)
+    entry_path = cache.put("v1", "digest1", "aa-bb", make_binary(tmp_path))
+    stored_at = time.time() - 120
+    os.utime(entry_path, (stored_at, stored_at))
+
+    assert cache.get("v1", "digest1", "aa-bb") is None
+    assert not entry_path.exists()
+
+
+def test_evicts_least_recently_used_over_budget(tmp_path):
+    cache = ArtifactCache(
+        tmp_path / "cache", max_bytes=10, max_age=3600, eviction_grace=0
+    )
+    old_path = cache.put("v1", "d", "old", make_binary(tmp_path, b"x" * 8, "old.bin"))
+    used_at = time.time() - 100
+    os.utime(old_path, (used_at, used_at))
+    new_path = cache.put("v1", "d", "new", make_binary(tmp_path, b"y" * 8, "new.bin"))
+
+    assert not old_path.exists()
+    assert new_path.exists()
+
+
+def test_disabled_cache_passes_binaries_through(tmp_path):
+    cache = ArtifactCache(tmp_path / "cache", max_bytes=0, max_age=3600)
+    binary_path = make_binary(tmp_path)
+
+    assert cache.put("v1", "d", "aa-bb", binary_path) == binary_path
+    assert cache.get("v1", "d", "aa-bb") is None
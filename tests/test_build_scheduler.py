@@ -0,0 +1,209 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import ptah.utils.BuildScheduler as build_scheduler_module
+from ptah.env import ENV
+from ptah.models import BuildJobState, PortableMac
+from ptah.utils.ArtifactCache import ArtifactCache
+from ptah.utils.BuilderSlotPool import BuilderSlotPool
+from ptah.utils.BuildScheduler import BuildScheduler
+
+
+class FakeBuilds:
+    """Stands in for `make image`, builds block until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.running: list[str] = []
+        self.started: list[str] = []
+
+    def run_make_build(self, profile, mac, builder, files_path, output_path, on_line):
+        with self.lock:
+            self.running.append(profile.name)
+            self.started.append(profile.name)
+        try:
+            self.release.wait(5)
+            output_path.mkdir(parents=True, exist_ok=True)
+            binary_path = output_path / "sysupgrade.bin"
+            binary_path.write_bytes(mac.encode())
+            return binary_path
+        finally:
+            with self.lock:
+                self.running.remove(profile.name)
+
+
+@pytest.fixture
+def builds(tmp_path, monkeypatch):
+    monkeypatch.setattr(ENV, "routers_files_path", tmp_path / "routers_files")
+    monkeypatch.setattr(ENV, "output_path", tmp_path / "output")
+    fake_builds = FakeBuilds()
+    monkeypatch.setattr(
+        build_scheduler_module, "run_make_build", fake_builds.run_make_build
+    )
+    digests = {}
+    monkeypatch.setattr(
+        build_scheduler_module,
+        "router_files_digest",
+        lambda mac: digests.get(str(mac), ""),
+    )
+    monkeypatch.setattr(
+        build_scheduler_module,
+        "snapshot_router_files",
+        lambda mac, snapshot_path: (None, digests.get(str(mac), "")),
+    )
+    monkeypatch.setattr(
+        BuilderSlotPool,
+        "_clone_slot",
+        lambda self, pristine_path, slot_path: slot_path.mkdir(
+            parents=True, exist_ok=True
+        ),
+    )
+    monkeypatch.setattr(
+        "ptah.utils.BuilderSlotPool.get_builder_path", lambda openwrt_profile: tmp_path
+    )
+    fake_builds.digests = digests
+    yield fake_builds
+    fake_builds.release.set()
+
+
+def make_scheduler(tmp_path, max_workers=2, max_per_profile=2, max_slots=2):
+    return BuildScheduler(
+        ArtifactCache(tmp_path / "artifacts", max_bytes=1024**2, max_age=3600),
+        BuilderSlotPool(tmp_path / "slots", max_slots),
+        max_workers=max_workers,
+        max_per_profile=max_per_profile,
+        job_retention=3600,
+    )
+
+
+def make_profile(name, openwrt_version="23.05"):
+    return SimpleNamespace(
+        name=name,
+        openwrt_profile=SimpleNamespace(
+            openwrt_version=openwrt_version, target="mediatek", arch="aarch64"
+        ),
+    )
+
+
+def make_context(index, profile, version="v1"):
+    return SimpleNamespace(
+        mac=PortableMac(f"aa:bb:cc:dd:ee:{index:02x}"),
+        profile=profile,
+        final_version=version,
+    )
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_runs_at_most_max_per_profile(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path, max_workers=3, max_per_profile=1, max_slots=3)
+    profile = make_profile("a")
+    jobs = [scheduler.submit(make_context(i, profile)) for i in range(3)]
+
+    wait_until(lambda: len(builds.started) == 1)
+    time.sleep(0.1)
+    assert builds.running == ["a"]
+    assert scheduler.stats()["queued"] == 2
+
+    builds.release.set()
+    for job in jobs:
+        assert job.wait(5)
+        assert job.state == BuildJobState.DONE
+
+
+def test_profiles_sharing_a_builder_do_not_block_other_builders(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path, max_workers=2, max_per_profile=2, max_slots=1)
+    first = scheduler.submit(make_context(1, make_profile("a", "23.05")))
+    # Same builder as "a", which has a single slot
+    second = scheduler.submit(make_context(2, make_profile("b", "23.05")))
+    other = scheduler.submit(make_context(3, make_profile("c", "24.10")))
+
+    wait_until(lambda: len(builds.started) == 2)
+    time.sleep(0.1)
+    assert sorted(builds.running) == ["a", "c"]
+    assert scheduler.stats()["queued"] == 1
+
+    builds.release.set()
+    for job in (first, second, other):
+        assert job.wait(5)
+        assert job.state == BuildJobState.DONE
+    assert builds.started[-1] == "b"
+
+
+def test_runs_at_most_max_workers(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path, max_workers=2, max_per_profile=2, max_slots=2)
+    jobs = [
+        scheduler.submit(make_context(i, make_profile(f"p{i}", f"{i}")))
+        for i in range(4)
+    ]
+
+    wait_until(lambda: len(builds.started) == 2)
+    time.sleep(0.1)
+    assert len(builds.running) == 2
+
+    builds.release.set()
+    for job in jobs:
+        assert job.wait(5)
+    assert len(builds.started) == 4
+
+
+def test_cached_binary_is_served_without_a_build(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path)
+    builds.release.set()
+    context = make_context(1, make_profile("a"))
+    first = scheduler.submit(context)
+    assert first.wait(5)
+
+    second = scheduler.submit(context)
+    assert second.state == BuildJobState.DONE
+    assert second.artifact_path == first.artifact_path
+    assert builds.started == ["a"]
+
+
+def test_new_router_secrets_are_built_again(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path)
+    builds.release.set()
+    context = make_context(1, make_profile("a"))
+    builds.digests[str(context.mac)] = "old-certificates"
+    assert scheduler.submit(context).wait(5)
+
+    # Prepared again, same versions but new certificates
+    builds.digests[str(context.mac)] = "new-certificates"
+    job = scheduler.submit(context)
+    assert job.wait(5)
+    assert job.state == BuildJobState.DONE
+    assert builds.started == ["a", "a"]
+
+
+def test_unfinished_job_is_reused(tmp_path, builds):
+    scheduler = make_scheduler(tmp_path)
+    context = make_context(1, make_profile("a"))
+    first = scheduler.submit(context)
+
+    assert scheduler.submit(context) is first
+    builds.release.set()
+    assert first.wait(5)
+
+
+def test_files_prepared_again_fail_the_job(tmp_path, builds, monkeypatch):
+    monkeypatch.setattr(
+        build_scheduler_module,
+        "snapshot_router_files",
+        lambda mac, snapshot_path: ("v2", ""),
+    )
+    scheduler = make_scheduler(tmp_path)
+    job = scheduler.submit(make_context(1, make_profile("a"), version="v1"))
+
+    assert job.state == BuildJobState.FAILED
+    assert "prepared again" in job.error
+    assert builds.started == []
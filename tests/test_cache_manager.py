@@ -0,0 +1,121 @@
+import os
+import time
+
+from ptah.utils.CacheManager import CacheArea, CacheManager, directory_usage
+
+
+def make_entry(path, size, accessed_ago):
+    path.mkdir(parents=True)
+    (path / "file").write_bytes(b"x" * size)
+    accessed_at = time.time() - accessed_ago
+    os.utime(path, (accessed_at, accessed_at))
+    return path
+
+
+def make_manager(tmp_path, max_bytes, eviction_grace=0, marker=None):
+    manager = CacheManager(eviction_grace=eviction_grace, interval=0)
+    manager.add_area(CacheArea("area", tmp_path / "area", max_bytes, marker))
+    return manager
+
+
+def test_evicts_least_recently_used_until_in_budget(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=250)
+    oldest = make_entry(tmp_path / "area" / "oldest", 100, accessed_ago=300)
+    older = make_entry(tmp_path / "area" / "older", 100, accessed_ago=200)
+    recent = make_entry(tmp_path / "area" / "recent", 100, accessed_ago=100)
+
+    assert manager.evict() == {"area": 1}
+    assert not oldest.exists()
+    assert older.exists() and recent.exists()
+
+
+def test_recently_accessed_entries_are_kept(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1, eviction_grace=60)
+    old = make_entry(tmp_path / "area" / "old", 100, accessed_ago=120)
+    fresh = make_entry(tmp_path / "area" / "fresh", 100, accessed_ago=10)
+
+    manager.evict()
+    assert not old.exists()
+    assert fresh.exists()
+
+
+def test_pinned_entries_are_kept(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=300)
+
+    with manager.pinned(entry):
+        assert manager.evict() == {"area": 0}
+        assert entry.exists()
+    assert manager.evict() == {"area": 1}
+    assert not entry.exists()
+
+
+def test_pins_cover_parents_and_children(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1, marker=".complete")
+    entry = tmp_path / "area" / "release" / "v1"
+    make_entry(entry, 100, accessed_ago=300)
+    (entry / ".complete").touch()
+    old = time.time() - 300
+    os.utime(entry / ".complete", (old, old))
+
+    # A pin on a file inside the entry protects the entry
+    manager.pin(entry / "file")
+    assert manager.evict() == {"area": 0}
+    manager.unpin(entry / "file")
+    assert manager.evict() == {"area": 1}
+
+
+def test_pins_are_counted(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=300)
+
+    manager.pin(entry)
+    manager.pin(entry)
+    manager.unpin(entry)
+    assert manager.is_pinned(entry)
+    manager.unpin(entry)
+    assert not manager.is_pinned(entry)
+
+
+def test_cleanups_run_before_eviction(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=300)
+    manager.pin(entry)
+    manager.add_cleanup(lambda: manager.unpin(entry))
+
+    assert manager.evict() == {"area": 1}
+    assert not entry.exists()
+
+
+def test_failing_cleanup_does_not_stop_eviction(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=1)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=300)
+
+    def cleanup():
+        raise RuntimeError("boom")
+
+    manager.add_cleanup(cleanup)
+    assert manager.evict() == {"area": 1}
+    assert not entry.exists()
+
+
+def test_unlimited_area_is_never_evicted(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=0)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=300)
+
+    assert manager.evict() == {"area": 0}
+    assert entry.exists()
+
+
+def test_usage_counts_hardlinks_once_and_reports_shared_bytes(tmp_path):
+    manager = make_manager(tmp_path, max_bytes=0)
+    entry = make_entry(tmp_path / "area" / "entry", 100, accessed_ago=0)
+    (entry / "other").write_bytes(b"y" * 50)
+    # Linked twice inside the entry, and once from a layer outside it
+    os.link(entry / "other", entry / "other-link")
+    os.link(entry / "file", tmp_path / "layer-file")
+
+    assert directory_usage(entry) == (150, 100)
+    usage = manager.usage()["area"]
+    assert usage["bytes"] == 150
+    assert usage["shared_bytes"] == 100